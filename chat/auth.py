@@ -0,0 +1,49 @@
+from rest_framework import exceptions
+from rest_framework.settings import api_settings
+
+# Browsers cannot set headers on WebSockets, so they offer the subprotocols
+# ``access_token, <token>`` instead; the server only echoes the first.
+TOKEN_SUBPROTOCOL = 'access_token'
+
+
+def get_token_key(scope):
+    """
+    Return the access token of a WebSocket handshake, from an
+    ``Authorization: Bearer`` header or the ``TOKEN_SUBPROTOCOL`` pair.
+    Tokens in the URL are refused, they end up in access logs.
+    """
+    for name, value in scope.get('headers', []):
+        if name == b'authorization':
+            parts = value.decode('latin1').split()
+            if len(parts) == 2 and parts[0] == 'Bearer':
+                return parts[1]
+    subprotocols = scope.get('subprotocols', [])
+    if TOKEN_SUBPROTOCOL in subprotocols[:-1]:
+        return subprotocols[subprotocols.index(TOKEN_SUBPROTOCOL) + 1]
+    return None
+
+
+def get_subprotocol(scope):
+    """The subprotocol to accept the handshake with, if the client offered one."""
+    return TOKEN_SUBPROTOCOL if TOKEN_SUBPROTOCOL in scope.get('subprotocols', []) else None
+
+
+def authenticate_token(key):
+    """
+    Return the active user owning access token ``key``, or None. Tries the
+    configured REST framework authentication classes in order, so
+    WebSockets accept exactly the tokens the HTTP API does.
+    """
+    if not key:
+        return None
+    for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        authenticate_credentials = getattr(authentication_class(), 'authenticate_credentials', None)
+        if authenticate_credentials is None:
+            continue
+        try:
+            result = authenticate_credentials(key)
+        except exceptions.AuthenticationFailed:
+            return None
+        if result is not None:
+            return result[0]
+    return None
@@ -0,0 +1,263 @@
+import asyncio
+import json
+import logging
+import re
+from collections import deque
+from datetime import datetime
+
+from channels.exceptions import StopConsumer
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.conf import settings
+from django.utils import timezone
+
+from chat.auth import authenticate_token, get_subprotocol, get_token_key
+from chat.outbound import OutboundQueue, QueueOverflow, dropped_frames
+from chat.presence import presence
+from core.executors import run_in_executor
+from dream_chat import models as chat_models
+from dream_chat.history import get_cursor, get_history, get_room_id, recent_messages
+from dream_chat.writer import message_writer
+
+_logger = logging.getLogger(__name__)
+
+ROOM_NAME_RE = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+MAX_PRESENCE_QUERY = 100
+
+# Close codes in the 4000-4999 range are free for applications.
+CLOSE_UNAUTHORIZED = 4001
+CLOSE_SLOW_CONSUMER = 4008
+
+
+def group_name(room):
+    return 'chat.{}'.format(room)
+
+
+class ChatConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Chat over a WebSocket authenticated with an API access token, sent as
+    an ``Authorization: Bearer`` header or, from browsers, as the
+    subprotocols ``access_token, <token>``.
+
+    Clients send ``{"type": "join" | "leave", "room": ...}``,
+    ``{"type": "message", "room": ..., "text": ...}``,
+    ``{"type": "typing", "room": ...}``,
+    ``{"type": "history", "room": ..., "before": <message id>}`` and
+    ``{"type": "presence", "user_ids": [...]}``, and acknowledge what they
+    read with ``{"type": "ack", "received": <frames received so far>}``.
+    Only staff users may create a room by joining it; messages are limited
+    to ``CHAT_MAX_MESSAGE_LENGTH`` characters. Joining replies with the
+    room's recent messages and the ``history`` cursor of the messages
+    before them. Messages are encoded once by the sender and fanned out to
+    the room's group through the channel layer, so receivers only forward
+    the encoded frame; they are written to the database in batches by
+    ``message_writer``.
+
+    Outgoing frames go through a bounded ``OutboundQueue`` drained by a
+    task of their own, so a client that stops reading cannot stall the
+    consumer. The task stops handing frames to the ASGI server while the
+    client has ``CHAT_UNACKED_BYTES`` of them unacknowledged, as daphne
+    buffers whatever it is handed; frames then wait in the queue until
+    its overflow policy applies.
+    """
+    outbound = None
+    _sender = None
+
+    async def connect(self):
+        self.user = await run_in_executor('db', authenticate_token, get_token_key(self.scope))
+        # Joined room name -> room id.
+        self.rooms = {}
+        if self.user is None:
+            await self.close(code=CLOSE_UNAUTHORIZED)
+            return
+        self.outbound = OutboundQueue(settings.CHAT_OUTBOUND_QUEUE_SIZE, settings.CHAT_OUTBOUND_POLICY)
+        # Sizes of the frames sent and not acknowledged yet, oldest first.
+        self.unacked = deque()
+        self.unacked_bytes = 0
+        self.sent = 0
+        self.acked = 0
+        self._ack = asyncio.Event()
+        await self.accept(get_subprotocol(self.scope))
+        self._sender = asyncio.ensure_future(self.send_frames())
+        presence.connected(self.user.pk)
+
+    async def disconnect(self, code):
+        if self._sender is not None:
+            self._sender.cancel()
+        if self.outbound is not None:
+            self.outbound.clear()
+            self.outbound = None
+            presence.disconnected(self.user.pk)
+        for room in list(getattr(self, 'rooms', ())):
+            await self.leave(room)
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        if self.outbound is None or text_data is None or close:
+            await super(ChatConsumer, self).send(text_data, bytes_data, close)
+        else:
+            await self.enqueue(text_data)
+
+    async def send_json(self, content, close=False):
+        # The base class sends past our send(), keep replies in line.
+        await self.send(text_data=await self.encode_json(content), close=close)
+
+    async def enqueue(self, frame, coalesce_key=None):
+        try:
+            self.outbound.put(frame, coalesce_key)
+        except QueueOverflow:
+            await self.drop_slow_consumer()
+
+    async def send_frames(self):
+        while True:
+            frame = await self.outbound.get()
+            while self.unacked and self.unacked_bytes + len(frame) > settings.CHAT_UNACKED_BYTES:
+                self._ack.clear()
+                await self._ack.wait()
+            await super(ChatConsumer, self).send(text_data=frame)
+            # Frames are JSON encoded with ASCII only, characters are bytes.
+            self.unacked.append(len(frame))
+            self.unacked_bytes += len(frame)
+            self.sent += 1
+
+    async def ack(self, received):
+        if not isinstance(received, int) or not self.acked <= received <= self.sent:
+            await self.send_error('Invalid ack.')
+            return
+        while self.acked < received:
+            self.unacked_bytes -= self.unacked.popleft()
+            self.acked += 1
+        self._ack.set()
+
+    async def drop_slow_consumer(self):
+        _logger.warning('Disconnecting user {}, {} frames behind'.format(self.user.pk, len(self.outbound)))
+        dropped_frames.labels(reason='disconnect').inc(len(self.outbound))
+        await self.disconnect(CLOSE_SLOW_CONSUMER)
+        try:
+            # The socket is not draining, do not wait on it for long.
+            await asyncio.wait_for(self.close(code=CLOSE_SLOW_CONSUMER), timeout=1)
+        except asyncio.TimeoutError:
+            pass
+        raise StopConsumer()
+
+    async def receive_json(self, content, **kwargs):
+        if not isinstance(content, dict):
+            await self.send_error('Expected an object.')
+            return
+        message_type = content.get('type')
+        if message_type == 'ack':
+            await self.ack(content.get('received'))
+            return
+        if message_type == 'presence':
+            await self.send_presence(content.get('user_ids'))
+            return
+
+        room = content.get('room')
+        if not isinstance(room, str) or not ROOM_NAME_RE.match(room):
+            await self.send_error('Invalid room.')
+            return
+
+        if message_type == 'join':
+            await self.join(room)
+        elif message_type == 'leave':
+            await self.leave(room)
+        elif message_type == 'message':
+            await self.post(room, content.get('text'))
+        elif message_type == 'typing':
+            await self.typing(room)
+        elif message_type == 'history':
+            await self.history(room, content.get('before'))
+        else:
+            await self.send_error('Unknown message type.')
+
+    async def join(self, room):
+        if room not in self.rooms:
+            room_id = await run_in_executor('db', get_room_id, room, self.user.is_staff)
+            if room_id is None:
+                await self.send_error('Unknown room.')
+                return
+            await self.channel_layer.group_add(group_name(room), self.channel_name)
+            self.rooms[room] = room_id
+        recent = recent_messages.get(room)
+        sent_before = datetime.fromtimestamp(recent[0]['sent_at'], timezone.utc) if recent else None
+        cursor = await run_in_executor('db', get_cursor, self.rooms[room], sent_before)
+        await self.send_json({'type': 'joined', 'room': room, 'recent': recent, 'next': cursor})
+
+    async def leave(self, room):
+        if room in self.rooms:
+            await self.channel_layer.group_discard(group_name(room), self.channel_name)
+            del self.rooms[room]
+
+    async def post(self, room, text):
+        if room not in self.rooms:
+            await self.send_error('Join the room first.')
+            return
+        if not isinstance(text, str) or not text:
+            await self.send_error('Message text is required.')
+            return
+        if len(text) > settings.CHAT_MAX_MESSAGE_LENGTH:
+            await self.send_error('Messages are limited to {} characters.'.format(settings.CHAT_MAX_MESSAGE_LENGTH))
+            return
+        sent_at = timezone.now()
+        message = {
+            'type': 'message',
+            'room': room,
+            'user_id': self.user.pk,
+            'text': text,
+            'sent_at': sent_at.timestamp(),
+        }
+        message_writer.add(chat_models.Message(
+            room_id=self.rooms[room], user_id=self.user.pk, text=text, created_at=sent_at))
+        recent_messages.append(room, message)
+        frame = json.dumps(message)
+        await self.channel_layer.group_send(group_name(room), {'type': 'chat.message', 'frame': frame})
+
+    async def typing(self, room):
+        if room not in self.rooms:
+            await self.send_error('Join the room first.')
+            return
+        frame = json.dumps({'type': 'typing', 'room': room, 'user_id': self.user.pk})
+        await self.channel_layer.group_send(group_name(room), {
+            'type': 'chat.message',
+            'frame': frame,
+            # A reader that is behind only needs to know the user is still typing.
+            'coalesce_key': 'typing.{}.{}'.format(room, self.user.pk),
+        })
+
+    async def history(self, room, before):
+        if room not in self.rooms:
+            await self.send_error('Join the room first.')
+            return
+        if before is not None and not isinstance(before, int):
+            await self.send_error('Invalid cursor.')
+            return
+        messages, cursor = await run_in_executor('db', get_history, self.rooms[room], before)
+        await self.send_json({
+            'type': 'history',
+            'room': room,
+            'messages': [
+                {
+                    'id': message['id'],
+                    'user_id': message['user_id'],
+                    'text': message['text'],
+                    'sent_at': message['created_at'].timestamp(),
+                }
+                for message in messages
+            ],
+            'next': cursor,
+        })
+
+    async def send_presence(self, user_ids):
+        if not isinstance(user_ids, list) or len(user_ids) > MAX_PRESENCE_QUERY or \
+                not all(isinstance(user_id, int) and user_id >= 0 for user_id in user_ids):
+            await self.send_error('Expected up to {} user ids.'.format(MAX_PRESENCE_QUERY))
+            return
+        await self.send_json({
+            'type': 'presence',
+            'online': [user_id for user_id in user_ids if presence.is_online(user_id)],
+            'count': presence.count(),
+        })
+
+    async def chat_message(self, event):
+        await self.enqueue(event['frame'], event.get('coalesce_key'))
+
+    async def send_error(self, detail):
+        await self.send_json({'type': 'error', 'detail': detail})
@@ -0,0 +1,89 @@
+import asyncio
+import json
+import time
+
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+
+from chat.routing import application
+from core.loadtest import LoadResult
+from dream_chat import models as chat_models
+from dream_users import models as user_models
+from dream_users import utils as user_utils
+
+
+class Command(BaseCommand):
+    help = (
+        'Open many authenticated chat connections in one room through the ASGI '
+        'application and measure fan-out latency and delivered messages per second '
+        'on the configured channel layer.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=2000)
+        parser.add_argument('--messages', type=int, default=50)
+        parser.add_argument('--room', default='bench')
+        parser.add_argument('--email', default='bench-chat@example.com')
+
+    def handle(self, *args, **options):
+        user, _ = user_models.User.objects.get_or_create(
+            email=options['email'], defaults={'username': 'bench-chat'})
+        # Joining does not create rooms for regular users.
+        chat_models.Room.objects.get_or_create(name=options['room'])
+        access_token, _ = user_utils.issue_access_token(user, device_id='bench-chat')
+        try:
+            loop = asyncio.get_event_loop()
+            loop.run_until_complete(self.run(access_token, options))
+        finally:
+            user_models.Token.objects.filter(user=user).delete()
+
+    async def connect(self, access_token, room):
+        communicator = WebsocketCommunicator(
+            application, '/ws/chat/', headers=[(b'authorization', 'Bearer {}'.format(access_token).encode())])
+        connected, _ = await communicator.connect(timeout=30)
+        if not connected:
+            raise RuntimeError('Chat connection was refused')
+        await communicator.send_json_to({'type': 'join', 'room': room})
+        await communicator.receive_json_from(timeout=30)
+        return communicator
+
+    async def run(self, access_token, options):
+        room = options['room']
+        start = time.perf_counter()
+        communicators = await asyncio.gather(*[
+            self.connect(access_token, room) for _ in range(options['connections'])
+        ])
+        self.stdout.write('{} connections joined in {:.1f} s'.format(
+            len(communicators), time.perf_counter() - start))
+
+        sender = communicators[0]
+        latencies = []
+        start = time.perf_counter()
+        for i in range(options['messages']):
+            sent_at = time.perf_counter()
+            await sender.send_json_to({'type': 'message', 'room': room, 'text': 'bench {}'.format(i)})
+            frames = await asyncio.gather(*[
+                communicator.receive_from(timeout=30) for communicator in communicators
+            ])
+            latencies.append(time.perf_counter() - sent_at)
+            assert all(json.loads(frame)['text'] == 'bench {}'.format(i) for frame in frames)
+            # The join reply and the messages so far.
+            await asyncio.gather(*[
+                communicator.send_json_to({'type': 'ack', 'received': i + 2}) for communicator in communicators
+            ])
+        result = LoadResult(latencies, 0, time.perf_counter() - start)
+
+        await asyncio.gather(*[communicator.disconnect() for communicator in communicators])
+
+        delivered = len(communicators) * options['messages']
+        self.stdout.write(
+            '{delivered} messages delivered, {rate:.0f} msg/s, fan-out to {connections} connections: '
+            'p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms'.format(
+                delivered=delivered,
+                rate=delivered / result.elapsed,
+                connections=len(communicators),
+                p50=result.percentile(50) * 1000,
+                p95=result.percentile(95) * 1000,
+                p99=result.percentile(99) * 1000,
+            )
+        )
@@ -0,0 +1,161 @@
+import asyncio
+import gc
+import json
+import tracemalloc
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from chat.consumers import ChatConsumer, group_name
+from chat.outbound import POLICIES, dropped_frames, queued_frames
+from dream_chat import models as chat_models
+from dream_users import models as user_models
+from dream_users import utils as user_utils
+
+
+class Client(object):
+    """
+    ASGI side of one connection behind a server that, like daphne, accepts
+    every send at once. A stalled client never reads, so the server keeps
+    its frames buffered; a healthy one acknowledges every frame.
+    """
+
+    def __init__(self, stalled):
+        self.stalled = stalled
+        self.inbox = asyncio.Queue()
+        self.accepted = asyncio.Event()
+        self.closed = False
+        self.received = 0
+        self.buffered = []
+
+    async def receive(self):
+        return await self.inbox.get()
+
+    async def send(self, message):
+        if message['type'] == 'websocket.accept':
+            self.accepted.set()
+        elif message['type'] == 'websocket.close':
+            self.closed = True
+        elif self.stalled:
+            self.buffered.append(message['text'])
+        else:
+            self.received += 1
+            self.send_to_server({'type': 'ack', 'received': self.received})
+
+    def send_to_server(self, content):
+        self.inbox.put_nowait({'type': 'websocket.receive', 'text': json.dumps(content)})
+
+
+class Command(BaseCommand):
+    help = (
+        'Fan chat messages out to healthy and stalled connections and check that '
+        'memory stays flat under the configured outbound queue policy.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--healthy', type=int, default=50)
+        parser.add_argument('--stalled', type=int, default=50)
+        parser.add_argument('--messages', type=int, default=5000)
+        parser.add_argument('--policy', choices=POLICIES)
+        parser.add_argument('--queue-size', type=int)
+        parser.add_argument('--max-growth-kb', type=int, default=512,
+                            help='Fail if memory grows more than this over the second half of the run.')
+        parser.add_argument('--room', default='bench-backpressure')
+        parser.add_argument('--email', default='bench-chat@example.com')
+
+    def handle(self, *args, **options):
+        overrides = {}
+        if options['policy']:
+            overrides['CHAT_OUTBOUND_POLICY'] = options['policy']
+        if options['queue_size']:
+            overrides['CHAT_OUTBOUND_QUEUE_SIZE'] = options['queue_size']
+
+        user, _ = user_models.User.objects.get_or_create(
+            email=options['email'], defaults={'username': 'bench-chat'})
+        # Joining does not create rooms for regular users.
+        chat_models.Room.objects.get_or_create(name=options['room'])
+        access_token, _ = user_utils.issue_access_token(user, device_id='bench-chat-backpressure')
+        try:
+            with override_settings(**overrides):
+                loop = asyncio.get_event_loop()
+                loop.run_until_complete(self.run(access_token, options))
+        finally:
+            user_models.Token.objects.filter(user=user).delete()
+
+    async def connect(self, access_token, room, stalled):
+        client = Client(stalled)
+        scope = {
+            'type': 'websocket',
+            'path': '/ws/chat/',
+            'headers': [(b'authorization', 'Bearer {}'.format(access_token).encode())],
+            'query_string': b'',
+        }
+        client.task = asyncio.ensure_future(ChatConsumer(scope)(client.receive, client.send))
+        client.inbox.put_nowait({'type': 'websocket.connect'})
+        await asyncio.wait_for(client.accepted.wait(), timeout=30)
+        client.send_to_server({'type': 'join', 'room': room})
+        return client
+
+    async def run(self, access_token, options):
+        room = options['room']
+        clients = await asyncio.gather(*(
+            [self.connect(access_token, room, stalled=False) for _ in range(options['healthy'])] +
+            [self.connect(access_token, room, stalled=True) for _ in range(options['stalled'])]
+        ))
+        healthy = [client for client in clients if not client.stalled]
+        # Let the joins land before publishing.
+        while any(client.received == 0 for client in healthy):
+            await asyncio.sleep(0.01)
+
+        layer = get_channel_layer()
+        dropped_before = {labels['reason']: child.value for labels, child in dropped_frames.samples()}
+        tracemalloc.start()
+        samples = []
+        num_messages = options['messages']
+        for i in range(num_messages):
+            frame = json.dumps({'type': 'message', 'room': room, 'user_id': 0, 'text': 'x' * 100, 'seq': i})
+            await layer.group_send(group_name(room), {'type': 'chat.message', 'frame': frame})
+            if i % 100 == 99:
+                # Healthy clients keep up, so every backlog left is a stalled one's.
+                target = i + 2
+                while any(client.received < target for client in healthy):
+                    await asyncio.sleep(0)
+                gc.collect()
+                samples.append(tracemalloc.get_traced_memory()[0])
+        tracemalloc.stop()
+
+        for client in clients:
+            client.inbox.put_nowait({'type': 'websocket.disconnect', 'code': 1000})
+        await asyncio.wait([client.task for client in clients], timeout=10)
+
+        dropped = {
+            labels['reason']: child.value - dropped_before.get(labels['reason'], 0)
+            for labels, child in dropped_frames.samples()
+        }
+        closed = sum(client.closed for client in clients if client.stalled)
+        buffered = max(sum(len(frame) for frame in client.buffered) for client in clients)
+        half = samples[len(samples) // 2] if samples else 0
+        growth = (samples[-1] - half) if samples else 0
+        self.stdout.write(
+            '{messages} messages to {healthy} healthy and {stalled} stalled connections: '
+            'memory {start:.0f} KB -> {half:.0f} KB -> {end:.0f} KB, dropped {dropped}, '
+            '{closed} stalled connections closed, {queued} frames still queued, '
+            'at most {buffered:.0f} KB buffered by the server for one connection'.format(
+                messages=num_messages,
+                healthy=len(healthy),
+                stalled=len(clients) - len(healthy),
+                start=samples[0] / 1024 if samples else 0,
+                half=half / 1024,
+                end=samples[-1] / 1024 if samples else 0,
+                dropped=dropped,
+                closed=closed,
+                queued=queued_frames.value,
+                buffered=buffered / 1024,
+            )
+        )
+        if buffered > settings.CHAT_UNACKED_BYTES:
+            raise CommandError('The server buffered {:.0f} KB for one connection'.format(buffered / 1024))
+        if growth > options['max_growth_kb'] * 1024:
+            raise CommandError('Memory grew {:.0f} KB over the second half of the run'.format(growth / 1024))
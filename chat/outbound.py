@@ -0,0 +1,92 @@
+"""
+Bounded outbound frame queues for WebSocket connections.
+
+Each chat connection queues frames here and a per connection task hands
+them to the ASGI server while the client has acknowledged all but
+``CHAT_UNACKED_BYTES`` of what it was sent. Daphne accepts every send at
+once and buffers unsent frames in its transport, so without that window a
+client that stops reading would grow the server's buffer without limit;
+with it, the client holds at most ``CHAT_UNACKED_BYTES`` there and
+``max_size`` frames here. When the queue is full:
+
+``drop_oldest``
+    the oldest queued frame is discarded;
+``coalesce``
+    the oldest queued frame is discarded too, but a frame with a coalesce
+    key, such as a typing notification, replaces a queued frame with the
+    same key whether the queue is full or not;
+``disconnect``
+    ``QueueOverflow`` is raised and the connection is closed.
+"""
+import asyncio
+import itertools
+from collections import OrderedDict
+
+from core import metrics
+
+POLICY_DROP_OLDEST = 'drop_oldest'
+POLICY_COALESCE = 'coalesce'
+POLICY_DISCONNECT = 'disconnect'
+POLICIES = (POLICY_DROP_OLDEST, POLICY_COALESCE, POLICY_DISCONNECT)
+
+queued_frames = metrics.gauge(
+    'chat_outbound_queued_frames',
+    'Frames waiting in outbound WebSocket queues of this process.',
+)
+dropped_frames = metrics.counter(
+    'chat_outbound_dropped_total',
+    'Outbound WebSocket frames dropped, by reason.',
+    labelnames=('reason',),
+)
+
+
+class QueueOverflow(Exception):
+    pass
+
+
+class OutboundQueue(object):
+
+    def __init__(self, max_size, policy):
+        if policy not in POLICIES:
+            raise ValueError('Unknown outbound queue policy {}'.format(policy))
+        self.max_size = max_size
+        self.policy = policy
+        self._frames = OrderedDict()
+        self._seq = itertools.count()
+        self._ready = asyncio.Event()
+
+    def __len__(self):
+        return len(self._frames)
+
+    def put(self, frame, coalesce_key=None):
+        if self.policy == POLICY_COALESCE and coalesce_key is not None:
+            key = ('coalesce', coalesce_key)
+            if key in self._frames:
+                # Keep the older frame's place in line, deliver the newer state.
+                self._frames[key] = frame
+                dropped_frames.labels(reason='coalesced').inc()
+                return
+        else:
+            key = ('seq', next(self._seq))
+
+        if len(self._frames) >= self.max_size:
+            if self.policy == POLICY_DISCONNECT:
+                raise QueueOverflow()
+            self._frames.popitem(last=False)
+            queued_frames.dec()
+            dropped_frames.labels(reason='overflow').inc()
+
+        self._frames[key] = frame
+        queued_frames.inc()
+        self._ready.set()
+
+    async def get(self):
+        while not self._frames:
+            self._ready.clear()
+            await self._ready.wait()
+        queued_frames.dec()
+        return self._frames.popitem(last=False)[1]
+
+    def clear(self):
+        queued_frames.dec(len(self._frames))
+        self._frames.clear()
@@ -0,0 +1,205 @@
+"""
+Who is online, per process, kept in sync through the channel layer.
+
+Online user ids live in two generations of bitmaps, one bit per user id.
+A heartbeat sets the user's bit in the current generation; every
+``PRESENCE_TTL / 2`` seconds the current generation becomes the previous
+one and a fresh one starts, so a user without heartbeats drops out after
+between half and all of ``PRESENCE_TTL``. Membership and the online count
+are O(1); a million user ids take 250 KB.
+
+Every process heartbeats the users holding chat connections to it each
+``PRESENCE_SYNC_INTERVAL`` and broadcasts them, with the users whose last
+local connection closed, in one message to the ``presence`` group. From
+its first chat connection on, a process listens to the group for the rest
+of its life, whether or not it still has users of its own. Users of a
+process that dies expire on their own.
+"""
+import asyncio
+import logging
+import threading
+import time
+from array import array
+from collections import Counter
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from core import metrics
+
+_logger = logging.getLogger(__name__)
+
+GROUP = 'presence'
+
+online_users = metrics.gauge(
+    'presence_online_users',
+    'Users seen online by this process.',
+)
+
+
+class PresenceBitmap(object):
+
+    def __init__(self, ttl, clock=time.monotonic):
+        self.window = ttl / 2.0
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._current = bytearray()
+        self._previous = bytearray()
+        self._current_count = 0
+        self._count = 0
+        self._rotated_at = clock()
+
+    @staticmethod
+    def _test(bitmap, user_id):
+        index = user_id >> 3
+        return index < len(bitmap) and bool(bitmap[index] >> (user_id & 7) & 1)
+
+    @staticmethod
+    def _set(bitmap, user_id):
+        index = user_id >> 3
+        if index >= len(bitmap):
+            # Grow in 4 KB steps rather than a byte at a time.
+            bitmap.extend(bytes((index // 4096 + 1) * 4096 - len(bitmap)))
+        bitmap[index] |= 1 << (user_id & 7)
+
+    @staticmethod
+    def _clear(bitmap, user_id):
+        index = user_id >> 3
+        if index < len(bitmap):
+            bitmap[index] &= ~(1 << (user_id & 7)) & 0xff
+
+    def _rotate(self):
+        elapsed = self._clock() - self._rotated_at
+        if elapsed < self.window:
+            return
+        if elapsed < 2 * self.window:
+            self._previous, self._count = self._current, self._current_count
+        else:
+            self._previous, self._count = bytearray(), 0
+        self._current, self._current_count = bytearray(len(self._previous)), 0
+        self._rotated_at = self._clock()
+
+    def add(self, user_id):
+        with self._lock:
+            self._rotate()
+            if self._test(self._current, user_id):
+                return
+            self._set(self._current, user_id)
+            self._current_count += 1
+            if not self._test(self._previous, user_id):
+                self._count += 1
+
+    def discard(self, user_id):
+        with self._lock:
+            self._rotate()
+            in_current = self._test(self._current, user_id)
+            in_previous = self._test(self._previous, user_id)
+            if in_current:
+                self._clear(self._current, user_id)
+                self._current_count -= 1
+            if in_previous:
+                self._clear(self._previous, user_id)
+            if in_current or in_previous:
+                self._count -= 1
+
+    def __contains__(self, user_id):
+        with self._lock:
+            self._rotate()
+            return self._test(self._current, user_id) or self._test(self._previous, user_id)
+
+    def __len__(self):
+        with self._lock:
+            self._rotate()
+            return self._count
+
+
+def _pack(user_ids):
+    return array('I', user_ids).tobytes()
+
+
+def _unpack(data):
+    user_ids = array('I')
+    user_ids.frombytes(data)
+    return user_ids
+
+
+class Presence(object):
+
+    def __init__(self, ttl, sync_interval):
+        self.online = PresenceBitmap(ttl)
+        self.sync_interval = sync_interval
+        # User id -> chat connections open to this process.
+        self._local = Counter()
+        self._gone = set()
+        self._task = None
+
+    def connected(self, user_id):
+        self._local[user_id] += 1
+        self.online.add(user_id)
+        self._ensure_syncing()
+
+    def disconnected(self, user_id):
+        self._local[user_id] -= 1
+        if self._local[user_id] <= 0:
+            del self._local[user_id]
+            self.online.discard(user_id)
+            self._gone.add(user_id)
+
+    def is_online(self, user_id):
+        return user_id in self.online
+
+    def count(self):
+        return len(self.online)
+
+    def _ensure_syncing(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._sync())
+
+    async def _sync(self):
+        layer = get_channel_layer()
+        channel = await layer.new_channel('presence.')
+        receiver = asyncio.ensure_future(self._receive(layer, channel))
+        try:
+            while True:
+                if receiver.done():
+                    _logger.error('Presence receiver stopped, restarting', exc_info=receiver.exception())
+                    receiver = asyncio.ensure_future(self._receive(layer, channel))
+                # Re-joining also renews the group membership's expiry.
+                await layer.group_add(GROUP, channel)
+                if self._local or self._gone:
+                    local = list(self._local)
+                    for user_id in local:
+                        self.online.add(user_id)
+                    gone, self._gone = [user_id for user_id in self._gone if user_id not in self._local], set()
+                    await layer.group_send(GROUP, {
+                        'type': 'presence.sync',
+                        'origin': channel,
+                        'online': _pack(local),
+                        'offline': _pack(gone),
+                    })
+                await asyncio.sleep(self.sync_interval)
+        finally:
+            receiver.cancel()
+            await layer.group_discard(GROUP, channel)
+
+    async def _receive(self, layer, channel):
+        while True:
+            message = await layer.receive(channel)
+            if message.get('origin') == channel:
+                continue
+            for user_id in _unpack(message['offline']):
+                # Connected here, whatever another process saw.
+                if user_id not in self._local:
+                    self.online.discard(user_id)
+            for user_id in _unpack(message['online']):
+                self.online.add(user_id)
+
+
+presence = Presence(settings.PRESENCE_TTL, settings.PRESENCE_SYNC_INTERVAL)
+
+
+def _collect():
+    online_users.set(presence.count())
+
+
+metrics.register_collector(_collect)
@@ -1,5 +1,18 @@
-from channels.routing import ProtocolTypeRouter
+from channels.http import AsgiHandler
+from channels.routing import ProtocolTypeRouter, URLRouter
+from django.urls import path, re_path
+
+from chat import consumers as chat_consumers
+from dream_users.routing import http_urlpatterns as user_http_urlpatterns
+
+websocket_urlpatterns = [
+    path('ws/chat/', chat_consumers.ChatConsumer),
+]
 
 application = ProtocolTypeRouter({
-    # Empty for now (http->django views is added by default)
+    # Async endpoints first, everything else falls through to the Django views.
+    'http': URLRouter(user_http_urlpatterns + [
+        re_path(r'', AsgiHandler),
+    ]),
+    'websocket': URLRouter(websocket_urlpatterns),
 })
@@ -1,3 +1,358 @@
-from django.test import TestCase
+import asyncio
+import json
+from datetime import timedelta
 
-# Create your tests here.
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from chat.auth import TOKEN_SUBPROTOCOL
+from chat.consumers import CLOSE_SLOW_CONSUMER, CLOSE_UNAUTHORIZED, ChatConsumer
+from chat.outbound import OutboundQueue, QueueOverflow
+from chat.presence import GROUP, Presence, PresenceBitmap, _pack
+from dream_chat import models as chat_models
+from dream_chat.writer import message_writer
+from dream_users import models as user_models
+from dream_users import utils as user_utils
+
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+class ChatTestCase(TransactionTestCase):
+
+    def setUp(self):
+        self.user = user_models.User.objects.create(email='chat@example.com', username='chat')
+        self.access_token, _ = user_utils.issue_access_token(self.user)
+        self.communicators = []
+        self.addCleanup(self.disconnect_all)
+        # Messages left unwritten would outlive the test database.
+        self.addCleanup(message_writer.drain)
+
+    def disconnect_all(self):
+        for communicator in self.communicators:
+            run(communicator.disconnect())
+
+    async def connect(self):
+        communicator = WebsocketCommunicator(
+            ChatConsumer, '/ws/chat/', headers=[(b'authorization', 'Bearer {}'.format(self.access_token).encode())])
+        connected, _ = await communicator.connect(timeout=5)
+        self.assertTrue(connected)
+        self.communicators.append(communicator)
+        return communicator
+
+    async def request(self, communicator, content):
+        await communicator.send_json_to(content)
+        return await self.receive(communicator)
+
+    async def receive(self, communicator):
+        content = await communicator.receive_json_from(timeout=5)
+        communicator.received = getattr(communicator, 'received', 0) + 1
+        await communicator.send_json_to({'type': 'ack', 'received': communicator.received})
+        return content
+
+
+class ChatConsumerTests(ChatTestCase):
+
+    def test_invalid_token_is_refused(self):
+        async def connect():
+            communicator = WebsocketCommunicator(ChatConsumer, '/ws/chat/', headers=[(b'authorization', b'Bearer x')])
+            return await communicator.connect(timeout=5)
+
+        self.assertEqual(run(connect()), (False, CLOSE_UNAUTHORIZED))
+
+    def test_token_in_query_string_is_refused(self):
+        async def connect():
+            communicator = WebsocketCommunicator(ChatConsumer, '/ws/chat/?token={}'.format(self.access_token))
+            return await communicator.connect(timeout=5)
+
+        self.assertEqual(run(connect()), (False, CLOSE_UNAUTHORIZED))
+
+    def test_token_subprotocol_is_accepted(self):
+        async def connect():
+            communicator = WebsocketCommunicator(
+                ChatConsumer, '/ws/chat/', subprotocols=[TOKEN_SUBPROTOCOL, self.access_token])
+            self.communicators.append(communicator)
+            return await communicator.connect(timeout=5)
+
+        # The token itself must not be echoed back in the handshake.
+        self.assertEqual(run(connect()), (True, TOKEN_SUBPROTOCOL))
+
+    def test_message_reaches_every_member_of_the_room(self):
+        room = chat_models.Room.objects.create(name='fan-out')
+
+        async def scenario():
+            sender, receiver, outsider = await self.connect(), await self.connect(), await self.connect()
+            await self.request(sender, {'type': 'join', 'room': room.name})
+            await self.request(receiver, {'type': 'join', 'room': room.name})
+            echo = await self.request(sender, {'type': 'message', 'room': room.name, 'text': 'hello'})
+            received = await self.receive(receiver)
+            refused = await self.request(outsider, {'type': 'message', 'room': room.name, 'text': 'hello'})
+            return echo, received, refused, await outsider.receive_nothing()
+
+        echo, received, refused, outsider_idle = run(scenario())
+        self.assertEqual(echo, received)
+        self.assertEqual((received['text'], received['user_id']), ('hello', self.user.pk))
+        self.assertEqual(refused, {'type': 'error', 'detail': 'Join the room first.'})
+        self.assertTrue(outsider_idle)
+
+    def test_invalid_room_name_is_refused(self):
+        async def scenario():
+            communicator = await self.connect()
+            return await self.request(communicator, {'type': 'join', 'room': '../etc'})
+
+        self.assertEqual(run(scenario()), {'type': 'error', 'detail': 'Invalid room.'})
+
+
+class ChatHistoryTests(ChatTestCase):
+
+    def test_join_returns_the_cursor_before_recent_messages(self):
+        room = chat_models.Room.objects.create(name='history-cursor')
+        older = chat_models.Message.objects.create(
+            room=room, user=self.user, text='older', created_at=timezone.now() - timedelta(hours=1))
+
+        async def scenario():
+            sender = await self.connect()
+            await self.request(sender, {'type': 'join', 'room': room.name})
+            await self.request(sender, {'type': 'message', 'room': room.name, 'text': 'recent'})
+            message_writer.flush()
+
+            reader = await self.connect()
+            joined = await self.request(reader, {'type': 'join', 'room': room.name})
+            history = await self.request(reader, {'type': 'history', 'room': room.name, 'before': joined['next']})
+            return joined, history
+
+        joined, history = run(scenario())
+        self.assertEqual(chat_models.Message.objects.filter(room=room).count(), 2)
+        self.assertEqual([message['text'] for message in joined['recent']], ['recent'])
+        self.assertEqual([message['id'] for message in history['messages']], [older.pk])
+        self.assertIsNone(history['next'])
+
+
+class ChatRoomTests(ChatTestCase):
+
+    def test_only_staff_create_rooms(self):
+        async def join():
+            communicator = await self.connect()
+            return await self.request(communicator, {'type': 'join', 'room': 'new-room'})
+
+        self.assertEqual(run(join()), {'type': 'error', 'detail': 'Unknown room.'})
+        self.assertFalse(chat_models.Room.objects.exists())
+
+        self.user.is_staff = True
+        self.user.save()
+        self.assertEqual(run(join())['type'], 'joined')
+        self.assertTrue(chat_models.Room.objects.filter(name='new-room').exists())
+
+    def test_long_message_is_refused(self):
+        room = chat_models.Room.objects.create(name='long-messages')
+
+        async def post(text):
+            communicator = await self.connect()
+            await self.request(communicator, {'type': 'join', 'room': room.name})
+            return await self.request(communicator, {'type': 'message', 'room': room.name, 'text': text})
+
+        self.assertEqual(run(post('x' * (settings.CHAT_MAX_MESSAGE_LENGTH + 1)))['type'], 'error')
+        self.assertEqual(run(post('x' * settings.CHAT_MAX_MESSAGE_LENGTH))['type'], 'message')
+
+
+class OutboundQueueTests(SimpleTestCase):
+
+    def drain(self, queue):
+        return [run(queue.get()) for _ in range(len(queue))]
+
+    def test_drop_oldest(self):
+        queue = OutboundQueue(2, 'drop_oldest')
+        for frame in ('a', 'b', 'c'):
+            queue.put(frame)
+        self.assertEqual(self.drain(queue), ['b', 'c'])
+
+    def test_coalesce_keeps_the_place_of_the_first_frame(self):
+        queue = OutboundQueue(3, 'coalesce')
+        queue.put('typing-1', 'typing')
+        queue.put('message')
+        queue.put('typing-2', 'typing')
+        queue.put('typing-3', 'typing')
+        self.assertEqual(self.drain(queue), ['typing-3', 'message'])
+
+    def test_disconnect(self):
+        queue = OutboundQueue(1, 'disconnect')
+        queue.put('a')
+        with self.assertRaises(QueueOverflow):
+            queue.put('b')
+
+
+class StalledClient(object):
+    """
+    ASGI side of a connection whose client stopped reading, behind a server
+    that, like daphne, accepts every send at once and buffers the frame.
+    """
+
+    def __init__(self):
+        self.inbox = asyncio.Queue()
+        self.accepted = asyncio.Event()
+        self.close_code = None
+        self.buffered = []
+
+    async def receive(self):
+        return await self.inbox.get()
+
+    async def send(self, message):
+        if message['type'] == 'websocket.accept':
+            self.accepted.set()
+        elif message['type'] == 'websocket.close':
+            self.close_code = message.get('code')
+        else:
+            self.buffered.append(message['text'])
+
+    def send_to_server(self, content):
+        self.inbox.put_nowait({'type': 'websocket.receive', 'text': json.dumps(content)})
+
+
+class SlowConsumerTests(ChatTestCase):
+
+    def setUp(self):
+        super(SlowConsumerTests, self).setUp()
+        # Rooms keep their recent messages between tests.
+        self.room = chat_models.Room.objects.create(name=self._testMethodName[:64])
+
+    async def connect_stalled(self):
+        client = StalledClient()
+        scope = {
+            'type': 'websocket',
+            'path': '/ws/chat/',
+            'headers': [(b'authorization', 'Bearer {}'.format(self.access_token).encode())],
+            'query_string': b'',
+        }
+        consumer = ChatConsumer(scope)
+        client.task = asyncio.ensure_future(consumer(client.receive, client.send))
+        self.addCleanup(self.disconnect_stalled, client)
+        client.inbox.put_nowait({'type': 'websocket.connect'})
+        await asyncio.wait_for(client.accepted.wait(), timeout=5)
+        client.send_to_server({'type': 'join', 'room': self.room.name})
+        while self.room.name not in consumer.rooms:
+            await asyncio.sleep(0.01)
+        return client, consumer
+
+    def disconnect_stalled(self, client):
+        if not client.task.done():
+            client.inbox.put_nowait({'type': 'websocket.disconnect', 'code': 1000})
+            run(asyncio.wait_for(client.task, timeout=5))
+
+    @override_settings(CHAT_UNACKED_BYTES=1000, CHAT_OUTBOUND_QUEUE_SIZE=5)
+    def test_server_buffers_only_unacknowledged_bytes(self):
+        async def scenario():
+            client, _ = await self.connect_stalled()
+            sender = await self.connect()
+            await self.request(sender, {'type': 'join', 'room': self.room.name})
+            for i in range(50):
+                await self.request(sender, {'type': 'message', 'room': self.room.name, 'text': 'x' * 100})
+            buffered = len(client.buffered)
+            self.assertLessEqual(sum(len(frame) for frame in client.buffered), 1000)
+            client.send_to_server({'type': 'ack', 'received': buffered})
+            await asyncio.sleep(0.05)
+            return buffered, len(client.buffered)
+
+        before, after = run(scenario())
+        self.assertGreater(after, before)
+
+    @override_settings(CHAT_OUTBOUND_POLICY='coalesce', CHAT_OUTBOUND_QUEUE_SIZE=10, CHAT_UNACKED_BYTES=1)
+    def test_typing_notifications_coalesce_for_a_slow_reader(self):
+        async def scenario():
+            _, reader = await self.connect_stalled()
+            typist = await self.connect()
+            await self.request(typist, {'type': 'join', 'room': self.room.name})
+            for _ in range(20):
+                await self.request(typist, {'type': 'typing', 'room': self.room.name})
+            await self.request(typist, {'type': 'message', 'room': self.room.name, 'text': 'hello'})
+            # The join reply went to the server, the rest waits in the queue.
+            return [json.loads(frame)['type'] for frame in reader.outbound._frames.values()]
+
+        self.assertEqual(run(scenario()), ['typing', 'message'])
+
+    @override_settings(CHAT_OUTBOUND_POLICY='disconnect', CHAT_OUTBOUND_QUEUE_SIZE=5, CHAT_UNACKED_BYTES=1)
+    def test_reader_that_falls_behind_is_disconnected(self):
+        async def scenario():
+            client, _ = await self.connect_stalled()
+            sender = await self.connect()
+            await self.request(sender, {'type': 'join', 'room': self.room.name})
+            for i in range(10):
+                await self.request(sender, {'type': 'message', 'room': self.room.name, 'text': str(i)})
+            await asyncio.wait_for(client.task, timeout=5)
+            return client
+
+        with self.assertLogs('chat.consumers', 'WARNING'):
+            client = run(scenario())
+        self.assertEqual(client.close_code, CLOSE_SLOW_CONSUMER)
+
+
+class PresenceBitmapTests(SimpleTestCase):
+
+    def setUp(self):
+        self.now = 0
+        self.online = PresenceBitmap(ttl=60, clock=lambda: self.now)
+
+    def test_heartbeat_keeps_a_user_online_for_the_ttl(self):
+        self.online.add(3)
+        self.online.add(70000)
+        self.assertEqual(len(self.online), 2)
+        self.now = 31
+        self.online.add(70000)
+        self.assertIn(3, self.online)
+        self.now = 62
+        self.assertNotIn(3, self.online)
+        self.assertIn(70000, self.online)
+        self.assertEqual(len(self.online), 1)
+
+    def test_discard(self):
+        self.online.add(3)
+        self.now = 31
+        self.online.add(3)
+        self.online.discard(3)
+        self.assertNotIn(3, self.online)
+        self.assertEqual(len(self.online), 0)
+
+
+class PresenceTests(SimpleTestCase):
+
+    def setUp(self):
+        self.presence = Presence(ttl=60, sync_interval=10)
+        self.addCleanup(self.stop)
+
+    def stop(self):
+        if self.presence._task is not None:
+            self.presence._task.cancel()
+            run(asyncio.wait([self.presence._task]))
+
+    async def remote_sync(self, online=(), offline=()):
+        # Let the sync task join the group first.
+        await asyncio.sleep(0.05)
+        await get_channel_layer().group_send(GROUP, {
+            'type': 'presence.sync',
+            'origin': 'presence.elsewhere',
+            'online': _pack(online),
+            'offline': _pack(offline),
+        })
+        await asyncio.sleep(0.05)
+
+    def test_remote_offline_does_not_hide_local_users(self):
+        async def scenario():
+            self.presence.connected(7)
+            await self.remote_sync(offline=[7])
+            return self.presence.is_online(7)
+
+        self.assertTrue(run(scenario()))
+
+    def test_remote_updates_apply_after_the_last_local_user_leaves(self):
+        self.presence.sync_interval = 0.01
+
+        async def scenario():
+            self.presence.connected(7)
+            self.presence.disconnected(7)
+            await self.remote_sync(online=[8])
+            return self.presence.is_online(8)
+
+        self.assertTrue(run(scenario()))
@@ -3,3 +3,15 @@ from django.apps import AppConfig
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        from celery.signals import task_postrun, task_prerun
+        from django.core.signals import request_finished, request_started
+
+        from core import db_router, profiling, queues  # noqa: F401
+
+        request_started.connect(db_router.unpin)
+        request_finished.connect(db_router.unpin)
+        # Worker threads run task after task, a write must not pin them for good.
+        task_prerun.connect(db_router.unpin)
+        task_postrun.connect(db_router.unpin)
@@ -0,0 +1,25 @@
+import time
+
+from channels import layers
+
+
+class InMemoryChannelLayer(layers.InMemoryChannelLayer):
+    """
+    Channels' in-memory layer, for a single process and local testing.
+
+    The stock layer scans every channel and group membership for expired
+    entries on each receive and group send, which makes fanning a message
+    out to N connections cost O(N^2). Here the scan runs at most once per
+    ``cleanup_interval`` seconds.
+    """
+
+    def __init__(self, cleanup_interval=1, **kwargs):
+        super(InMemoryChannelLayer, self).__init__(**kwargs)
+        self.cleanup_interval = cleanup_interval
+        self._cleaned_at = 0
+
+    def _clean_expired(self):
+        now = time.monotonic()
+        if now - self._cleaned_at >= self.cleanup_interval:
+            self._cleaned_at = now
+            super(InMemoryChannelLayer, self)._clean_expired()
@@ -0,0 +1,16 @@
+from django.db.backends.mysql import base
+
+from core.db.backends.persistent import PersistentConnectionMixin
+
+
+class DatabaseWrapper(PersistentConnectionMixin, base.DatabaseWrapper):
+
+    def is_usable(self):
+        # PyMySQL's ping() reconnects by default, which would bypass
+        # connect() and skip Django's per connection setup.
+        try:
+            self.connection.ping(False)
+        except base.Database.Error:
+            return False
+        else:
+            return True
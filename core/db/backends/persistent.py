@@ -0,0 +1,67 @@
+import time
+
+from django.conf import settings
+
+from core import metrics
+
+connect_seconds = metrics.histogram(
+    'db_connect_seconds',
+    'Time to open a new database connection, by alias.',
+    labelnames=('alias',),
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1),
+)
+connection_checkouts = metrics.counter(
+    'db_connection_checkouts_total',
+    'Requests that used a database connection, by alias and whether it was reused.',
+    labelnames=('alias', 'reused'),
+)
+health_check_failures = metrics.counter(
+    'db_connection_health_check_failures_total',
+    'Persistent connections found dead when a request first used them.',
+    labelnames=('alias',),
+)
+
+
+class PersistentConnectionMixin(object):
+    """
+    Database wrapper mixin for ``CONN_MAX_AGE`` persistent connections.
+
+    The first query of each request checks that a connection kept from an
+    earlier request is still alive, and reconnects if it is not, instead
+    of failing the request. Connect latency and how often requests reuse a
+    connection are recorded per alias.
+    """
+    _request_started = True
+
+    def close_if_unusable_or_obsolete(self):
+        # Runs on request_started and request_finished.
+        super(PersistentConnectionMixin, self).close_if_unusable_or_obsolete()
+        self._request_started = True
+
+    def ensure_connection(self):
+        if self._request_started and not self.in_atomic_block:
+            self._request_started = False
+            reused = self.connection is not None
+            if reused and settings.DB_CONN_HEALTH_CHECKS and not self.is_usable():
+                health_check_failures.labels(alias=self.alias).inc()
+                self.close()
+                reused = False
+            connection_checkouts.labels(alias=self.alias, reused=reused).inc()
+        super(PersistentConnectionMixin, self).ensure_connection()
+
+    def get_new_connection(self, conn_params):
+        start = time.perf_counter()
+        connection = super(PersistentConnectionMixin, self).get_new_connection(conn_params)
+        connect_seconds.labels(alias=self.alias).observe(time.perf_counter() - start)
+        return connection
+
+
+def reuse_ratio(alias='default'):
+    """Share of requests since process start that reused a connection."""
+    counts = {
+        labels['reused']: child.value
+        for labels, child in connection_checkouts.samples()
+        if labels['alias'] == alias
+    }
+    total = sum(counts.values())
+    return counts.get('True', 0) / total if total else 0.0
@@ -0,0 +1,114 @@
+"""
+Read replica routing.
+
+Reads go to a random healthy alias from ``DATABASE_REPLICAS`` and writes
+to ``default``. Once a thread has written, or while it is inside a
+transaction on ``default``, its reads stay on the primary until the
+request or Celery task ends, so it always sees its own writes. Tasks
+reading rows a request just wrote must still ask for ``PRIMARY``. A
+replica whose lag is above ``REPLICA_MAX_LAG`` seconds, or cannot be
+measured, gets no reads until a later check finds it caught up.
+"""
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+from core import metrics
+
+_logger = logging.getLogger(__name__)
+
+PRIMARY = 'default'
+
+_local = threading.local()
+_lock = threading.Lock()
+_health = {}
+
+replica_lag = metrics.gauge(
+    'db_replica_lag_seconds',
+    'Last measured replication lag by replica, -1 when unknown.',
+    labelnames=('alias',),
+)
+replica_reads = metrics.counter(
+    'db_replica_reads_total',
+    'Read queries routed by database alias.',
+    labelnames=('alias',),
+)
+
+
+def pin_primary():
+    """Send this thread's reads to the primary until ``unpin``."""
+    _local.pinned = True
+
+
+def unpin(**kwargs):
+    _local.pinned = False
+
+
+def is_pinned():
+    return getattr(_local, 'pinned', False) or connections[PRIMARY].in_atomic_block
+
+
+def measure_lag(alias):
+    """Return replication lag of ``alias`` in seconds, or None if unknown."""
+    connection = connections[alias]
+    if connection.vendor != 'mysql':
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute('SHOW SLAVE STATUS')
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        columns = [column[0] for column in cursor.description]
+    return dict(zip(columns, row)).get('Seconds_Behind_Master')
+
+
+def is_healthy(alias):
+    now = time.monotonic()
+    checked_at, healthy = _health.get(alias, (None, True))
+    if checked_at is not None and now - checked_at < settings.REPLICA_LAG_CHECK_INTERVAL:
+        return healthy
+
+    with _lock:
+        # Other threads keep using the previous verdict while one checks.
+        _health[alias] = (now, healthy)
+    try:
+        lag = measure_lag(alias)
+    except DatabaseError as e:
+        _logger.warning('Cannot measure replication lag of {}: {}'.format(alias, e))
+        lag = None
+    healthy = lag is not None and lag <= settings.REPLICA_MAX_LAG
+    if not healthy:
+        _logger.warning('Replica {} lag {}, reading from primary'.format(alias, lag))
+    replica_lag.labels(alias=alias).set(-1 if lag is None else lag)
+    with _lock:
+        _health[alias] = (now, healthy)
+    return healthy
+
+
+class ReplicaRouter(object):
+
+    def db_for_read(self, model, **hints):
+        alias = PRIMARY
+        if settings.DATABASE_REPLICAS and not is_pinned():
+            replicas = [replica for replica in settings.DATABASE_REPLICAS if is_healthy(replica)]
+            if replicas:
+                alias = random.choice(replicas)
+        replica_reads.labels(alias=alias).inc()
+        return alias
+
+    def db_for_write(self, model, **hints):
+        pin_primary()
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
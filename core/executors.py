@@ -0,0 +1,141 @@
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from core import db_router, metrics
+
+_lock = threading.Lock()
+_executors = {}
+_pid = None
+_local = threading.local()
+_propagators = []
+
+executor_rejected = metrics.counter(
+    'executor_rejected_total',
+    'Tasks shed because the executor queue was full.',
+    labelnames=('executor',),
+)
+
+
+class ExecutorOverloaded(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Service temporarily overloaded, try again later.'
+    default_code = 'overloaded'
+    wait = 1
+
+
+class BoundedExecutor(ThreadPoolExecutor):
+    """
+    Thread pool that refuses new tasks with ``ExecutorOverloaded`` once
+    ``max_queue`` tasks are already waiting for a free worker.
+    """
+
+    def __init__(self, name, max_workers, max_queue=None):
+        super(BoundedExecutor, self).__init__(
+            max_workers=max_workers, thread_name_prefix='{}-executor'.format(name))
+        self.name = name
+        self.max_queue = max_queue
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def submit(self, fn, *args, **kwargs):
+        with self._pending_lock:
+            if self.max_queue is not None and self._pending >= self._max_workers + self.max_queue:
+                executor_rejected.labels(executor=self.name).inc()
+                raise ExecutorOverloaded()
+            self._pending += 1
+        try:
+            contexts = [context for context in (capture() for capture in _propagators) if context is not None]
+            future = super(BoundedExecutor, self).submit(self._run, contexts, fn, *args, **kwargs)
+        except Exception:
+            self._task_done(None)
+            raise
+        future.add_done_callback(self._task_done)
+        return future
+
+    def _run(self, contexts, fn, *args, **kwargs):
+        _local.executor = self.name
+        with ExitStack() as stack:
+            for context in contexts:
+                stack.enter_context(context)
+            return fn(*args, **kwargs)
+
+    def _task_done(self, future):
+        with self._pending_lock:
+            self._pending -= 1
+
+
+def propagate(capture):
+    """
+    Call ``capture`` in the submitting thread for every task; it returns a
+    context manager the task then runs in, or None. This carries per request
+    state such as metrics and profiles over to the worker threads.
+    """
+    _propagators.append(capture)
+
+
+def get_executor(name):
+    """
+    Return the process wide thread pool ``name``, sized by
+    ``settings.EXECUTOR_WORKERS[name]`` and bounded by
+    ``settings.EXECUTOR_QUEUE_LIMITS.get(name)``.
+    """
+    global _pid
+    with _lock:
+        if _pid != os.getpid():
+            # Worker threads do not survive a fork.
+            _executors.clear()
+            _pid = os.getpid()
+        executor = _executors.get(name)
+        if executor is None:
+            executor = BoundedExecutor(
+                name,
+                max_workers=settings.EXECUTOR_WORKERS[name],
+                max_queue=settings.EXECUTOR_QUEUE_LIMITS.get(name),
+            )
+            _executors[name] = executor
+        return executor
+
+
+def _call_with_db(func, *args, **kwargs):
+    close_old_connections()
+    db_router.unpin()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        db_router.unpin()
+        close_old_connections()
+
+
+def run_in_executor(name, func, *args, **kwargs):
+    """
+    Run blocking ``func`` on the ``name`` pool without blocking the event
+    loop; await the returned future. The task is submitted right away, so it
+    picks up the state bound to the calling thread at the time of the call.
+    """
+    loop = asyncio.get_event_loop()
+    return loop.run_in_executor(
+        get_executor(name), functools.partial(_call_with_db, func, *args, **kwargs))
+
+
+def run_bounded(name, func, *args, **kwargs):
+    """
+    Run CPU heavy ``func`` on the ``name`` pool and wait for the result, so
+    at most ``EXECUTOR_WORKERS[name]`` calls run at once in this process.
+    Calls made from that pool's own threads run inline.
+    """
+    if getattr(_local, 'executor', None) == name:
+        return func(*args, **kwargs)
+    return get_executor(name).submit(func, *args, **kwargs).result()
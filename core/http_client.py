@@ -0,0 +1,113 @@
+import logging
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from core import metrics, request_metrics
+
+_logger = logging.getLogger(__name__)
+
+http_request_seconds = metrics.histogram(
+    'external_http_request_seconds',
+    'Latency of outbound HTTP requests by service and outcome.',
+    labelnames=('service', 'outcome'),
+)
+http_retries = metrics.counter(
+    'external_http_retries_total',
+    'Retried outbound HTTP requests by service.',
+    labelnames=('service',),
+)
+
+RETRY_STATUS_CODES = frozenset((502, 503, 504))
+
+
+def redact_url(url):
+    """Drop the query string, which may carry access tokens."""
+    parts = urlsplit(url)
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, '', ''))
+
+
+class HttpClient(object):
+    """
+    Keep-alive HTTP client shared by every thread of a worker process.
+
+    Every request gets connect and read timeouts. Idempotent requests that
+    fail to connect, time out or get a 502/503/504 are retried with full
+    jitter exponential backoff.
+    """
+
+    def __init__(self, connect_timeout, read_timeout, max_retries, backoff, pool_size):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        # Pooled sockets must not be shared with a forked child.
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._session = self._new_session()
+                    self._pid = os.getpid()
+        return self._session
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size, max_retries=0)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def request(self, method, url, service='other', **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        retries = self.max_retries if method in ('GET', 'HEAD', 'OPTIONS') else 0
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                elapsed = time.perf_counter() - start
+                http_request_seconds.labels(service=service, outcome='error').observe(elapsed)
+                request_metrics.record_http(elapsed)
+                if attempt >= retries:
+                    raise
+                # The exception text repeats the full URL, log only its class.
+                _logger.warning('{} {} {} request failed, retrying: {}'.format(
+                    service, method, redact_url(url), type(e).__name__))
+            else:
+                elapsed = time.perf_counter() - start
+                http_request_seconds.labels(service=service, outcome=response.status_code).observe(elapsed)
+                request_metrics.record_http(elapsed)
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= retries:
+                    return response
+                response.close()
+
+            http_retries.labels(service=service).inc()
+            time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+            attempt += 1
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+
+http_client = HttpClient(
+    connect_timeout=settings.HTTP_CLIENT_CONNECT_TIMEOUT,
+    read_timeout=settings.HTTP_CLIENT_READ_TIMEOUT,
+    max_retries=settings.HTTP_CLIENT_MAX_RETRIES,
+    backoff=settings.HTTP_CLIENT_BACKOFF,
+    pool_size=settings.HTTP_CLIENT_POOL_SIZE,
+)
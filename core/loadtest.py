@@ -0,0 +1,122 @@
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+
+class LoadResult(object):
+
+    def __init__(self, latencies, errors, elapsed):
+        self.latencies = sorted(latencies)
+        self.errors = errors
+        self.elapsed = elapsed
+
+    @property
+    def throughput(self):
+        return len(self.latencies) / self.elapsed if self.elapsed else 0
+
+    def percentile(self, p):
+        if not self.latencies:
+            return 0
+        index = min(len(self.latencies) - 1, max(0, int(math.ceil(p / 100.0 * len(self.latencies))) - 1))
+        return self.latencies[index]
+
+    def summary(self):
+        return {
+            'requests': len(self.latencies),
+            'errors': self.errors,
+            'throughput': self.throughput,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+        }
+
+
+def run_load(send, total, concurrency, make_state=None, finish_state=None):
+    """
+    Call ``send(state, i)`` ``total`` times from ``concurrency`` threads.
+    ``send`` returns True on success; ``make_state`` builds per thread state
+    such as an HTTP session and ``finish_state(state)`` runs as each thread
+    exits.
+    """
+    counter = iter(range(total))
+    counter_lock = threading.Lock()
+    latencies = []
+    errors = [0]
+    results_lock = threading.Lock()
+
+    def worker():
+        state = make_state() if make_state else None
+        try:
+            while True:
+                with counter_lock:
+                    i = next(counter, None)
+                if i is None:
+                    return
+                start = time.perf_counter()
+                try:
+                    ok = send(state, i)
+                except Exception:
+                    ok = False
+                latency = time.perf_counter() - start
+                with results_lock:
+                    latencies.append(latency)
+                    if not ok:
+                        errors[0] += 1
+        finally:
+            if finish_state:
+                finish_state(state)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return LoadResult(latencies, errors[0], time.perf_counter() - start)
+
+
+class _StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@contextmanager
+def stub_json_server(respond):
+    """
+    Serve ``respond(method, path) -> (status, data)`` as JSON on a free
+    local port for the duration of the block, which receives the base URL.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            self.reply()
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            self.reply()
+
+        def reply(self):
+            status, data = respond(self.command, self.path)
+            body = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = _StubServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, name='stub-http-server', daemon=True)
+    thread.start()
+    try:
+        yield 'http://127.0.0.1:{}'.format(server.server_address[1])
+    finally:
+        server.shutdown()
+        server.server_close()
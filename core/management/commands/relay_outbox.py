@@ -0,0 +1,28 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core import outbox
+
+
+class Command(BaseCommand):
+    help = 'Publish outbox messages to the Celery broker in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.OUTBOX_BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=settings.OUTBOX_POLL_INTERVAL,
+                            help='Seconds to sleep when the outbox is empty.')
+        parser.add_argument('--once', action='store_true', help='Drain the outbox and exit.')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            relayed = outbox.relay(options['batch_size'])
+            if relayed:
+                self.stdout.write('Relayed {} messages'.format(relayed))
+            if relayed < options['batch_size']:
+                if options['once']:
+                    return
+                time.sleep(options['interval'])
@@ -0,0 +1,188 @@
+import threading
+
+_lock = threading.Lock()
+_registry = {}
+_collectors = []
+
+
+class _Child(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class _GaugeChild(_Child):
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class _HistogramChild(object):
+
+    def __init__(self, buckets):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        with self._lock:
+            self.sum += value
+            self.count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+
+class Metric(object):
+    """
+    Process local metric, optionally split by label values.
+    """
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def labels(self, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        return _Child()
+
+    def samples(self):
+        """Return a list of ``(label_dict, child)`` pairs."""
+        return [
+            (dict(zip(self.labelnames, key)), child)
+            for key, child in list(self._children.items())
+        ]
+
+    def __getattr__(self, item):
+        # Unlabelled metrics proxy straight to their single child.
+        if item.startswith('_') or self.labelnames:
+            raise AttributeError(item)
+        return getattr(self._children[()], item)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+
+class Histogram(Metric):
+    """
+    Bucketed observations. ``counts`` are per bucket, not cumulative.
+    """
+    type = 'histogram'
+    default_buckets = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, float('inf'))
+
+    def __init__(self, name, documentation, labelnames=(), buckets=None):
+        self.buckets = tuple(buckets or self.default_buckets)
+        if self.buckets[-1] != float('inf'):
+            self.buckets += (float('inf'),)
+        super(Histogram, self).__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+
+def _get_or_create(metric_class, name, documentation, labelnames, **kwargs):
+    with _lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = metric_class(name, documentation, labelnames, **kwargs)
+            _registry[name] = metric
+        elif not isinstance(metric, metric_class):
+            raise ValueError('Metric {} already registered as {}'.format(name, metric.type))
+        return metric
+
+
+def counter(name, documentation, labelnames=()):
+    return _get_or_create(Counter, name, documentation, labelnames)
+
+
+def gauge(name, documentation, labelnames=()):
+    return _get_or_create(Gauge, name, documentation, labelnames)
+
+
+def histogram(name, documentation, labelnames=(), buckets=None):
+    return _get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+
+def all_metrics():
+    with _lock:
+        return list(_registry.values())
+
+
+def register_collector(collector):
+    """Register ``collector()`` to refresh gauges right before metrics are read."""
+    with _lock:
+        _collectors.append(collector)
+
+
+def collect():
+    for collector in list(_collectors):
+        collector()
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels.items()
+    ) + '}'
+
+
+def render():
+    """Return every metric in the Prometheus text exposition format."""
+    collect()
+    lines = []
+    for metric in sorted(all_metrics(), key=lambda m: m.name):
+        lines.append('# HELP {} {}'.format(metric.name, metric.documentation))
+        lines.append('# TYPE {} {}'.format(metric.name, metric.type))
+        for labels, child in metric.samples():
+            if metric.type != 'histogram':
+                lines.append('{}{} {}'.format(metric.name, _format_labels(labels), _format_value(child.value)))
+                continue
+            cumulative = 0
+            for bound, count in zip(child.buckets, child.counts):
+                cumulative += count
+                bucket_labels = dict(labels, le=_format_value(bound))
+                lines.append('{}_bucket{} {}'.format(metric.name, _format_labels(bucket_labels), cumulative))
+            lines.append('{}_sum{} {}'.format(metric.name, _format_labels(labels), _format_value(child.sum)))
+            lines.append('{}_count{} {}'.format(metric.name, _format_labels(labels), child.count))
+    return '\n'.join(lines) + '\n'
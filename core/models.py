@@ -1,3 +1,18 @@
 from django.db import models
 
-# Create your models here.
+
+class OutboxMessage(models.Model):
+    """
+    Celery task call recorded in the same transaction as the change that
+    caused it, published to the broker later by ``manage.py relay_outbox``.
+    """
+    task_name = models.CharField(max_length=200)
+    args = models.TextField(default='[]')
+    kwargs = models.TextField(default='{}')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'outbox_message'
+
+    def __str__(self):
+        return 'OutboxMessage {}: {}'.format(self.id, self.task_name)
@@ -0,0 +1,55 @@
+import json
+import logging
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from core import metrics
+from core.models import OutboxMessage
+from dream.celery import app as celery_app
+
+_logger = logging.getLogger(__name__)
+
+relayed_messages = metrics.counter(
+    'outbox_relayed_total',
+    'Outbox messages published to the broker.',
+)
+
+
+def enqueue(task, *args, **kwargs):
+    """
+    Schedule ``task.delay(*args, **kwargs)`` as part of the current
+    transaction. With OUTBOX_ENABLED the call is stored in the outbox table
+    and the request does no broker I/O; otherwise it is sent on commit.
+    """
+    if not settings.OUTBOX_ENABLED:
+        transaction.on_commit(lambda: task.delay(*args, **kwargs))
+        return
+    OutboxMessage.objects.create(task_name=task.name, args=json.dumps(args), kwargs=json.dumps(kwargs))
+
+
+def relay(batch_size):
+    """
+    Publish up to ``batch_size`` outbox messages over one producer
+    connection and delete them. Delivery is at least once: if publishing
+    fails half way, the whole batch is kept and sent again.
+    """
+    skip_locked = connection.features.has_select_for_update_skip_locked
+    with transaction.atomic():
+        messages = list(
+            OutboxMessage.objects.select_for_update(skip_locked=skip_locked).order_by('id')[:batch_size]
+        )
+        if not messages:
+            return 0
+        with celery_app.producer_or_acquire() as producer:
+            for message in messages:
+                celery_app.send_task(
+                    message.task_name,
+                    args=json.loads(message.args),
+                    kwargs=json.loads(message.kwargs),
+                    producer=producer,
+                )
+        OutboxMessage.objects.filter(pk__in=[message.pk for message in messages]).delete()
+
+    relayed_messages.inc(len(messages))
+    return len(messages)
@@ -0,0 +1,224 @@
+"""
+Sampling profiler for live requests and Celery tasks.
+
+A single daemon thread reads the stacks of the threads being profiled
+every ``PROFILER_INTERVAL`` seconds through ``sys._current_frames``, so a
+profiled request runs at full speed apart from that sampling. Each profile
+is written to ``PROFILER_OUTPUT_DIR`` as collapsed stacks, one
+``frame;frame;frame count`` line per distinct stack, which flamegraph.pl
+and speedscope read directly.
+
+Requests are profiled at ``PROFILER_SAMPLE_RATE``, or when they carry an
+``X-Profile`` header equal to ``PROFILER_HEADER_TOKEN``; tasks at
+``PROFILER_TASK_SAMPLE_RATE``. Work a profiled request hands to the
+``core.executors`` pools, such as password hashing, is sampled into the
+same profile.
+"""
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from celery.signals import task_postrun, task_prerun
+from django.conf import settings
+
+from core import executors, request_metrics
+
+_logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_ASGI_HEADER = b'x-profile'
+
+
+class Profile(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.stacks = Counter()
+        self.started_at = time.time()
+        self.finished = False
+
+    def add(self, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('{}:{}'.format(frame.f_globals.get('__name__', code.co_filename), code.co_name))
+            frame = frame.f_back
+        self.stacks[';'.join(reversed(stack))] += 1
+
+    def write(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        filename = '{}-{}-{}.collapsed'.format(
+            self.name.replace('/', '_').replace(' ', '_'), int(self.started_at * 1000), os.getpid())
+        path = os.path.join(directory, filename)
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('{} {}\n'.format(stack, count))
+        return path
+
+
+class Sampler(object):
+
+    def __init__(self, interval):
+        self.interval = interval
+        # Thread id -> profile its stacks are sampled into.
+        self._threads = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+
+    def attach(self, thread_id, profile):
+        with self._cond:
+            if profile.finished:
+                return
+            if self._pid != os.getpid():
+                # The sampling thread does not survive a fork.
+                self._thread = None
+                self._pid = os.getpid()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='profiler-sampler', daemon=True)
+                self._thread.start()
+            self._threads[thread_id] = profile
+            self._cond.notify()
+
+    def detach(self, thread_id):
+        with self._cond:
+            self._threads.pop(thread_id, None)
+
+    def stop(self, profile):
+        # Samples are added under the lock, so none is added after this.
+        with self._cond:
+            profile.finished = True
+            for thread_id in [thread_id for thread_id, other in self._threads.items() if other is profile]:
+                del self._threads[thread_id]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._threads:
+                    self._cond.wait()
+                frames = sys._current_frames()
+                for thread_id, profile in self._threads.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        profile.add(frame)
+                del frames
+            time.sleep(self.interval)
+
+
+sampler = Sampler(settings.PROFILER_INTERVAL)
+
+
+def current():
+    """Return the profile of the request handled by this thread, if any."""
+    return getattr(_local, 'profile', None)
+
+
+@contextmanager
+def attach(profile):
+    """Sample this thread into ``profile`` for the duration of the block."""
+    thread_id = threading.get_ident()
+    previous = current()
+    _local.profile = profile
+    sampler.attach(thread_id, profile)
+    try:
+        yield profile
+    finally:
+        sampler.detach(thread_id)
+        _local.profile = previous
+        if previous is not None:
+            sampler.attach(thread_id, previous)
+
+
+@contextmanager
+def bind(profile):
+    """
+    Make ``profile`` this thread's current profile for the block without
+    sampling the thread, so only the executor work it submits is sampled.
+    Event loop threads serve other connections in between.
+    """
+    previous = current()
+    _local.profile = profile
+    try:
+        yield profile
+    finally:
+        _local.profile = previous
+
+
+def _propagate():
+    profile = current()
+    if profile is not None:
+        return attach(profile)
+
+
+executors.propagate(_propagate)
+
+
+def start_profile(name):
+    profile = Profile(name)
+    _local.profile = profile
+    sampler.attach(threading.get_ident(), profile)
+    return profile
+
+
+def finish_profile(profile):
+    sampler.stop(profile)
+    if current() is profile:
+        _local.profile = None
+    if not profile.stacks:
+        return None
+    try:
+        path = profile.write(settings.PROFILER_OUTPUT_DIR)
+    except OSError:
+        _logger.exception('Could not write profile {}'.format(profile.name))
+        return None
+    _logger.info('Wrote {} samples of {} to {}'.format(sum(profile.stacks.values()), profile.name, path))
+    return path
+
+
+def should_profile(header):
+    """Decide whether to profile a request carrying ``X-Profile: header``."""
+    token = settings.PROFILER_HEADER_TOKEN
+    if token and header == token:
+        return True
+    return random.random() < settings.PROFILER_SAMPLE_RATE
+
+
+class ProfilingMiddleware(object):
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not should_profile(request.META.get(PROFILE_HEADER)):
+            return self.get_response(request)
+
+        profile = start_profile('request')
+        try:
+            response = self.get_response(request)
+        finally:
+            profile.name = 'request-{}'.format(request_metrics.get_route(request))
+            finish_profile(profile)
+        return response
+
+
+_task_profiles = {}
+
+
+@task_prerun.connect
+def start_task_profile(task_id=None, task=None, **kwargs):
+    if random.random() < settings.PROFILER_TASK_SAMPLE_RATE:
+        _task_profiles[task_id] = start_profile('task-{}'.format(task.name))
+
+
+@task_postrun.connect
+def finish_task_profile(task_id=None, **kwargs):
+    profile = _task_profiles.pop(task_id, None)
+    if profile is not None:
+        finish_profile(profile)
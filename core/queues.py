@@ -0,0 +1,92 @@
+import logging
+import threading
+import time
+
+from celery.signals import before_task_publish, task_prerun
+from django.conf import settings
+
+from core import metrics
+
+_logger = logging.getLogger(__name__)
+
+QUEUE_DEFAULT = 'default'
+QUEUE_MAIL_HIGH = 'mail_high'
+QUEUE_MAIL_BULK = 'mail_bulk'
+
+ENQUEUED_AT_HEADER = 'enqueued_at'
+
+_refresh_lock = threading.Lock()
+_refreshed_at = None
+_refreshing = False
+
+queue_latency = metrics.histogram(
+    'celery_queue_latency_seconds',
+    'Time tasks waited in the broker before a worker started them.',
+    labelnames=('queue',),
+    buckets=(.01, .05, .1, .5, 1, 5, 10, 30, 60, 300, 900),
+)
+queue_depth = metrics.gauge(
+    'celery_queue_depth',
+    'Messages waiting in each Celery queue.',
+    labelnames=('queue',),
+)
+
+
+@before_task_publish.connect
+def stamp_enqueued_at(headers=None, **kwargs):
+    if headers is not None:
+        headers.setdefault(ENQUEUED_AT_HEADER, time.time())
+
+
+@task_prerun.connect
+def observe_queue_latency(task=None, **kwargs):
+    enqueued_at = task.request.get(ENQUEUED_AT_HEADER)
+    if enqueued_at is None:
+        return
+    queue = (task.request.delivery_info or {}).get('routing_key') or QUEUE_DEFAULT
+    queue_latency.labels(queue=queue).observe(max(0, time.time() - enqueued_at))
+
+
+def get_queue_depths(queues=None):
+    from dream.celery import app as celery_app
+
+    depths = {}
+    with celery_app.connection_for_read() as connection:
+        for queue in queues or settings.CELERY_MONITORED_QUEUES:
+            # A failed passive declare closes the channel, use one per queue.
+            try:
+                with connection.channel() as channel:
+                    depths[queue] = channel.queue_declare(queue=queue, passive=True).message_count
+            except Exception as e:
+                _logger.warning('Could not read depth of queue {}: {}'.format(queue, e))
+    return depths
+
+
+def refresh_queue_depths():
+    global _refreshing
+    try:
+        for queue, depth in get_queue_depths().items():
+            queue_depth.labels(queue=queue).set(depth)
+    except Exception as e:
+        _logger.warning('Could not read queue depths: {}'.format(e))
+    finally:
+        with _refresh_lock:
+            _refreshing = False
+
+
+def collect_queue_depths():
+    """
+    Refresh the depth gauges in the background once they are older than
+    CELERY_QUEUE_DEPTH_TTL, so a scrape never waits on the broker.
+    """
+    global _refreshed_at, _refreshing
+    now = time.monotonic()
+    with _refresh_lock:
+        if _refreshing or (_refreshed_at is not None and now - _refreshed_at < settings.CELERY_QUEUE_DEPTH_TTL):
+            return
+        _refreshing = True
+        _refreshed_at = now
+    threading.Thread(target=refresh_queue_depths, name='queue-depths', daemon=True).start()
+
+
+metrics.register_collector(collect_queue_depths)
@@ -0,0 +1,40 @@
+import threading
+import time
+
+
+class TokenBucket(object):
+    """
+    Thread safe token bucket: ``rate`` tokens per second, bursts of up to
+    ``capacity`` tokens.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens=1):
+        """Take ``tokens`` if available; otherwise return seconds to wait."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens=1):
+        """Block until ``tokens`` are available."""
+        if tokens > self.capacity:
+            # They never would be; clamping would undercount the caller.
+            raise ValueError('Cannot take {} tokens from a bucket of {}'.format(tokens, self.capacity))
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait:
+                return
+            time.sleep(wait)
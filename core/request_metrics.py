@@ -0,0 +1,131 @@
+import logging
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+from core import executors, metrics
+
+_logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+request_seconds = metrics.histogram(
+    'http_request_duration_seconds',
+    'Time spent handling a request, by route.',
+    labelnames=('route',),
+)
+request_queries = metrics.histogram(
+    'http_request_db_queries',
+    'Database queries run per request, by route.',
+    labelnames=('route',),
+    buckets=QUERY_BUCKETS,
+)
+request_db_seconds = metrics.histogram(
+    'http_request_db_seconds',
+    'Time spent in database queries per request, by route.',
+    labelnames=('route',),
+)
+request_external_seconds = metrics.histogram(
+    'http_request_external_seconds',
+    'Time spent in outbound HTTP calls per request, by route.',
+    labelnames=('route',),
+)
+
+
+class RequestStats(object):
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.http_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # Database execute wrapper.
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += time.perf_counter() - start
+
+
+def current():
+    """Return the stats of the request handled by this thread, if any."""
+    return getattr(_local, 'stats', None)
+
+
+@contextmanager
+def bind(stats):
+    """Make ``stats`` this thread's current request stats for the block."""
+    previous = current()
+    _local.stats = stats
+    try:
+        yield stats
+    finally:
+        _local.stats = previous
+
+
+@contextmanager
+def track(stats):
+    """Bind ``stats`` and count this thread's database queries into them."""
+    with bind(stats), ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(stats))
+        yield stats
+
+
+def _propagate():
+    stats = current()
+    if stats is not None:
+        return track(stats)
+
+
+# Queries a request runs on the executor pools count towards the request.
+executors.propagate(_propagate)
+
+
+def observe(method, route, stats, elapsed):
+    request_seconds.labels(route=route).observe(elapsed)
+    request_queries.labels(route=route).observe(stats.queries)
+    request_db_seconds.labels(route=route).observe(stats.db_time)
+    request_external_seconds.labels(route=route).observe(stats.http_time)
+
+    budget = settings.REQUEST_QUERY_BUDGET
+    if budget is not None and stats.queries > budget:
+        _logger.warning('{} {} ran {} queries (budget {}), {:.1f} ms in the database'.format(
+            method, route, stats.queries, budget, stats.db_time * 1000))
+
+
+def record_http(seconds):
+    stats = current()
+    if stats is not None:
+        stats.http_time += seconds
+
+
+def get_route(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else 'unresolved'
+
+
+class RequestMetricsMiddleware(object):
+    """
+    Record view time, database queries and time, and outbound HTTP time of
+    every request, by route. Requests running more than
+    ``REQUEST_QUERY_BUDGET`` queries are logged.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = RequestStats()
+        start = time.perf_counter()
+        with track(stats):
+            response = self.get_response(request)
+        observe(request.method, get_route(request), stats, time.perf_counter() - start)
+        return response
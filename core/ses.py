@@ -0,0 +1,86 @@
+import logging
+import os
+import threading
+import time
+
+import boto3
+from botocore.config import Config
+from django.conf import settings
+
+_logger = logging.getLogger(__name__)
+
+CHARSET = 'UTF-8'
+
+_lock = threading.Lock()
+_client = None
+_pid = None
+
+
+class LocalSESClient(object):
+    """
+    Stand-in for the boto3 SES client when ``SES_BACKEND = 'local'``. Keeps
+    sent messages in memory and optionally sleeps to mimic AWS latency.
+    """
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def send_email(self, Destination, Message, Source, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.sent.append({'Destination': Destination, 'Message': Message, 'Source': Source})
+            message_id = 'local-{}'.format(len(self.sent))
+        _logger.info('Local SES send to {}: {}'.format(
+            Destination['ToAddresses'], Message['Subject']['Data']))
+        return {'MessageId': message_id}
+
+
+def _new_client():
+    if settings.SES_BACKEND == 'local':
+        return LocalSESClient(latency=settings.SES_LOCAL_LATENCY)
+    return boto3.client(
+        'ses',
+        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+        region_name=settings.AWS_REGION,
+        endpoint_url=settings.SES_ENDPOINT_URL,
+        config=Config(max_pool_connections=settings.SES_MAX_POOL_CONNECTIONS),
+    )
+
+
+def get_client():
+    """
+    Return the SES client of this worker process. boto3 clients are thread
+    safe, so one client and its connection pool serve every send.
+    """
+    global _client, _pid
+    if _pid != os.getpid():
+        with _lock:
+            if _pid != os.getpid():
+                _client = _new_client()
+                _pid = os.getpid()
+    return _client
+
+
+def build_message(subject, body_html, body_text=None):
+    message = {
+        'Body': {
+            'Html': {
+                'Charset': CHARSET,
+                'Data': body_html,
+            },
+        },
+        'Subject': {
+            'Charset': CHARSET,
+            'Data': subject,
+        },
+    }
+    if body_text:
+        message['Body']['Text'] = {
+            'Charset': CHARSET,
+            'Data': body_text,
+        }
+    return message
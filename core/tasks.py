@@ -1,55 +1,83 @@
-import boto3
+from concurrent.futures import ThreadPoolExecutor
+
 from botocore.exceptions import ClientError
 from celery import shared_task, Task
 from celery.utils.log import get_task_logger
 from django.conf import settings
 
+from core import ses
+from core.queues import QUEUE_MAIL_BULK, QUEUE_MAIL_HIGH
+from core.ratelimit import TokenBucket
+
 _logger = get_task_logger(__name__)
 
+# Each mail queue gets its own share of the SES sending quota, so a bulk
+# run can never use up the rate transactional mail needs.
+_send_rates = {
+    queue: TokenBucket(rate)
+    for queue, rate in settings.SES_QUEUE_SEND_RATES.items()
+}
+
 
 class AWSSESTask(Task):
     """AWS Simple Email Service Task"""
-    _client = None
 
     @property
     def client(self):
-        if self._client is None:
-            self._client = boto3.client(
-                'ses',
-                aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-                region_name=settings.AWS_REGION)
-            return self._client
+        return ses.get_client()
+
+
+def deliver_email(subject, body_html, from_email, recipient_list, body_text=None, queue=QUEUE_MAIL_HIGH):
+    """
+    Send one message through this worker's SES client, within the send
+    rate of ``queue``. A message to more recipients than the rate allows
+    at once goes out as several sends. Returns success.
+    """
+    send_rate = _send_rates[queue]
+    chunk_size = max(1, int(send_rate.capacity))
+    message = ses.build_message(subject, body_html, body_text)
+    sent = True
+    for i in range(0, len(recipient_list), chunk_size):
+        recipients = recipient_list[i:i + chunk_size]
+        send_rate.acquire(len(recipients))
+        try:
+            ses.get_client().send_email(
+                Destination={'ToAddresses': recipients},
+                Message=message,
+                Source=from_email,
+            )
+        except ClientError as e:
+            _logger.error('Failed to send to {}: {}'.format(recipients, e.response['Error']['Message']))
+            sent = False
+    return sent
 
 
 @shared_task(base=AWSSESTask, bind=True)
 def send_email(self, subject, body_html, from_email, recipient_list, body_text=None):
-    CHARSET = 'UTF-8'
-    message = {
-        'Body': {
-            'Html': {
-                'Charset': CHARSET,
-                'Data': body_html,
-            },
-        },
-        'Subject': {
-            'Charset': CHARSET,
-            'Data': subject,
-        },
-    }
-    if body_text:
-        message['Body']['Text'] = {
-            'Charset': CHARSET,
-            'Data': body_text,
-        }
-
-    try:
-        self.client.send_email(
-            Destination={'ToAddresses': recipient_list},
-            Message=message,
-            Source=from_email,
-        )
-    except ClientError as e:
-        _logger.error(e.response['Error']['Message'])
+    deliver_email(subject, body_html, from_email, recipient_list, body_text)
+
+
+@shared_task(base=AWSSESTask, bind=True)
+def send_email_batch(self, messages, from_email):
+    """
+    Send many messages, each a dict with ``subject``, ``body_html``,
+    ``recipient_list`` and optionally ``body_text``, with at most
+    SES_BATCH_CONCURRENCY sends in flight, within the mail_bulk queue's
+    share of the SES send rate. A message failing for any reason does not
+    stop the others. Returns the number of messages sent and failed and the
+    indexes of the failed ones in ``messages``.
+    """
+    def send(message):
+        try:
+            return deliver_email(
+                message['subject'], message['body_html'], from_email,
+                message['recipient_list'], message.get('body_text'), queue=QUEUE_MAIL_BULK)
+        except Exception:
+            _logger.exception('Failed to send to {}'.format(message.get('recipient_list')))
+            return False
 
+    with ThreadPoolExecutor(max_workers=settings.SES_BATCH_CONCURRENCY) as executor:
+        results = list(executor.map(send, messages))
 
+    failed = [i for i, sent in enumerate(results) if not sent]
+    return {'sent': len(results) - len(failed), 'failed': len(failed), 'failed_messages': failed}
@@ -1,3 +1,298 @@
-from django.test import TestCase
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+import requests
+from celery.signals import task_postrun, task_prerun
+from django.db import transaction
+from django.http import Http404
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from core import db_router, executors, metrics, outbox, profiling, queues, ses, tasks
+from core.db.backends import persistent
+from core.db.backends.mysql import base as mysql_base
+from core.http_client import HttpClient
+from core.models import OutboxMessage
+from core.queues import QUEUE_MAIL_HIGH
+from core.ratelimit import TokenBucket
+from core.views import metrics_view
+
+
+class HttpClientTests(SimpleTestCase):
+
+    def test_retry_log_leaves_out_the_query_string(self):
+        client = HttpClient(connect_timeout=1, read_timeout=1, max_retries=1, backoff=0, pool_size=1)
+        with self.assertLogs('core.http_client', 'WARNING') as logs:
+            with self.assertRaises(requests.ConnectionError):
+                # Nothing listens on port 1.
+                client.get('http://127.0.0.1:1/me?access_token=SECRET', service='facebook')
+        self.assertEqual(len(logs.output), 1)
+        self.assertNotIn('SECRET', logs.output[0])
+        self.assertIn('http://127.0.0.1:1/me', logs.output[0])
+
+
+class LocalSESTestCase(SimpleTestCase):
+    """Sends through a fresh in-memory SES client."""
+
+    def setUp(self):
+        self.client = ses.LocalSESClient()
+        patcher = mock.patch('core.ses.get_client', return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def sent_to(self):
+        return [message['Destination']['ToAddresses'] for message in self.client.sent]
+
+
+class TokenBucketTests(SimpleTestCase):
+
+    def test_acquire_within_capacity(self):
+        bucket = TokenBucket(rate=1000, capacity=5)
+        bucket.acquire(5)
+        self.assertGreater(bucket.try_acquire(1), 0)
+
+    def test_acquire_past_capacity_is_refused(self):
+        with self.assertRaises(ValueError):
+            TokenBucket(rate=1000, capacity=5).acquire(6)
+
+
+class DeliverEmailTests(LocalSESTestCase):
+
+    def test_message_to_more_recipients_than_the_rate_is_split(self):
+        bucket = TokenBucket(rate=1000, capacity=3)
+        recipients = ['user-{}@example.com'.format(i) for i in range(7)]
+        with mock.patch.dict(tasks._send_rates, {QUEUE_MAIL_HIGH: bucket}):
+            self.assertTrue(tasks.deliver_email('subject', '<p>body</p>', 'noreply@example.com', recipients))
+        self.assertEqual(self.sent_to(), [recipients[0:3], recipients[3:6], recipients[6:7]])
+
+
+class SendEmailBatchTests(LocalSESTestCase):
+
+    def test_failing_message_does_not_stop_the_batch(self):
+        messages = [
+            {'subject': 'one', 'body_html': '<p>1</p>', 'recipient_list': ['one@example.com']},
+            {'subject': 'broken', 'body_html': '<p>2</p>'},
+            {'subject': 'three', 'body_html': '<p>3</p>', 'recipient_list': ['three@example.com']},
+        ]
+        with self.assertLogs('core.tasks', 'ERROR'):
+            result = tasks.send_email_batch.apply((messages, 'noreply@example.com')).get()
+        self.assertEqual(result, {'sent': 2, 'failed': 1, 'failed_messages': [1]})
+        self.assertEqual(sorted(self.sent_to()), [['one@example.com'], ['three@example.com']])
+
+
+class OutboxTests(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(outbox.celery_app, 'producer_or_acquire')
+        patcher.start().return_value.__enter__.return_value = 'producer'
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(outbox.celery_app, 'send_task')
+        self.send_task = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_enqueue_is_part_of_the_transaction(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                outbox.enqueue(tasks.send_email, 'subject', '<p>body</p>', 'noreply@example.com', ['a@example.com'])
+                raise RuntimeError()
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_relay_publishes_in_order_and_deletes(self):
+        outbox.enqueue(tasks.send_email, 'first', '<p>1</p>', 'noreply@example.com', ['a@example.com'])
+        outbox.enqueue(tasks.send_email, 'second', '<p>2</p>', 'noreply@example.com', ['b@example.com'],
+                       body_text='2')
+        self.assertEqual(outbox.relay(batch_size=10), 2)
+        self.assertEqual(self.send_task.call_args_list, [
+            mock.call('core.tasks.send_email', args=['first', '<p>1</p>', 'noreply@example.com', ['a@example.com']],
+                      kwargs={}, producer='producer'),
+            mock.call('core.tasks.send_email', args=['second', '<p>2</p>', 'noreply@example.com', ['b@example.com']],
+                      kwargs={'body_text': '2'}, producer='producer'),
+        ])
+        self.assertFalse(OutboxMessage.objects.exists())
+        self.assertEqual(outbox.relay(batch_size=10), 0)
+
+    def test_relay_respects_batch_size(self):
+        for i in range(3):
+            outbox.enqueue(tasks.send_email, str(i), '', 'noreply@example.com', ['a@example.com'])
+        self.assertEqual(outbox.relay(batch_size=2), 2)
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+
+    def test_failed_publish_keeps_the_batch(self):
+        outbox.enqueue(tasks.send_email, 'subject', '', 'noreply@example.com', ['a@example.com'])
+        self.send_task.side_effect = ConnectionError()
+        with self.assertRaises(ConnectionError):
+            outbox.relay(batch_size=10)
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRouterTests(TransactionTestCase):
+
+    def setUp(self):
+        patcher = mock.patch('core.db_router.is_healthy', return_value=True)
+        self.is_healthy = patcher.start()
+        self.addCleanup(patcher.stop)
+        db_router.unpin()
+        self.addCleanup(db_router.unpin)
+        self.router = db_router.ReplicaRouter()
+
+    def test_reads_go_to_a_healthy_replica(self):
+        self.assertEqual(self.router.db_for_read(OutboxMessage), 'replica')
+        self.is_healthy.return_value = False
+        self.assertEqual(self.router.db_for_read(OutboxMessage), db_router.PRIMARY)
+
+    def test_reads_stay_on_the_primary_after_a_write(self):
+        self.assertEqual(self.router.db_for_write(OutboxMessage), db_router.PRIMARY)
+        self.assertEqual(self.router.db_for_read(OutboxMessage), db_router.PRIMARY)
+        db_router.unpin()
+        self.assertEqual(self.router.db_for_read(OutboxMessage), 'replica')
+
+    def test_reads_inside_a_transaction_use_the_primary(self):
+        with transaction.atomic():
+            self.assertEqual(self.router.db_for_read(OutboxMessage), db_router.PRIMARY)
+
+    def test_celery_tasks_start_and_end_unpinned(self):
+        for signal in (task_prerun, task_postrun):
+            db_router.pin_primary()
+            signal.send(sender=tasks.send_email, task_id='test', task=tasks.send_email, args=(), kwargs={})
+            self.assertFalse(db_router.is_pinned())
+
+
+@override_settings(DB_CONN_HEALTH_CHECKS=True)
+class PersistentConnectionTests(SimpleTestCase):
+    """Runs the MySQL wrapper against a fake driver connection."""
+
+    def setUp(self):
+        patcher = mock.patch.object(mysql_base.base.Database, 'connect', side_effect=self.connect)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(mysql_base.DatabaseWrapper, 'init_connection_state')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.opened = []
+        self.wrapper = mysql_base.DatabaseWrapper({
+            'NAME': 'persistent', 'USER': '', 'PASSWORD': '', 'HOST': '', 'PORT': '', 'OPTIONS': {},
+            'CONN_MAX_AGE': 60, 'AUTOCOMMIT': True, 'ATOMIC_REQUESTS': False, 'TIME_ZONE': None, 'TEST': {},
+        }, alias='persistent')
+
+    def connect(self, **params):
+        self.opened.append(mock.Mock())
+        return self.opened[-1]
+
+    def start_request(self):
+        self.wrapper.close_if_unusable_or_obsolete()
+        self.wrapper.ensure_connection()
+
+    def checkouts(self, reused):
+        return persistent.connection_checkouts.labels(alias='persistent', reused=reused).value
+
+    def test_live_connection_is_reused(self):
+        self.start_request()
+        reused = self.checkouts(True)
+        self.start_request()
+        self.assertEqual(len(self.opened), 1)
+        self.opened[0].ping.assert_called_once_with(False)
+        self.assertEqual(self.checkouts(True), reused + 1)
+
+    def test_failed_ping_opens_a_new_connection(self):
+        self.start_request()
+        failures = persistent.health_check_failures.labels(alias='persistent').value
+        self.opened[0].ping.side_effect = mysql_base.base.Database.OperationalError(2006, 'gone away')
+        self.start_request()
+        self.assertEqual(len(self.opened), 2)
+        self.opened[0].ping.assert_called_once_with(False)
+        self.opened[0].close.assert_called_once_with()
+        self.assertIs(self.wrapper.connection, self.opened[1])
+        self.assertEqual(persistent.health_check_failures.labels(alias='persistent').value, failures + 1)
+
+    def test_only_the_first_query_of_a_request_pings(self):
+        self.start_request()
+        self.wrapper.ensure_connection()
+        self.wrapper.ensure_connection()
+        self.opened[0].ping.assert_not_called()
+
+
+@mock.patch.object(metrics, '_collectors', [])
+class MetricsViewTests(SimpleTestCase):
+
+    def scrape(self, **headers):
+        return metrics_view(RequestFactory().get('/metrics/', REMOTE_ADDR='127.0.0.1', **headers))
+
+    @override_settings(METRICS_TOKEN='scrape-token')
+    def test_scrape_with_the_token(self):
+        response = self.scrape(HTTP_AUTHORIZATION='Bearer scrape-token')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'# TYPE ', response.content)
+
+    @override_settings(METRICS_TOKEN='scrape-token')
+    def test_scrape_without_the_token_is_refused(self):
+        for headers in ({}, {'HTTP_AUTHORIZATION': 'Bearer wrong'}):
+            with self.assertRaises(Http404):
+                self.scrape(**headers)
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_metrics_are_off_without_a_token(self):
+        with self.assertRaises(Http404):
+            self.scrape(HTTP_AUTHORIZATION='Bearer None')
+
+
+class QueueDepthTests(SimpleTestCase):
+
+    def setUp(self):
+        patcher = mock.patch.multiple(queues, _refreshed_at=None, _refreshing=False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_scrape_does_not_wait_for_the_broker(self):
+        broker = threading.Event()
+        calls = []
+
+        def get_queue_depths():
+            calls.append(1)
+            broker.wait(5)
+            return {'mail_high': 7}
+
+        with mock.patch.object(queues, 'get_queue_depths', get_queue_depths):
+            queues.collect_queue_depths()
+            # Still refreshing, and then within the TTL: no second broker call.
+            queues.collect_queue_depths()
+            broker.set()
+            for thread in threading.enumerate():
+                if thread.name == 'queue-depths':
+                    thread.join(5)
+            queues.collect_queue_depths()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(queues.queue_depth.labels(queue='mail_high').value, 7)
+
+    def test_broker_errors_are_logged(self):
+        with mock.patch.object(queues, 'get_queue_depths', side_effect=OSError('broker down')):
+            with self.assertLogs('core.queues', 'WARNING'):
+                queues.refresh_queue_depths()
+        self.assertFalse(queues._refreshing)
+
+
+class ProfilingTests(SimpleTestCase):
+
+    def sleep_in_executor(self):
+        time.sleep(0.05)
+
+    def test_executor_threads_are_sampled_into_the_profile(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(PROFILER_OUTPUT_DIR=directory):
+            profile = profiling.start_profile('test')
+            try:
+                executors.run_bounded('hashing', self.sleep_in_executor)
+            finally:
+                path = profiling.finish_profile(profile)
+            with open(path) as f:
+                stacks = [line.rsplit(' ', 1)[0] for line in f]
+        self.assertTrue(any(stack.endswith('core.tests:sleep_in_executor') for stack in stacks))
+        self.assertIsNone(profiling.current())
+
+    def test_finished_profile_takes_no_more_samples(self):
+        profile = profiling.start_profile('test')
+        profiling.sampler.stop(profile)
+        samples = sum(profile.stacks.values())
+        with profiling.attach(profile):
+            time.sleep(0.05)
+        self.assertEqual(sum(profile.stacks.values()), samples)
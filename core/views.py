@@ -1,3 +1,15 @@
-from django.shortcuts import render
+import hmac
 
-# Create your views here.
+from django.conf import settings
+from django.http import Http404, HttpResponse
+
+from core import metrics
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint, only served to holders of METRICS_TOKEN."""
+    token = settings.METRICS_TOKEN
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if not token or not hmac.compare_digest(authorization.encode(), 'Bearer {}'.format(token).encode()):
+        raise Http404
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
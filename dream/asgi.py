@@ -0,0 +1,13 @@
+"""
+ASGI entrypoint. Configures Django and then runs the application routing
+defined in ASGI_APPLICATION.
+"""
+
+import os
+
+import django
+from channels.routing import get_default_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dream.settings')
+django.setup()
+application = get_default_application()
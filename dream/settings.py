@@ -11,7 +11,10 @@ https://docs.djangoproject.com/en/2.1/ref/settings/
 """
 
 import os
+from datetime import timedelta
+
 import pymysql
+from celery.schedules import crontab
 
 pymysql.install_as_MySQLdb()
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -39,10 +42,15 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
 
     'channels',
+    'core',
     'dream_users',
+    'chat',
+    'dream_chat',
 ]
 
 MIDDLEWARE = [
+    'core.request_metrics.RequestMetricsMiddleware',
+    'core.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -56,6 +64,38 @@ ROOT_URLCONF = 'dream.urls'
 AUTH_USER_MODEL = 'dream_users.User'
 ASGI_APPLICATION = "chat.routing.application"
 
+# Chat fan-out. The in-memory layer only reaches consumers of one process;
+# run several processes against channels_redis.core.RedisChannelLayer.
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'core.channel_layers.InMemoryChannelLayer',
+    },
+}
+
+# Chat messages are written in batches of up to CHAT_WRITE_BATCH_SIZE at
+# least every CHAT_WRITE_FLUSH_INTERVAL seconds. At most
+# CHAT_WRITE_MAX_PENDING wait in memory, the oldest are dropped beyond.
+CHAT_WRITE_BATCH_SIZE = 500
+CHAT_WRITE_FLUSH_INTERVAL = 1
+CHAT_WRITE_MAX_PENDING = 50000
+# Messages per room kept in memory for clients joining a room.
+CHAT_RECENT_MESSAGES = 50
+CHAT_HISTORY_PAGE_SIZE = 50
+# Longer chat messages are refused.
+CHAT_MAX_MESSAGE_LENGTH = 2000
+# Frames buffered per chat connection for a client that is not reading,
+# and what to do once full: 'drop_oldest', 'coalesce' or 'disconnect'.
+# Frames are only handed to the ASGI server, which buffers them without
+# limit, while less than CHAT_UNACKED_BYTES are unacknowledged by the client.
+CHAT_OUTBOUND_QUEUE_SIZE = 200
+CHAT_OUTBOUND_POLICY = 'drop_oldest'
+CHAT_UNACKED_BYTES = 256 * 1024
+# Users count as online for up to PRESENCE_TTL seconds after their last
+# heartbeat. Each process heartbeats its connected users to the others
+# every PRESENCE_SYNC_INTERVAL, which must stay below PRESENCE_TTL / 2.
+PRESENCE_TTL = 60
+PRESENCE_SYNC_INTERVAL = 15
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -79,18 +119,51 @@ WSGI_APPLICATION = 'dream.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
+        # Django's MySQL backend plus connection health checks and metrics.
+        'ENGINE': 'core.db.backends.mysql',
         'NAME': 'db_ml',
         'USER': 'root',
         'PASSWORD': 'tuan0210',
         'HOST': 'localhost',
         'PORT': '3306',
+        # Keep connections open across requests; must stay below MySQL's
+        # wait_timeout.
+        'CONN_MAX_AGE': 60,
+    },
+    # Read replicas are plain aliases listed in DATABASE_REPLICAS, e.g.
+    # 'replica': {..., 'HOST': 'db-replica-1', 'TEST': {'MIRROR': 'default'}},
+}
+
+# Ping persistent connections before the first query of each request.
+DB_CONN_HEALTH_CHECKS = True
+
+DATABASE_ROUTERS = ['core.db_router.ReplicaRouter']
+# Aliases that take read queries. A replica lagging more than
+# REPLICA_MAX_LAG seconds is skipped until a later check, at most every
+# REPLICA_LAG_CHECK_INTERVAL seconds per process, finds it caught up.
+DATABASE_REPLICAS = []
+REPLICA_MAX_LAG = 5
+REPLICA_LAG_CHECK_INTERVAL = 5
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
+PASSWORD_HASHERS = [
+    'dream_users.hashers.BoundedPBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+
+# Run `manage.py calibrate_hasher` on production hardware to pick this.
+PASSWORD_HASHER_ITERATIONS = 120000
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -124,6 +197,145 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 EXPIRED_TOKEN_TIME = 86400
+EXPIRED_TOKEN_RESET_TIME = 3600
+EXPIRED_TOKEN_CONFIRM_EMAIL_TIME = 86400
 URL_GET_ID_FACEBOOK = "https://graph.facebook.com/me?access_token="
+URL_GET_PROFILE_LINE = 'https://api.line.me/v2/profile'
 EMAIL_NO_REPLY = 'noreply@gmail.com'
 SERVER_URL = 'http://128.199.159.39:8000'
+
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': (
+        'dream_users.auth.SignedBearerAuthentication',
+        'dream_users.auth.BearerAuthentication',
+    ),
+}
+
+# Bearer token cache. Other processes only drop their local tier entry when
+# its TTL runs out, so TOKEN_CACHE_LOCAL_TTL bounds how long a logged out
+# token can still be accepted by another worker.
+TOKEN_CACHE_ENABLED = True
+TOKEN_CACHE_ALIAS = 'default'
+TOKEN_CACHE_LOCAL_SIZE = 10000
+TOKEN_CACHE_LOCAL_TTL = 10
+TOKEN_CACHE_SHARED_TTL = 3600
+
+# 'db' issues Token rows, 'signed' issues stateless signed tokens. Signed
+# token logout relies on a denylist in the TOKEN_CACHE_ALIAS cache, so that
+# backend must be shared and must not evict entries early.
+ACCESS_TOKEN_MODE = 'db'
+# Key signed tokens are signed with. Never the committed SECRET_KEY: the
+# app refuses to start in signed mode without a key of its own.
+ACCESS_TOKEN_SIGNING_KEY = os.environ.get('ACCESS_TOKEN_SIGNING_KEY')
+
+# Concurrent db token sessions a user may hold; logging in past the cap
+# evicts the oldest ones.
+MAX_SESSIONS_PER_USER = 10
+
+# Resolved Facebook/LINE profiles keyed by a hash of the access token.
+# Invalid tokens are remembered for the shorter negative TTL.
+SOCIAL_PROFILE_CACHE_TTL = 60
+SOCIAL_PROFILE_NEGATIVE_TTL = 10
+
+# Expired token reaper. Keep batches small so each DELETE only locks a few
+# rows of the live tables.
+REAPER_BATCH_SIZE = 1000
+REAPER_BATCH_SLEEP = 0.1
+
+# Write-behind login history: None writes on every login, 'local' buffers
+# per process, 'cache' buffers in LOGIN_ACTIVITY_CACHE_ALIAS (must be shared
+# and support atomic incr) and is flushed by the Celery beat task below.
+LOGIN_ACTIVITY_BUFFER = None
+LOGIN_ACTIVITY_CACHE_ALIAS = 'default'
+LOGIN_ACTIVITY_FLUSH_INTERVAL = 30
+
+# Outbound HTTP (Facebook, LINE). Timeouts are in seconds, retries only
+# apply to idempotent requests.
+HTTP_CLIENT_CONNECT_TIMEOUT = 3.05
+HTTP_CLIENT_READ_TIMEOUT = 5
+HTTP_CLIENT_MAX_RETRIES = 2
+HTTP_CLIENT_BACKOFF = 0.2
+HTTP_CLIENT_POOL_SIZE = 10
+
+# Thread pools for blocking work: ORM and broker calls from the ASGI
+# endpoints, password hashing (every PBKDF2 call, sync or async) and
+# outbound HTTP. A full queue makes the pool answer 503.
+EXECUTOR_WORKERS = {
+    'db': 8,
+    'hashing': 2,
+    'http': 16,
+}
+EXECUTOR_QUEUE_LIMITS = {
+    'hashing': 32,
+}
+
+# Amazon SES. SES_BACKEND = 'local' swaps in an in-memory stand-in;
+# SES_ENDPOINT_URL can point the real client at a local SES emulator.
+SES_BACKEND = 'aws'
+SES_ENDPOINT_URL = None
+SES_LOCAL_LATENCY = 0
+SES_MAX_POOL_CONNECTIONS = 10
+# Recipients per second each mail queue may send, per worker process. The
+# sum over all worker processes must stay within the account's SES quota.
+SES_QUEUE_SEND_RATES = {
+    'mail_high': 4,
+    'mail_bulk': 10,
+}
+SES_BATCH_CONCURRENCY = 8
+
+# Tasks enqueued from request handlers go through the outbox table and are
+# published by `manage.py relay_outbox`. When disabled they are sent to the
+# broker directly once the request's transaction commits.
+OUTBOX_ENABLED = True
+OUTBOX_BATCH_SIZE = 500
+OUTBOX_POLL_INTERVAL = 0.5
+
+# Transactional mail (confirm, reset) and bulk mail get their own queues so
+# a bulk run never delays a password reset. Run a worker per queue with its
+# own concurrency, e.g.
+#   celery -A dream worker -Q mail_high -c 8
+#   celery -A dream worker -Q mail_bulk -c 2
+#   celery -A dream worker -Q default -B
+CELERY_TASK_DEFAULT_QUEUE = 'default'
+CELERY_TASK_ROUTES = {
+    'dream_users.tasks.send_user_email': {'queue': 'mail_high'},
+    'dream_users.tasks.send_register_confirm_email': {'queue': 'mail_high'},
+    'dream_users.tasks.send_forgot_password_email': {'queue': 'mail_high'},
+    'core.tasks.send_email': {'queue': 'mail_high'},
+    'core.tasks.send_email_batch': {'queue': 'mail_bulk'},
+}
+CELERY_MONITORED_QUEUES = ('default', 'mail_high', 'mail_bulk')
+# Seconds a scrape may report queue depths read from the broker earlier.
+CELERY_QUEUE_DEPTH_TTL = 15
+
+# Repeated forgot-password requests within this many seconds send nothing
+# new, and a send reuses a reset/confirm token created within the window.
+EMAIL_DEDUP_WINDOW = 300
+EMAIL_DEDUP_CACHE_ALIAS = 'default'
+
+CELERY_BEAT_SCHEDULE = {
+    'reap-expired-tokens': {
+        'task': 'dream_users.tasks.reap_expired_tokens',
+        'schedule': crontab(minute=15),
+    },
+}
+# Only the shared cache buffer is flushed by beat, 'local' flushes itself.
+if LOGIN_ACTIVITY_BUFFER == 'cache':
+    CELERY_BEAT_SCHEDULE['flush-login-activity'] = {
+        'task': 'dream_users.tasks.flush_login_activity',
+        'schedule': timedelta(seconds=LOGIN_ACTIVITY_FLUSH_INTERVAL),
+    }
+
+# Log requests running more queries than this; None disables the check.
+REQUEST_QUERY_BUDGET = None
+# Scrapers send "Authorization: Bearer <METRICS_TOKEN>"; /metrics/ is not
+# served while it is unset.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Sampling profiler, see core.profiling. Requests sent with
+# "X-Profile: <PROFILER_HEADER_TOKEN>" are always profiled.
+PROFILER_SAMPLE_RATE = 0.0
+PROFILER_TASK_SAMPLE_RATE = 0.0
+PROFILER_HEADER_TOKEN = None
+PROFILER_INTERVAL = 0.005
+PROFILER_OUTPUT_DIR = '/tmp/dream-profiles'
@@ -15,6 +15,7 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path
+from core import views as core_views
 from dream_users import views as user_views
 
 urlpatterns = [
@@ -25,4 +26,5 @@ urlpatterns = [
     path('register/', user_views.RegisterEmailAPI.as_view()),
     path('confirm/<token>/', user_views.ConfirmEmailAPI.as_view()),
     path('logout/', user_views.LogoutAPI.as_view()),
+    path('metrics/', core_views.metrics_view),
 ]
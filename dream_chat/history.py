@@ -0,0 +1,82 @@
+import threading
+from collections import deque
+
+from django.conf import settings
+
+from core.cache import LRUCache
+from dream_chat import models as chat_models
+
+
+class RecentMessages(object):
+    """
+    The last ``size`` messages of each room, as sent to clients, so a
+    reconnecting client catches up without a query. Only messages posted
+    through this process are seen.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._rooms = {}
+        self._lock = threading.Lock()
+
+    def append(self, room, message):
+        buffer = self._rooms.get(room)
+        if buffer is None:
+            with self._lock:
+                buffer = self._rooms.setdefault(room, deque(maxlen=self.size))
+        buffer.append(message)
+
+    def get(self, room):
+        buffer = self._rooms.get(room)
+        return list(buffer) if buffer is not None else []
+
+
+recent_messages = RecentMessages(settings.CHAT_RECENT_MESSAGES)
+
+_room_ids = LRUCache(10000)
+
+
+def get_room_id(name, create=False):
+    """Return the id of room ``name``, or None if it does not exist and ``create`` is false."""
+    room_id = _room_ids.get(name)
+    if room_id is None:
+        if create:
+            room_id = chat_models.Room.objects.get_or_create(name=name)[0].pk
+        else:
+            room_id = chat_models.Room.objects.filter(name=name).values_list('id', flat=True).first()
+            if room_id is None:
+                # Not cached, so a room created later is found.
+                return None
+        _room_ids.set(name, room_id)
+    return room_id
+
+
+def get_history(room_id, before=None, limit=None):
+    """
+    Return ``(messages, cursor)``: up to ``limit`` messages of a room older
+    than message id ``before``, newest first, and the cursor for the next
+    page or None. Seeks on the (room_id, id) index, so every page costs the
+    same however deep it is.
+    """
+    limit = limit or settings.CHAT_HISTORY_PAGE_SIZE
+    messages = chat_models.Message.objects.filter(room_id=room_id)
+    if before is not None:
+        messages = messages.filter(id__lt=before)
+    messages = list(
+        messages.order_by('-id').values('id', 'user_id', 'text', 'created_at')[:limit]
+    )
+    cursor = messages[-1]['id'] if len(messages) == limit else None
+    return messages, cursor
+
+
+def get_cursor(room_id, sent_before=None):
+    """
+    Return the history cursor for the messages of a room sent before
+    ``sent_before``, or for all of them, and None if there are none. Recent
+    messages have no ids yet, so this is where a client pages on from.
+    """
+    messages = chat_models.Message.objects.filter(room_id=room_id)
+    if sent_before is not None:
+        messages = messages.filter(created_at__lt=sent_before)
+    newest = messages.order_by('-id').values_list('id', flat=True).first()
+    return newest + 1 if newest is not None else None
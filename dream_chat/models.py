@@ -1,3 +1,33 @@
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
-# Create your models here.
+
+class Room(models.Model):
+    name = models.CharField(max_length=64, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'chat_room'
+
+    def __str__(self):
+        return 'Room: {}'.format(self.name)
+
+
+class Message(models.Model):
+    # Indexed through (room, id) below.
+    room = models.ForeignKey(Room, related_name='messages', on_delete=models.CASCADE, db_index=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='chat_messages', on_delete=models.CASCADE)
+    text = models.TextField()
+    # When the message was sent, which is earlier than when it is written.
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'chat_message'
+        indexes = [
+            # Keyset pagination of a room's history.
+            models.Index(fields=['room', 'id'], name='chat_message_room_id_idx'),
+        ]
+
+    def __str__(self):
+        return 'Message (room {}, user {})'.format(self.room_id, self.user_id)
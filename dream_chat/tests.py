@@ -1,3 +1,49 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.db import OperationalError
+from django.test import TransactionTestCase
+
+from dream_chat import models as chat_models
+from dream_chat.writer import MessageWriter
+from dream_users import models as user_models
+
+
+class MessageWriterTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = user_models.User.objects.create(email='writer@example.com', username='writer')
+        self.room = chat_models.Room.objects.create(name='writer')
+        # Flushed by hand only.
+        self.writer = MessageWriter(batch_size=100, interval=3600, max_pending=5)
+
+    def message(self, text):
+        return chat_models.Message(room_id=self.room.pk, user_id=self.user.pk, text=text)
+
+    def written(self):
+        return list(chat_models.Message.objects.order_by('id').values_list('text', flat=True))
+
+    def test_full_buffer_sheds_the_oldest(self):
+        for i in range(7):
+            self.writer.add(self.message(str(i)))
+        self.assertEqual(self.writer.flush(), 5)
+        self.assertEqual(self.written(), ['2', '3', '4', '5', '6'])
+
+    def test_rejected_message_is_dropped_and_the_rest_written(self):
+        messages = [self.message(str(i)) for i in range(5)]
+        messages[3].room_id = None
+        for message in messages:
+            self.writer.add(message)
+        with self.assertLogs('dream_chat.writer', 'ERROR'):
+            self.assertEqual(self.writer.flush(), 4)
+        self.assertEqual(self.written(), ['0', '1', '2', '4'])
+        self.assertEqual(self.writer.drain(), [])
+
+    def test_failed_flush_keeps_messages_for_the_next(self):
+        for i in range(3):
+            self.writer.add(self.message(str(i)))
+        with mock.patch.object(chat_models.Message.objects, 'bulk_create', side_effect=OperationalError):
+            with self.assertRaises(OperationalError):
+                self.writer.flush()
+        self.writer.add(self.message('3'))
+        self.assertEqual(self.writer.flush(), 4)
+        self.assertEqual(self.written(), ['0', '1', '2', '3'])
@@ -0,0 +1,125 @@
+"""
+Write-behind persistence of chat messages.
+
+Consumers only append messages to an in-process buffer. A background
+thread writes the buffer with ``bulk_create`` once it holds
+``CHAT_WRITE_BATCH_SIZE`` messages or every ``CHAT_WRITE_FLUSH_INTERVAL``
+seconds, whichever comes first. Messages still buffered when the process
+dies are lost, at most one interval's worth. A batch the database rejects
+is split until the offending messages are found; those are logged and
+dropped so they cannot hold back the rest.
+"""
+import atexit
+import logging
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.db import DataError, IntegrityError, connections
+
+from core import metrics
+from dream_chat import models as chat_models
+
+_logger = logging.getLogger(__name__)
+
+flushed_messages = metrics.counter(
+    'chat_messages_flushed_total',
+    'Chat messages written to the database.',
+)
+dropped_messages = metrics.counter(
+    'chat_messages_dropped_total',
+    'Chat messages dropped, by reason: the write buffer was full or the database rejected them.',
+    labelnames=('reason',),
+)
+pending_messages = metrics.gauge(
+    'chat_messages_pending',
+    'Chat messages buffered and not yet written.',
+)
+
+
+class MessageWriter(object):
+
+    def __init__(self, batch_size, interval, max_pending):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_pending = max_pending
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._full = threading.Event()
+        self._thread = None
+
+    def add(self, message):
+        """Buffer an unsaved ``Message``; never blocks on the database."""
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                # The database is not keeping up, shed the oldest.
+                self._pending.popleft()
+                dropped_messages.labels(reason='overflow').inc()
+            self._pending.append(message)
+            pending_messages.set(len(self._pending))
+            if len(self._pending) >= self.batch_size:
+                self._full.set()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='chat-message-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def drain(self):
+        with self._lock:
+            pending, self._pending = list(self._pending), deque()
+            self._full.clear()
+            pending_messages.set(0)
+        return pending
+
+    def flush(self):
+        messages = self.drain()
+        if not messages:
+            return 0
+        written = 0
+        # Batches still to write, the next one last.
+        batches = [messages]
+        try:
+            while batches:
+                batch = batches[-1]
+                try:
+                    chat_models.Message.objects.bulk_create(batch, batch_size=self.batch_size)
+                except (DataError, IntegrityError):
+                    batches.pop()
+                    if len(batch) == 1:
+                        _logger.exception('Dropping chat message the database rejects: {}'.format(batch[0]))
+                        dropped_messages.labels(reason='rejected').inc()
+                    else:
+                        half = len(batch) // 2
+                        batches += [batch[half:], batch[:half]]
+                else:
+                    batches.pop()
+                    written += len(batch)
+        except Exception:
+            unwritten = [message for batch in reversed(batches) for message in batch]
+            with self._lock:
+                # Retry with the next flush, still shedding the oldest.
+                overflow = max(0, len(unwritten) + len(self._pending) - self.max_pending)
+                self._pending.extendleft(reversed(unwritten[overflow:]))
+                dropped_messages.labels(reason='overflow').inc(min(overflow, len(unwritten)))
+                pending_messages.set(len(self._pending))
+            raise
+        finally:
+            flushed_messages.inc(written)
+        return written
+
+    def _run(self):
+        while True:
+            self._full.wait(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                _logger.exception('Failed to write chat messages')
+            finally:
+                connections.close_all()
+
+
+message_writer = MessageWriter(
+    batch_size=settings.CHAT_WRITE_BATCH_SIZE,
+    interval=settings.CHAT_WRITE_FLUSH_INTERVAL,
+    max_pending=settings.CHAT_WRITE_MAX_PENDING,
+)
@@ -0,0 +1 @@
+default_app_config = 'dream_users.apps.DreamUsersConfig'
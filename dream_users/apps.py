@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class DreamUsersConfig(AppConfig):
     name = 'dream_users'
+
+    def ready(self):
+        from dream_users import signals  # noqa: F401
+        from dream_users.signed_tokens import check_signing_key
+        check_signing_key()
@@ -5,7 +5,14 @@ from django.conf import settings
 from rest_framework import exceptions
 from rest_framework.authentication import TokenAuthentication
 
+from core import db_router
+
 from . import models as user_models
+from . import signed_tokens
+from .cache import get_user, token_cache, user_cache
+
+# Signed tokens always contain the signer separator, hex token keys never do.
+signing_separator = ':'
 
 
 class BearerAuthentication(TokenAuthentication):
@@ -13,11 +20,28 @@ class BearerAuthentication(TokenAuthentication):
     model = user_models.Token
 
     def authenticate_credentials(self, key):
-        model = self.get_model()
-        try:
-            token = model.objects.select_related('user').get(key=key)
-        except model.DoesNotExist:
-            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        token = token_cache.get(key) if settings.TOKEN_CACHE_ENABLED else None
+        if token is not None:
+            user = get_user(token.user_id)
+            if user is None:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            token.user = user
+        else:
+            model = self.get_model()
+            tokens = model.objects.select_related('user')
+            if settings.TOKEN_CACHE_ENABLED:
+                # What is read here is cached for everyone; a lagging replica
+                # could bring back a token that was just revoked.
+                tokens = tokens.using(db_router.PRIMARY)
+            token = tokens.filter(key=key).first()
+            if token is None and settings.DATABASE_REPLICAS:
+                # A token issued moments ago may not have reached the replica.
+                token = tokens.using(db_router.PRIMARY).filter(key=key).first()
+            if token is None:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            if settings.TOKEN_CACHE_ENABLED and token.user.is_active:
+                token_cache.set(token)
+                user_cache.set(token.user_id, token.user)
 
         utc_now = timezone.now()
         expired_time = token.created + timedelta(seconds=settings.EXPIRED_TOKEN_TIME)
@@ -27,4 +51,26 @@ class BearerAuthentication(TokenAuthentication):
         if not token.user.is_active:
             raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
 
-        return (token.user, token)
\ No newline at end of file
+        return (token.user, token)
+
+
+class SignedBearerAuthentication(TokenAuthentication):
+    """
+    Verifies stateless signed access tokens. Keys that are not signed
+    tokens are left to the next authentication class.
+    """
+    keyword = 'Bearer'
+
+    def authenticate_credentials(self, key):
+        if signing_separator not in key:
+            return None
+
+        try:
+            user, token = signed_tokens.verify(key)
+        except signed_tokens.InvalidToken as e:
+            raise exceptions.AuthenticationFailed(e.args[0])
+
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        return (user, token)
@@ -0,0 +1,177 @@
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+from core import metrics
+from core.cache import LRUCache
+from core.db_router import PRIMARY
+from dream_users import models as user_models
+
+INVALID_SOCIAL_TOKEN = 'invalid'
+
+cache_requests = metrics.counter(
+    'auth_cache_requests_total',
+    'Authentication cache lookups by cache, tier and result.',
+    labelnames=('cache', 'tier', 'result'),
+)
+
+
+class TwoTierCache(object):
+    """
+    Cache with a small per process LRU in front of the shared Django cache
+    backend. Processes cannot invalidate each other's local tier, so keep
+    its TTL short.
+    """
+
+    def __init__(self, name, local_size, local_ttl, shared_ttl, alias):
+        self.name = name
+        self.local = LRUCache(local_size)
+        self.local_ttl = local_ttl
+        self.shared_ttl = shared_ttl
+        self.alias = alias
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    def make_key(self, key):
+        # Keys may be bearer tokens, never put them into a shared cache raw.
+        return 'auth:{}:{}'.format(self.name, hashlib.sha256(str(key).encode()).hexdigest())
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not None:
+            self._count('local', 'hit')
+            return value
+        self._count('local', 'miss')
+
+        value = self.shared.get(self.make_key(key))
+        if value is None:
+            self._count('shared', 'miss')
+            return None
+        self._count('shared', 'hit')
+
+        self.local.set(key, value, self.local_ttl)
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.shared_ttl if ttl is None else min(ttl, self.shared_ttl)
+        if ttl <= 0:
+            return
+        self.shared.set(self.make_key(key), value, ttl)
+        self.local.set(key, value, min(ttl, self.local_ttl))
+
+    def invalidate(self, *keys):
+        for key in keys:
+            self.local.delete(key)
+        self.shared.delete_many([self.make_key(key) for key in keys])
+
+    def _count(self, tier, result):
+        cache_requests.labels(cache=self.name, tier=tier, result=result).inc()
+
+    def stats(self):
+        return {
+            '{tier}_{result}'.format(**labels): child.value
+            for labels, child in cache_requests.samples()
+            if labels['cache'] == self.name
+        }
+
+
+class TokenCache(TwoTierCache):
+    """
+    Authenticated ``Token`` rows keyed by token key. Only the owner's id and
+    the creation time are cached; callers resolve the user through
+    ``get_user`` so a saved user is seen as soon as ``user_cache`` drops it.
+    Entries never outlive the token's own expiry.
+    """
+
+    def get(self, key):
+        value = super(TokenCache, self).get(key)
+        if value is None:
+            return None
+        user_id, created = value
+        return user_models.Token(key=key, user_id=user_id, created=created)
+
+    def set(self, token):
+        expired_time = token.created + timedelta(seconds=settings.EXPIRED_TOKEN_TIME)
+        ttl = int((expired_time - timezone.now()).total_seconds())
+        super(TokenCache, self).set(token.key, (token.user_id, token.created), ttl)
+
+    def invalidate_user(self, user_id):
+        keys = list(user_models.Token.objects.filter(user_id=user_id).values_list('key', flat=True))
+        if keys:
+            self.invalidate(*keys)
+
+
+class UserCache(TwoTierCache):
+    """
+    Users keyed by id, cached without their password hash. Cached users come
+    back with ``password`` deferred, so reading it loads it from the
+    database and ``save()`` leaves it alone.
+
+    Entries are dropped by the ``User`` save and delete signals only. Code
+    changing users with ``QuerySet.update()`` must call ``invalidate`` for
+    them, and ``token_cache.invalidate_user`` when deactivating them.
+    """
+    excluded_fields = ('password',)
+
+    def get(self, key):
+        value = super(UserCache, self).get(key)
+        if value is None:
+            return None
+        return user_models.User.from_db(PRIMARY, list(value), list(value.values()))
+
+    def set(self, key, user):
+        super(UserCache, self).set(key, {
+            field.attname: getattr(user, field.attname)
+            for field in user_models.User._meta.concrete_fields
+            if field.attname not in self.excluded_fields
+        })
+
+
+token_cache = TokenCache(
+    'token',
+    local_size=settings.TOKEN_CACHE_LOCAL_SIZE,
+    local_ttl=settings.TOKEN_CACHE_LOCAL_TTL,
+    shared_ttl=settings.TOKEN_CACHE_SHARED_TTL,
+    alias=settings.TOKEN_CACHE_ALIAS,
+)
+
+user_cache = UserCache(
+    'user',
+    local_size=settings.TOKEN_CACHE_LOCAL_SIZE,
+    local_ttl=settings.TOKEN_CACHE_LOCAL_TTL,
+    shared_ttl=settings.TOKEN_CACHE_SHARED_TTL,
+    alias=settings.TOKEN_CACHE_ALIAS,
+)
+
+# Social access token -> resolved {id, name} profile, or INVALID_SOCIAL_TOKEN.
+social_profile_cache = TwoTierCache(
+    'social_profile',
+    local_size=settings.TOKEN_CACHE_LOCAL_SIZE,
+    local_ttl=settings.TOKEN_CACHE_LOCAL_TTL,
+    shared_ttl=settings.SOCIAL_PROFILE_CACHE_TTL,
+    alias=settings.TOKEN_CACHE_ALIAS,
+)
+
+# Facebook id -> user id.
+social_user_cache = TwoTierCache(
+    'social_user',
+    local_size=settings.TOKEN_CACHE_LOCAL_SIZE,
+    local_ttl=settings.TOKEN_CACHE_LOCAL_TTL,
+    shared_ttl=settings.TOKEN_CACHE_SHARED_TTL,
+    alias=settings.TOKEN_CACHE_ALIAS,
+)
+
+
+def get_user(user_id):
+    user = user_cache.get(user_id)
+    if user is None:
+        # Read from the primary, a replica may still show a deactivated user.
+        user = user_models.User.objects.using(PRIMARY).filter(pk=user_id).first()
+        if user is not None:
+            user_cache.set(user_id, user)
+    return user
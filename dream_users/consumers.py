@@ -0,0 +1,171 @@
+import json
+import logging
+import time
+from urllib.parse import parse_qsl
+
+from channels.generic.http import AsyncHttpConsumer
+from django.contrib.auth import authenticate
+from django.db import IntegrityError, transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.renderers import JSONRenderer
+
+from core import outbox, profiling, request_metrics
+from core.executors import run_in_executor
+from dream_users import login_activity
+from dream_users import models as user_models
+from dream_users import serializers as user_sers
+from dream_users import utils as user_utils
+from dream_users.tasks import EMAIL_REGISTER_CONFIRM, send_user_email
+
+_logger = logging.getLogger(__name__)
+
+
+class APIConsumer(AsyncHttpConsumer):
+    """
+    Async counterpart of a POST only ``APIView``. Subclasses implement
+    ``post(data)`` returning ``(status, data)``; blocking work must go
+    through ``run``, so it counts towards the request's metrics and
+    profile. Password hashing is bounded by the hasher itself, so it runs
+    on the ``db`` pool like other ORM work.
+    """
+
+    @property
+    def route(self):
+        # Named like the view_name of an unnamed class based view.
+        return '{}.{}'.format(type(self).__module__, type(self).__name__)
+
+    async def handle(self, body):
+        self.stats = request_metrics.RequestStats()
+        self.profile = None
+        header = dict(self.scope.get('headers', [])).get(profiling.PROFILE_ASGI_HEADER)
+        if profiling.should_profile(header.decode('latin1') if header is not None else None):
+            self.profile = profiling.Profile('request-{}'.format(self.route))
+        start = time.perf_counter()
+        try:
+            await self.respond(body)
+        finally:
+            request_metrics.observe(self.scope['method'], self.route, self.stats, time.perf_counter() - start)
+            if self.profile is not None:
+                profiling.finish_profile(self.profile)
+
+    def run(self, executor, func, *args, **kwargs):
+        """``run_in_executor`` on behalf of this request."""
+        with request_metrics.bind(self.stats), profiling.bind(self.profile):
+            return run_in_executor(executor, func, *args, **kwargs)
+
+    async def respond(self, body):
+        if self.scope['method'] != 'POST':
+            await self.send_data(status.HTTP_405_METHOD_NOT_ALLOWED, {'detail': 'Method not allowed.'})
+            return
+
+        try:
+            data = self.parse(body)
+        except ValueError:
+            await self.send_data(status.HTTP_400_BAD_REQUEST, {'detail': 'Malformed request.'})
+            return
+
+        try:
+            response_status, response_data = await self.post(data)
+        except APIException as e:
+            response_status, response_data = e.status_code, {'detail': e.detail}
+        await self.send_data(response_status, response_data)
+
+    def parse(self, body):
+        headers = dict(self.scope.get('headers', []))
+        content_type = headers.get(b'content-type', b'').decode('latin1')
+        if content_type.startswith('application/x-www-form-urlencoded'):
+            return dict(parse_qsl(body.decode()))
+        return json.loads(body.decode() or '{}')
+
+    async def send_data(self, response_status, data):
+        body = JSONRenderer().render(data) if data is not None else b''
+        await self.send_response(response_status, body, headers=[
+            (b'Content-Type', b'application/json'),
+        ])
+
+    async def post(self, data):
+        raise NotImplementedError
+
+
+def complete_login(user, device_id=None):
+    access_token, expired_time = user_utils.issue_access_token(user, device_id)
+    login_activity.record(user.id)
+    data = {
+        'access_token': access_token,
+        'expired_time': expired_time,
+        'user': user
+    }
+    return user_sers.TokenSerializer(data).data
+
+
+class LoginEmailConsumer(APIConsumer):
+
+    async def post(self, data):
+        validator = user_sers.LoginEmailValidator(data=data)
+        if not validator.is_valid():
+            _logger.error(validator.errors)
+            return status.HTTP_400_BAD_REQUEST, validator.errors
+
+        email = validator.validated_data['email']
+        password = validator.validated_data['password']
+        user = await self.run('db', authenticate, email=email, password=password)
+        if not user:
+            _logger.error('Incorrect email: {} or password: ******'.format(email))
+            return status.HTTP_401_UNAUTHORIZED, 'Incorrect email or password'
+
+        return status.HTTP_200_OK, await self.run(
+            'db', complete_login, user, validator.validated_data.get('device_id'))
+
+
+class LoginFacebookConsumer(APIConsumer):
+
+    async def post(self, data):
+        validator = user_sers.LoginFacebookValidator(data=data)
+        if not validator.is_valid():
+            return status.HTTP_400_BAD_REQUEST, validator.errors
+
+        fb_access_token = validator.validated_data['fb_access_token']
+        try:
+            profiles = await self.run('http', user_utils.get_facebook_profile, fb_access_token)
+            fb_id = profiles['id']
+            user_name = profiles['name']
+        except user_utils.SocialProfileUnavailable:
+            return status.HTTP_503_SERVICE_UNAVAILABLE, 'Facebook is unavailable'
+        except Exception:
+            return status.HTTP_401_UNAUTHORIZED, 'Incorrect facebook id'
+
+        user = await self.run('db', user_utils.get_or_create_facebook_user, fb_id, user_name)
+        return status.HTTP_200_OK, await self.run(
+            'db', complete_login, user, validator.validated_data.get('device_id'))
+
+
+def create_inactive_user(email, password):
+    user = user_models.User(email=email, is_active=False)
+    user.set_password(password)
+    with transaction.atomic():
+        user.save()
+        outbox.enqueue(send_user_email, user.id, EMAIL_REGISTER_CONFIRM)
+    return user
+
+
+class RegisterEmailConsumer(APIConsumer):
+
+    async def post(self, data):
+        validator = user_sers.RegisterEmailValidator(data=data)
+        if not validator.is_valid():
+            return status.HTTP_400_BAD_REQUEST, validator.errors
+
+        email = validator.validated_data['email']
+        password = validator.validated_data['password']
+        exists = await self.run('db', user_models.User.objects.filter(email=email).exists)
+        if exists:
+            return status.HTTP_409_CONFLICT, 'Email already exists'
+
+        try:
+            user = await self.run('db', create_inactive_user, email, password)
+        except IntegrityError:
+            # The existence check may have read a lagging replica.
+            return status.HTTP_409_CONFLICT, 'Email already exists'
+
+        return status.HTTP_200_OK, user_sers.UserSerializer(user).data
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+from core.executors import run_bounded
+
+
+class BoundedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2 hasher that runs on the bounded ``hashing`` executor, so a login
+    burst cannot occupy every CPU, and sheds load with a 503 once too many
+    hashes are queued. Same algorithm name as Django's hasher, existing
+    passwords keep verifying and are upgraded to the configured iterations.
+    """
+    iterations = settings.PASSWORD_HASHER_ITERATIONS
+
+    def encode(self, password, salt, iterations=None):
+        return run_bounded('hashing', super(BoundedPBKDF2PasswordHasher, self).encode,
+                           password, salt, iterations)
@@ -0,0 +1,168 @@
+"""
+Write-behind recording of login days.
+
+With ``LOGIN_ACTIVITY_BUFFER`` set, a login only notes "user X was active
+on day D" in a buffer, and a periodic flush writes every buffered pair to
+``LoginHistory`` with ``bulk_update_login_history``. Repeat logins on the
+same day are dropped at the buffer.
+
+``'local'`` buffers in process and flushes from a background thread;
+``'cache'`` buffers in the shared cache and is flushed by the
+``flush_login_activity`` Celery task.
+"""
+import atexit
+import logging
+import threading
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.utils import timezone
+
+from core import metrics
+from dream_users import utils as user_utils
+
+_logger = logging.getLogger(__name__)
+
+SEQ_KEY = 'login_activity:seq'
+MARK_KEY = 'login_activity:mark'
+FLUSHED_KEY = 'login_activity:flushed'
+SEEN_TIMEOUT = 2 * 86400
+
+flushed_logins = metrics.counter(
+    'login_activity_flushed_total',
+    'Buffered login days written to login history.',
+)
+
+
+class ActivityBuffer(object):
+
+    def add(self, user_id, login_day):
+        raise NotImplementedError
+
+    def drain(self):
+        """Remove and return the buffered ``(user_id, login_day)`` pairs."""
+        raise NotImplementedError
+
+    def ack(self):
+        """Called once drained pairs are safely written."""
+
+    def flush(self):
+        user_days = self.drain()
+        if user_days:
+            user_utils.bulk_update_login_history(user_days)
+            flushed_logins.inc(len(user_days))
+        self.ack()
+        return len(user_days)
+
+
+class LocalActivityBuffer(ActivityBuffer):
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, user_id, login_day):
+        with self._lock:
+            self._pending.add((user_id, login_day))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='login-activity-flush', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def drain(self):
+        with self._lock:
+            pending, self._pending = self._pending, set()
+        return pending
+
+    def _run(self):
+        stopped = threading.Event()
+        while not stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                _logger.exception('Failed to flush login activity')
+            finally:
+                connections.close_all()
+
+
+class CacheActivityBuffer(ActivityBuffer):
+    """
+    Buffered pairs live in numbered cache slots handed out by an atomic
+    ``incr``. A flush only drains slots numbered up to the head seen by the
+    previous flush, so writers have had a full interval to fill them.
+    """
+
+    def __init__(self, alias):
+        self.alias = alias
+        self._draining = None
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def add(self, user_id, login_day):
+        seen_key = 'login_activity:seen:{}:{}'.format(login_day.isoformat(), user_id)
+        if not self.cache.add(seen_key, 1, SEEN_TIMEOUT):
+            return
+
+        self.cache.add(SEQ_KEY, 0, None)
+        seq = self.cache.incr(SEQ_KEY)
+        self.cache.set(self._slot_key(seq), (user_id, login_day.toordinal()), SEEN_TIMEOUT)
+
+    def drain(self):
+        head = self.cache.get(SEQ_KEY, 0)
+        upto = self.cache.get(MARK_KEY, 0)
+        start = self.cache.get(FLUSHED_KEY, 0)
+        self.cache.set(MARK_KEY, head, None)
+        if upto <= start:
+            return set()
+
+        keys = [self._slot_key(seq) for seq in range(start + 1, upto + 1)]
+        slots = self.cache.get_many(keys)
+        self._draining = (upto, keys)
+        if len(slots) < len(keys):
+            _logger.warning('Lost {} buffered login days'.format(len(keys) - len(slots)))
+        return {
+            (user_id, date.fromordinal(day))
+            for user_id, day in slots.values()
+        }
+
+    def ack(self):
+        if self._draining is not None:
+            upto, keys = self._draining
+            self.cache.set(FLUSHED_KEY, upto, None)
+            self.cache.delete_many(keys)
+            self._draining = None
+
+    @staticmethod
+    def _slot_key(seq):
+        return 'login_activity:slot:{}'.format(seq)
+
+
+def _build_buffer():
+    if settings.LOGIN_ACTIVITY_BUFFER == 'local':
+        return LocalActivityBuffer(settings.LOGIN_ACTIVITY_FLUSH_INTERVAL)
+    if settings.LOGIN_ACTIVITY_BUFFER == 'cache':
+        return CacheActivityBuffer(settings.LOGIN_ACTIVITY_CACHE_ALIAS)
+    return None
+
+
+activity_buffer = _build_buffer()
+
+
+def record(user_id):
+    login_day = timezone.now().date()
+    if activity_buffer is None:
+        user_utils.create_or_update_login_history(user_id, login_day)
+    else:
+        activity_buffer.add(user_id, login_day)
+
+
+def flush():
+    if activity_buffer is None:
+        return 0
+    return activity_buffer.flush()
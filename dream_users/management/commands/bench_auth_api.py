@@ -0,0 +1,241 @@
+import json
+from datetime import timedelta
+from urllib.parse import parse_qs, urlsplit
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from core import outbox, request_metrics
+from core.loadtest import run_load, stub_json_server
+from core.models import OutboxMessage
+from dream import celery_app
+from dream_users import models as user_models
+from dream_users.tasks import EMAIL_REGISTER_CONFIRM, send_user_email
+
+EMAIL_PREFIX = 'bench-auth-'
+SCENARIOS = ('login_email', 'login_facebook', 'register', 'confirm', 'reset_password', 'logout', 'mail')
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed bench users, drive the auth API in process at a given concurrency and '
+        'report throughput, latency percentiles and queries per request. Facebook is '
+        'served by a local stub. Requests queue mail in the outbox; the mail scenario '
+        'runs queued mail tasks in process against SES, by default the in-memory '
+        'client. With --baseline, fail when a scenario regressed against a stored result.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--requests', type=int, default=200, help='Requests per scenario.')
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+        parser.add_argument('--password', default='bench-pass1')
+        parser.add_argument('--baseline', help='JSON file of a previous run to compare against.')
+        parser.add_argument('--save-baseline', help='Write this run\'s results to a JSON file.')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Allowed relative drop in throughput or rise in p95 latency.')
+        parser.add_argument('--keep-data', action='store_true')
+        parser.add_argument('--ses-backend', choices=('local', 'aws'), default='local',
+                            help='\'aws\' sends through SES_ENDPOINT_URL, e.g. a local SES emulator.')
+        parser.add_argument('--ses-latency', type=float, default=0,
+                            help='Seconds each send to the in-memory SES client takes.')
+        parser.add_argument('--confirm-database', metavar='NAME',
+                            help='Name of the database to seed and clean up, it must be a throwaway one.')
+
+    def handle(self, *args, **options):
+        database = connections[DEFAULT_DB_ALIAS].settings_dict['NAME']
+        if options['confirm_database'] != database:
+            raise CommandError(
+                'This creates and deletes {}* users and their data in database {}. Run it against a '
+                'throwaway database only, with --confirm-database {}.'.format(EMAIL_PREFIX, database, database))
+
+        self.cleanup()
+        self.users = self.seed(options['users'], options['password'])
+        self.password = options['password']
+
+        results = {}
+        try:
+            # The test client sends Host: testserver; mail waits in the outbox
+            # for the mail scenario.
+            with stub_json_server(self.facebook_profile) as facebook_url, override_settings(
+                    ALLOWED_HOSTS=settings.ALLOWED_HOSTS + ['testserver'],
+                    URL_GET_ID_FACEBOOK=facebook_url + '/me?access_token=',
+                    SES_BACKEND=options['ses_backend'], SES_LOCAL_LATENCY=options['ses_latency'],
+                    OUTBOX_ENABLED=True):
+                self.stdout.write('{:<16} {:>8} {:>7} {:>9} {:>9} {:>9} {:>9} {:>10}'.format(
+                    'scenario', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'queries'))
+                for scenario in options['scenarios']:
+                    results[scenario] = self.run(scenario, options['requests'], options['concurrency'])
+        finally:
+            if not options['keep_data']:
+                self.cleanup()
+
+        failed = ['{}: {} of {}'.format(scenario, result['errors'], result['requests'])
+                  for scenario, result in sorted(results.items()) if result['errors']]
+        if failed:
+            raise CommandError('Requests failed, results are not comparable:\n  ' + '\n  '.join(failed))
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            self.compare(results, baseline, options['tolerance'])
+
+    @staticmethod
+    def queued_mail(user_ids):
+        """Return the outbox messages mailing any of ``user_ids``."""
+        return [
+            message for message in OutboxMessage.objects.filter(task_name=send_user_email.name).order_by('id')
+            if json.loads(message.args)[0] in user_ids
+        ]
+
+    def cleanup(self):
+        users = user_models.User.objects.filter(email__startswith=EMAIL_PREFIX)
+        # Registrations queue their confirmation mail in the outbox.
+        OutboxMessage.objects.filter(
+            id__in=[message.id for message in self.queued_mail(set(users.values_list('id', flat=True)))]
+        ).delete()
+        users.delete()
+
+    @staticmethod
+    def seed(num_users, password):
+        # One hash for every user keeps seeding fast; logins still verify it.
+        password_hash = make_password(password)
+        yesterday = timezone.now().date() - timedelta(days=1)
+        user_models.User.objects.bulk_create([
+            user_models.User(
+                email='{}{}@example.com'.format(EMAIL_PREFIX, i),
+                username='bench-auth-{}'.format(i),
+                password=password_hash,
+                facebook_id='bench-auth-fb-{}'.format(i),
+            )
+            for i in range(num_users)
+        ])
+        users = list(user_models.User.objects.filter(email__startswith=EMAIL_PREFIX).order_by('id'))
+        user_models.LoginHistory.objects.bulk_create([
+            user_models.LoginHistory(user=user, start_date=yesterday - timedelta(days=7), end_date=yesterday,
+                                     num_date=8)
+            for user in users
+        ])
+        return users
+
+    def facebook_profile(self, method, path):
+        token = parse_qs(urlsplit(path).query).get('access_token', [''])[0]
+        return 200, {'id': 'bench-auth-fb-{}'.format(token), 'name': 'bench-auth-{}'.format(token)}
+
+    def prepare(self, scenario, num_requests):
+        """Return ``send(client, i)`` for ``scenario``, seeding single use tokens it consumes."""
+        users = self.users
+
+        def user(i):
+            return users[i % len(users)]
+
+        if scenario == 'login_email':
+            return lambda client, i: client.post(
+                '/login/email/', {'email': user(i).email, 'password': self.password},
+                content_type='application/json').status_code == 200
+
+        if scenario == 'login_facebook':
+            return lambda client, i: client.post(
+                '/login/facebook/', {'fb_access_token': str(i % len(users))},
+                content_type='application/json').status_code == 200
+
+        if scenario == 'register':
+            run_id = timezone.now().strftime('%Y%m%d%H%M%S%f')
+            return lambda client, i: client.post(
+                '/register/', {'email': '{}new-{}-{}@example.com'.format(EMAIL_PREFIX, run_id, i),
+                               'password': self.password},
+                content_type='application/json').status_code == 200
+
+        if scenario == 'confirm':
+            tokens = [user_models.ConfirmEmailToken(user=user(i)) for i in range(num_requests)]
+            for token in tokens:
+                token.token = token.generate_confirm_email_token()
+            user_models.ConfirmEmailToken.objects.bulk_create(tokens)
+            return lambda client, i: client.get('/confirm/{}/'.format(tokens[i].token)).status_code == 200
+
+        if scenario == 'reset_password':
+            tokens = [user_models.ResetToken(user=user(i)) for i in range(num_requests)]
+            for token in tokens:
+                token.reset_token = token.generate_reset_token()
+            user_models.ResetToken.objects.bulk_create(tokens)
+            # Reset to the same password so later logins keep working.
+            return lambda client, i: client.post(
+                '/reset-password/', {'reset_token': tokens[i].reset_token, 'password': self.password,
+                                     'confirm_password': self.password},
+                content_type='application/json').status_code == 200
+
+        if scenario == 'logout':
+            tokens = [user_models.Token(user=user(i)) for i in range(num_requests)]
+            for token in tokens:
+                token.key = token.generate_key()
+            user_models.Token.objects.bulk_create(tokens)
+            return lambda client, i: client.post(
+                '/logout/', HTTP_AUTHORIZATION='Bearer {}'.format(tokens[i].key)).status_code == 204
+
+        if scenario == 'mail':
+            for i in range(num_requests):
+                outbox.enqueue(send_user_email, user(i).id, EMAIL_REGISTER_CONFIRM)
+            messages = self.queued_mail({user.id for user in users})[-num_requests:]
+
+            def deliver(client, i):
+                # What a worker does with the message once it is relayed.
+                message = messages[i]
+                result = celery_app.tasks[message.task_name].apply(
+                    args=json.loads(message.args), kwargs=json.loads(message.kwargs))
+                message.delete()
+                return result.successful() and result.result is True
+
+            return deliver
+
+        raise CommandError('Unknown scenario {}'.format(scenario))
+
+    def run(self, scenario, num_requests, concurrency):
+        send = self.prepare(scenario, num_requests)
+        queries_before = self.total_queries()
+        result = run_load(send, num_requests, concurrency, make_state=Client)
+        queries, handled = (after - before for after, before in zip(self.total_queries(), queries_before))
+
+        summary = result.summary()
+        summary['queries'] = queries / handled if handled else 0
+        self.stdout.write('{:<16} {:>8} {:>7} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>10.2f}'.format(
+            scenario, summary['requests'], summary['errors'], summary['throughput'],
+            summary['p50'] * 1000, summary['p95'] * 1000, summary['p99'] * 1000, summary['queries']))
+        return summary
+
+    @staticmethod
+    def total_queries():
+        """Return ``(queries, requests)`` recorded by the request metrics so far."""
+        samples = request_metrics.request_queries.samples()
+        return sum(child.sum for _, child in samples), sum(child.count for _, child in samples)
+
+    def compare(self, results, baseline, tolerance):
+        regressions = []
+        for scenario, result in sorted(results.items()):
+            base = baseline.get(scenario)
+            if base is None:
+                continue
+            if result['errors'] > base['errors']:
+                regressions.append('{}: {} errors, baseline {}'.format(scenario, result['errors'], base['errors']))
+            if result['throughput'] < base['throughput'] * (1 - tolerance):
+                regressions.append('{}: {:.1f} req/s, baseline {:.1f}'.format(
+                    scenario, result['throughput'], base['throughput']))
+            if result['p95'] > base['p95'] * (1 + tolerance):
+                regressions.append('{}: p95 {:.1f} ms, baseline {:.1f} ms'.format(
+                    scenario, result['p95'] * 1000, base['p95'] * 1000))
+            # Query counts are deterministic, any increase is a regression.
+            if result['queries'] > base['queries'] + 0.05:
+                regressions.append('{}: {:.2f} queries/request, baseline {:.2f}'.format(
+                    scenario, result['queries'], base['queries']))
+
+        if regressions:
+            raise CommandError('Regressed against baseline:\n  ' + '\n  '.join(regressions))
+        self.stdout.write('No regressions against baseline.')
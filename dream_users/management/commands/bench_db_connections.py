@@ -0,0 +1,95 @@
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework import permissions
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+from rest_framework.views import APIView
+
+from core.db.backends.persistent import connect_seconds, connection_checkouts
+from core.loadtest import run_load
+from dream_users import models as user_models
+
+
+class UserLookupAPI(APIView):
+    """One primary key lookup, so connection setup dominates the request."""
+    permission_classes = (permissions.AllowAny,)
+
+    def get(self, request, pk):
+        user = user_models.User.objects.only('pk').get(pk=pk)
+        return Response({'id': user.pk})
+
+
+class Command(BaseCommand):
+    help = 'Compare a query-only endpoint with per request and persistent database connections.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--max-age', type=int, default=60)
+        parser.add_argument('--email', default='bench-db-connections@example.com')
+
+    def handle(self, *args, **options):
+        user, created = user_models.User.objects.get_or_create(
+            email=options['email'], defaults={'username': 'bench-db-connections'})
+
+        settings_dict = connections[DEFAULT_DB_ALIAS].settings_dict
+        max_age = settings_dict['CONN_MAX_AGE']
+        try:
+            for age in (0, options['max_age']):
+                settings_dict['CONN_MAX_AGE'] = age
+                self.run(age, user.pk, options)
+        finally:
+            settings_dict['CONN_MAX_AGE'] = max_age
+            if created:
+                user.delete()
+
+    def run(self, max_age, pk, options):
+        factory = APIRequestFactory()
+        view = UserLookupAPI.as_view()
+        connects = connect_seconds.labels(alias=DEFAULT_DB_ALIAS)
+        connects_before, connect_time_before = connects.count, connects.sum
+        checkouts_before = self.checkouts()
+
+        def send(state, i):
+            # Mirror the handler: connections are recycled around each request.
+            request_started.send(sender=self.__class__)
+            try:
+                response = view(factory.get('/users/{}/'.format(pk)), pk=pk)
+            finally:
+                request_finished.send(sender=self.__class__)
+            return response.status_code == 200
+
+        def close_connections(state):
+            # Connections are per thread, close each worker's before it exits.
+            connections.close_all()
+
+        connections.close_all()
+        result = run_load(send, options['requests'], options['concurrency'], finish_state=close_connections)
+        connections.close_all()
+
+        opened = connects.count - connects_before
+        reused = self.checkouts()[True] - checkouts_before[True]
+        used = reused + self.checkouts()[False] - checkouts_before[False]
+        summary = result.summary()
+        self.stdout.write(
+            'CONN_MAX_AGE={max_age}: {throughput:.1f} req/s, p50 {p50:.1f} ms, p95 {p95:.1f} ms, '
+            '{errors} errors, {opened} connects ({connect_ms:.2f} ms avg), reuse ratio {reuse:.2f}'.format(
+                max_age=max_age,
+                throughput=summary['throughput'],
+                p50=summary['p50'] * 1000,
+                p95=summary['p95'] * 1000,
+                errors=summary['errors'],
+                opened=opened,
+                connect_ms=(connects.sum - connect_time_before) / opened * 1000 if opened else 0,
+                reuse=reused / used if used else 0,
+            )
+        )
+
+    @staticmethod
+    def checkouts():
+        counts = {True: 0, False: 0}
+        for labels, child in connection_checkouts.samples():
+            if labels['alias'] == DEFAULT_DB_ALIAS:
+                counts[labels['reused'] == 'True'] += child.value
+        return counts
@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from core import ses
+from core import tasks as core_tasks
+from core.ratelimit import TokenBucket
+from dream_users import models as user_models
+from dream_users.tasks import EMAIL_BUILDERS, send_user_email
+
+
+class Command(BaseCommand):
+    help = 'Measure send_user_email tasks per second and queries per task against the local SES stand-in.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tasks', type=int, default=500)
+        parser.add_argument('--kind', choices=sorted(EMAIL_BUILDERS), default='register_confirm')
+        parser.add_argument('--email', default='bench-email-tasks@example.com')
+
+    def handle(self, *args, **options):
+        user, _ = user_models.User.objects.get_or_create(
+            email=options['email'], defaults={'username': 'bench-email-tasks'})
+        num_tasks = options['tasks']
+
+        # Measure the task, not the SES send rate limit.
+        send_rates = dict(core_tasks._send_rates)
+        core_tasks._send_rates.update({queue: TokenBucket(num_tasks) for queue in send_rates})
+        with override_settings(SES_BACKEND='local', SES_LOCAL_LATENCY=0):
+            ses._pid = None
+            try:
+                failed = 0
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    for _ in range(num_tasks):
+                        result = send_user_email.apply(args=(user.id, options['kind']))
+                        # The task returns False when nothing was sent.
+                        if not result.successful() or not result.result:
+                            failed += 1
+                    elapsed = time.perf_counter() - start
+            finally:
+                ses._pid = None
+                core_tasks._send_rates.update(send_rates)
+                user_models.ConfirmEmailToken.objects.filter(user=user).delete()
+                user_models.ResetToken.objects.filter(user=user).delete()
+
+        self.stdout.write('{}: {:.1f} tasks/s, {:.2f} queries/task, {:.2f} ms/task, {} failed'.format(
+            options['kind'], num_tasks / elapsed, len(queries) / num_tasks, elapsed / num_tasks * 1000, failed))
+        if failed:
+            raise CommandError('{} of {} tasks failed, the timings above are not valid'.format(failed, num_tasks))
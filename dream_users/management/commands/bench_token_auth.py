@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from dream_users import models as user_models
+from dream_users.auth import BearerAuthentication
+from dream_users.cache import token_cache
+
+
+class Command(BaseCommand):
+    help = 'Compare queries and latency per authenticated request with and without the token cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--email', default='bench-token-auth@example.com')
+
+    def handle(self, *args, **options):
+        user, _ = user_models.User.objects.get_or_create(
+            email=options['email'], defaults={'username': 'bench-token-auth'})
+        token = user_models.Token.objects.create(user=user)
+        try:
+            for enabled in (False, True):
+                token_cache.invalidate(token.key)
+                with override_settings(TOKEN_CACHE_ENABLED=enabled):
+                    self.run(token.key, options['requests'], enabled)
+        finally:
+            token_cache.invalidate(token.key)
+            token.delete()
+
+        self.stdout.write('cache counters: {}'.format(token_cache.stats()))
+
+    def run(self, key, num_requests, enabled):
+        authentication = BearerAuthentication()
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            for _ in range(num_requests):
+                authentication.authenticate_credentials(key)
+            elapsed = time.perf_counter() - start
+
+        self.stdout.write(
+            'cache {state}: {queries:.3f} queries/request, {latency:.1f} us/request'.format(
+                state='on' if enabled else 'off',
+                queries=len(queries) / num_requests,
+                latency=elapsed / num_requests * 1e6,
+            )
+        )
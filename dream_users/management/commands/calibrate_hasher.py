@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Suggest PASSWORD_HASHER_ITERATIONS for a target hashing latency on this machine.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target-ms', type=float, default=100)
+        parser.add_argument('--samples', type=int, default=5)
+
+    def handle(self, *args, **options):
+        hasher = PBKDF2PasswordHasher()
+        salt = hasher.salt()
+        iterations = settings.PASSWORD_HASHER_ITERATIONS
+        hasher.encode('calibrate', salt, iterations)  # warm up
+
+        timings = []
+        for _ in range(options['samples']):
+            start = time.perf_counter()
+            hasher.encode('calibrate', salt, iterations)
+            timings.append(time.perf_counter() - start)
+        elapsed_ms = sorted(timings)[len(timings) // 2] * 1000
+
+        suggested = int(iterations * options['target_ms'] / elapsed_ms) // 1000 * 1000
+        self.stdout.write('{} iterations take {:.1f} ms (median of {}).'.format(
+            iterations, elapsed_ms, options['samples']))
+        self.stdout.write('PASSWORD_HASHER_ITERATIONS = {}  # ~{:.0f} ms'.format(
+            max(suggested, 1000), options['target_ms']))
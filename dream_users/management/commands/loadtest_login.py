@@ -0,0 +1,35 @@
+import requests
+from django.core.management.base import BaseCommand
+
+from core.loadtest import run_load
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive concurrent email logins against running servers, e.g. a WSGI '
+        'server and daphne serving dream.asgi, and compare throughput.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('targets', nargs='+', metavar='NAME=URL',
+                            help='Login endpoint per server, e.g. wsgi=http://127.0.0.1:8000/login/email/')
+        parser.add_argument('--email', required=True)
+        parser.add_argument('--password', required=True)
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=50)
+
+    def handle(self, *args, **options):
+        payload = {'email': options['email'], 'password': options['password']}
+        self.stdout.write('{:<10} {:>8} {:>7} {:>10} {:>9} {:>9} {:>9}'.format(
+            'target', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+        for target in options['targets']:
+            name, url = target.split('=', 1)
+
+            def send(session, i):
+                return session.post(url, json=payload, timeout=30).status_code == 200
+
+            result = run_load(send, options['requests'], options['concurrency'], make_state=requests.Session)
+            summary = result.summary()
+            self.stdout.write('{:<10} {:>8} {:>7} {:>10.1f} {:>9.1f} {:>9.1f} {:>9.1f}'.format(
+                name, summary['requests'], summary['errors'], summary['throughput'],
+                summary['p50'] * 1000, summary['p95'] * 1000, summary['p99'] * 1000))
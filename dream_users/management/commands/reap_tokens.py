@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from dream_users.reaper import reap_expired_tokens
+
+
+class Command(BaseCommand):
+    help = 'Delete expired Token, ResetToken and ConfirmEmailToken rows in bounded batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.REAPER_BATCH_SIZE)
+        parser.add_argument('--batch-sleep', type=float, default=settings.REAPER_BATCH_SLEEP,
+                            help='Seconds to pause between batches.')
+        parser.add_argument('--max-batches', type=int, default=None,
+                            help='Stop after this many batches per table.')
+
+    def handle(self, *args, **options):
+        results = reap_expired_tokens(
+            batch_size=options['batch_size'],
+            batch_sleep=options['batch_sleep'],
+            max_batches=options['max_batches'],
+        )
+        for table, (deleted, elapsed) in results.items():
+            self.stdout.write('{}: deleted {} rows in {:.1f}s ({:.0f} rows/s)'.format(
+                table, deleted, elapsed, deleted / elapsed if elapsed else 0))
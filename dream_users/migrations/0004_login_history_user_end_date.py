@@ -0,0 +1,34 @@
+# Generated by Django 2.1.3 on 2026-10-18 10:20
+
+from django.db import migrations
+from django.db.models import Count
+
+
+def remove_duplicate_streaks(apps, schema_editor):
+    # Concurrent logins could create several rows ending on the same day,
+    # keep the longest one so the unique key can be added.
+    LoginHistory = apps.get_model('dream_users', 'LoginHistory')
+    duplicates = LoginHistory.objects.values('user_id', 'end_date').annotate(
+        rows=Count('id')
+    ).filter(rows__gt=1)
+    for duplicate in duplicates:
+        rows = LoginHistory.objects.filter(
+            user_id=duplicate['user_id'], end_date=duplicate['end_date']
+        ).order_by('-num_date', 'id')
+        keep = rows.first()
+        rows.exclude(pk=keep.pk).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dream_users', '0003_token_created_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_streaks, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='loginhistory',
+            unique_together={('user', 'end_date')},
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.1.3 on 2026-10-18 10:21
+
+from django.db import migrations, models
+import dream_users.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dream_users', '0004_login_history_user_end_date'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='loginhistory',
+            name='end_date',
+            field=models.DateField(default=dream_users.models.today),
+        ),
+        migrations.AlterField(
+            model_name='loginhistory',
+            name='start_date',
+            field=models.DateField(default=dream_users.models.today),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 2.1.3 on 2026-10-18 10:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dream_users', '0005_login_history_date_defaults'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='token',
+            name='device_id',
+            field=models.CharField(blank=True, max_length=64, null=True, verbose_name='Device id'),
+        ),
+        migrations.AddIndex(
+            model_name='token',
+            index=models.Index(fields=['user', 'created'], name='token_user_created_idx'),
+        ),
+    ]
@@ -4,6 +4,7 @@ import os
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 TOKEN_LENGTH = 64
@@ -34,6 +35,7 @@ class User(AbstractUser):
     status = models.IntegerField(choices=STATUS_CHOICES, default=STATUS_WAIT_CONFIRM)
     facebook_id = models.CharField(max_length=150, blank=True, null=True, unique=True)
     line_id = models.CharField(max_length=150, blank=True, null=True, unique=True)
+    token_generation = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -56,10 +58,16 @@ class Token(models.Model):
         settings.AUTH_USER_MODEL, related_name='tokens',
         on_delete=models.CASCADE, verbose_name=_("User")
     )
-    created = models.DateTimeField(_("Created"), auto_now_add=True)
+    created = models.DateTimeField(_("Created"), auto_now_add=True, db_index=True)
+    # Client supplied id of the device the session belongs to, if any.
+    device_id = models.CharField(_("Device id"), max_length=64, blank=True, null=True)
 
     class Meta:
         db_table = 'token'
+        indexes = [
+            # Finding a user's sessions by device and evicting the oldest.
+            models.Index(fields=['user', 'created'], name='token_user_created_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.key:
@@ -80,7 +88,7 @@ class ResetToken(models.Model):
         settings.AUTH_USER_MODEL, related_name='reset_token',
         on_delete=models.CASCADE, verbose_name=_('user')
     )
-    created_at = models.DateTimeField(_("Created"), auto_now_add=True)
+    created_at = models.DateTimeField(_("Created"), auto_now_add=True, db_index=True)
 
     class Meta:
         db_table = 'reset_token'
@@ -104,7 +112,7 @@ class ConfirmEmailToken(models.Model):
         settings.AUTH_USER_MODEL, related_name='confirm_email_token',
         on_delete=models.CASCADE, verbose_name=_('user')
     )
-    created_at = models.DateTimeField(_('Created'), auto_now_add=True)
+    created_at = models.DateTimeField(_('Created'), auto_now_add=True, db_index=True)
 
     class Meta:
         db_table = 'confirm_email_token'
@@ -133,11 +141,21 @@ class Rating(models.Model):
         db_table = 'rating'
 
 
+def today():
+    # The day logins are counted on, as in login_activity.record().
+    return timezone.now().date()
+
+
 class LoginHistory(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    start_date = models.DateField(auto_now_add=True)
-    end_date = models.DateField(auto_now=True)
+    # Plain defaults rather than auto_now so buffered logins can be written
+    # with the day they happened on.
+    start_date = models.DateField(default=today)
+    end_date = models.DateField(default=today)
     num_date = models.IntegerField(default=1)
 
     class Meta:
         db_table = 'login_history'
+        # A user has at most one streak ending on a given day. Also serves
+        # as the (user_id, end_date) index for streak updates.
+        unique_together = ('user', 'end_date')
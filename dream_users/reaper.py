@@ -0,0 +1,62 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from dream_users import models as user_models
+
+_logger = logging.getLogger(__name__)
+
+
+def get_expired_token_models():
+    """Return ``(model, created field, lifetime in seconds)`` triples to reap."""
+    return (
+        (user_models.Token, 'created', settings.EXPIRED_TOKEN_TIME),
+        (user_models.ResetToken, 'created_at', settings.EXPIRED_TOKEN_RESET_TIME),
+        (user_models.ConfirmEmailToken, 'created_at', settings.EXPIRED_TOKEN_CONFIRM_EMAIL_TIME),
+    )
+
+
+def reap_expired(model, field, lifetime, batch_size, batch_sleep=0, max_batches=None):
+    """
+    Delete rows of ``model`` older than ``lifetime`` seconds.
+
+    Each batch picks at most ``batch_size`` primary keys through the index
+    on ``field`` and deletes them by primary key, so every statement holds
+    row locks on a bounded set only. Returns ``(deleted, elapsed seconds)``.
+    """
+    cutoff = timezone.now() - timedelta(seconds=lifetime)
+    expired = model.objects.filter(**{field + '__lt': cutoff}).order_by(field)
+    deleted = batches = 0
+    start = time.monotonic()
+    while max_batches is None or batches < max_batches:
+        pks = list(expired.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            break
+        model.objects.filter(pk__in=pks).delete()
+        deleted += len(pks)
+        batches += 1
+        if len(pks) < batch_size:
+            break
+        if batch_sleep:
+            time.sleep(batch_sleep)
+    elapsed = time.monotonic() - start
+
+    _logger.info('Reaped {} expired {} rows in {} batches, {:.1f}s ({:.0f} rows/s)'.format(
+        deleted, model._meta.db_table, batches, elapsed, deleted / elapsed if elapsed else 0))
+    return deleted, elapsed
+
+
+def reap_expired_tokens(batch_size=None, batch_sleep=None, max_batches=None):
+    if batch_size is None:
+        batch_size = settings.REAPER_BATCH_SIZE
+    if batch_sleep is None:
+        batch_sleep = settings.REAPER_BATCH_SLEEP
+
+    results = {}
+    for model, field, lifetime in get_expired_token_models():
+        results[model._meta.db_table] = reap_expired(
+            model, field, lifetime, batch_size, batch_sleep, max_batches)
+    return results
@@ -0,0 +1,9 @@
+from django.urls import path
+
+from dream_users import consumers as user_consumers
+
+http_urlpatterns = [
+    path('login/email/', user_consumers.LoginEmailConsumer),
+    path('login/facebook/', user_consumers.LoginFacebookConsumer),
+    path('register/', user_consumers.RegisterEmailConsumer),
+]
@@ -6,14 +6,17 @@ from dream_users import models as user_models
 class LoginEmailValidator(serializers.Serializer):
     email = serializers.EmailField(required=True, allow_blank=False)
     password = serializers.CharField(required=True, allow_blank=False)
+    device_id = serializers.CharField(required=False, allow_blank=True, max_length=64)
 
 
 class LoginFacebookValidator(serializers.Serializer):
     fb_access_token = serializers.CharField(required=True, allow_blank=False)
+    device_id = serializers.CharField(required=False, allow_blank=True, max_length=64)
 
 
 class LoginLineValidator(serializers.Serializer):
     line_access_token = serializers.CharField(required=True, allow_blank=False)
+    device_id = serializers.CharField(required=False, allow_blank=True, max_length=64)
 
 
 class RegisterEmailValidator(serializers.Serializer):
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.db.models.signals import post_save, pre_delete
+from django.dispatch import receiver
+
+from dream_users.cache import social_user_cache, token_cache, user_cache
+from dream_users.models import User
+
+
+@receiver(post_save, sender=User)
+def invalidate_cached_user(sender, instance, created, **kwargs):
+    if not created:
+        user_cache.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def invalidate_inactive_user_tokens(sender, instance, created, **kwargs):
+    if settings.TOKEN_CACHE_ENABLED and not created and not instance.is_active:
+        token_cache.invalidate_user(instance.pk)
+
+
+@receiver(pre_delete, sender=User)
+def invalidate_deleted_user_tokens(sender, instance, **kwargs):
+    user_cache.invalidate(instance.pk)
+    if instance.facebook_id:
+        social_user_cache.invalidate(instance.facebook_id)
+    if settings.TOKEN_CACHE_ENABLED:
+        token_cache.invalidate_user(instance.pk)
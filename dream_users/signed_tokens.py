@@ -0,0 +1,109 @@
+"""
+Stateless access tokens.
+
+A signed token carries the user id, its expiry, the user's token
+generation at issue time and a random id, so verifying it needs no token
+row. Logout puts the random id on a denylist in the shared cache until
+the token expires; bumping ``User.token_generation`` revokes every token
+of a user at once.
+"""
+import binascii
+import os
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import F
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
+
+from dream_users import models as user_models
+from dream_users.cache import get_user, user_cache
+
+SALT = 'dream_users.signed_tokens'
+DENYLIST_PREFIX = 'auth:deny:'
+
+
+class InvalidToken(Exception):
+    pass
+
+
+class SignedToken(object):
+
+    def __init__(self, key, user_id, generation, expired_time, jti):
+        self.key = key
+        self.user_id = user_id
+        self.generation = generation
+        self.expired_time = expired_time
+        self.jti = jti
+
+    def __str__(self):
+        return 'SignedToken (user {}): {}'.format(self.user_id, self.jti)
+
+
+def check_signing_key():
+    """Refuse signed mode without a signing key of its own."""
+    if settings.ACCESS_TOKEN_MODE != 'signed':
+        return
+    key = settings.ACCESS_TOKEN_SIGNING_KEY
+    if not key:
+        raise ImproperlyConfigured('ACCESS_TOKEN_MODE is signed but ACCESS_TOKEN_SIGNING_KEY is not set.')
+    if key == settings.SECRET_KEY:
+        raise ImproperlyConfigured('ACCESS_TOKEN_SIGNING_KEY must not be the committed SECRET_KEY.')
+
+
+def _denylist():
+    return caches[settings.TOKEN_CACHE_ALIAS]
+
+
+def issue(user):
+    expired_time = timezone.now() + timedelta(seconds=settings.EXPIRED_TOKEN_TIME)
+    payload = {
+        'u': user.pk,
+        'g': user.token_generation,
+        'e': int(expired_time.timestamp()),
+        'j': binascii.hexlify(os.urandom(8)).decode(),
+    }
+    key = signing.dumps(payload, key=settings.ACCESS_TOKEN_SIGNING_KEY, salt=SALT)
+    return SignedToken(key, payload['u'], payload['g'], expired_time, payload['j'])
+
+
+def verify(key):
+    """
+    Return ``(user, token)`` for a valid signed token, raise ``InvalidToken``
+    otherwise.
+    """
+    signing_key = settings.ACCESS_TOKEN_SIGNING_KEY
+    if not signing_key:
+        # signing would fall back to SECRET_KEY, which is public.
+        raise InvalidToken(_('Invalid token.'))
+    try:
+        payload = signing.loads(key, key=signing_key, salt=SALT)
+        expired_time = datetime.fromtimestamp(payload['e'], timezone.utc)
+        token = SignedToken(key, payload['u'], payload['g'], expired_time, payload['j'])
+    except (signing.BadSignature, KeyError, TypeError, ValueError):
+        raise InvalidToken(_('Invalid token.'))
+
+    if timezone.now() > token.expired_time:
+        raise InvalidToken(_('Token has expired'))
+
+    if _denylist().get(DENYLIST_PREFIX + token.jti) is not None:
+        raise InvalidToken(_('Invalid token.'))
+
+    user = get_user(token.user_id)
+    if user is None or user.token_generation != token.generation:
+        raise InvalidToken(_('Invalid token.'))
+    return user, token
+
+
+def revoke(token):
+    ttl = int((token.expired_time - timezone.now()).total_seconds())
+    if ttl > 0:
+        _denylist().set(DENYLIST_PREFIX + token.jti, 1, ttl)
+
+
+def revoke_all(user_id):
+    user_models.User.objects.filter(pk=user_id).update(token_generation=F('token_generation') + 1)
+    user_cache.invalidate(user_id)
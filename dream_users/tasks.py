@@ -1,64 +1,90 @@
-from datetime import timedelta
-from time import timezone
-
 from celery import shared_task
+from django.conf import settings
 
-from dream import settings
-from django.template.loader import render_to_string
+from core.db_router import PRIMARY
+from core.emails import render_email
+from core.tasks import deliver_email
+from dream_users import login_activity
 from dream_users import models as user_models
+from dream_users import utils as user_utils
+from dream_users.reaper import reap_expired_tokens as _reap_expired_tokens
 
-from core.tasks import send_email
+EMAIL_REGISTER_CONFIRM = 'register_confirm'
+EMAIL_FORGOT_PASSWORD = 'forgot_password'
 
 
-def generate_confirm_link(email):
-    user = user_models.User.objects.get(email=email)
-    token = user_models.ConfirmEmailToken.objects.create(user=user)
+def generate_confirm_link(user):
+    token = user_utils.get_recent_token(user_models.ConfirmEmailToken.objects.filter(user=user))
+    if token is None:
+        token = user_models.ConfirmEmailToken.objects.create(user=user)
     return '{host}/confirm/{token}/'.format(host=settings.SERVER_URL, token=token.token)
 
 
-def generate_forgot_link(email):
-    user = user_models.User.objects.get(email=email)
-    reset_token = user_models.ResetToken.objects.create(user=user)
+def generate_forgot_link(user):
+    reset_token = user_utils.get_recent_token(user_models.ResetToken.objects.filter(user=user))
+    if reset_token is None:
+        reset_token = user_models.ResetToken.objects.create(user=user)
     return '{host}/forgot-link/{token}'.format(host=settings.SERVER_URL, token=reset_token.reset_token)
 
 
-@shared_task
-def send_register_confirm_email(to_email):
-    confirm_link = generate_confirm_link(to_email)
+def build_register_confirm_email(user):
     subject = '[Sixcent English App] Register Confirmation'
-    context = {'confirm_link': confirm_link}
-    body_html = render_to_string('emails/register_confirm.html', context)
-    send_email.delay(
+    context = {'confirm_link': generate_confirm_link(user)}
+    return subject, render_email('emails/register_confirm.html', context)
+
+
+def build_forgot_password_email(user):
+    subject = '[Sixcent English App] Forgot password'
+    context = {'forgot_link': generate_forgot_link(user)}
+    return subject, render_email('emails/forgot_password.html', context)
+
+
+EMAIL_BUILDERS = {
+    EMAIL_REGISTER_CONFIRM: build_register_confirm_email,
+    EMAIL_FORGOT_PASSWORD: build_forgot_password_email,
+}
+
+
+@shared_task
+def send_user_email(user_id, kind):
+    """
+    Create the user's token, render the ``kind`` email and send it, all in
+    this one task.
+    """
+    try:
+        # Queued right after the user was saved; a replica may lag behind.
+        user = user_models.User.objects.using(PRIMARY).get(pk=user_id)
+    except user_models.User.DoesNotExist:
+        return False
+
+    subject, body_html = EMAIL_BUILDERS[kind](user)
+    return deliver_email(
         subject=subject,
         body_html=body_html,
         from_email=settings.EMAIL_NO_REPLY,
-        recipient_list=[to_email]
+        recipient_list=[user.email]
     )
 
 
+# Email address based tasks, kept so messages queued before the switch to
+# send_user_email still get delivered.
 @shared_task
 def send_register_confirm_email(to_email):
-    confirm_link = generate_confirm_link(to_email)
-    subject = '[Sixcent English App] Register Confirmation'
-    context = {'confirm_link': confirm_link}
-    body_html = render_to_string('emails/register_confirm.html', context)
-    send_email.delay(
-        subject=subject,
-        body_html=body_html,
-        from_email=settings.EMAIL_NO_REPLY,
-        recipient_list=[to_email]
-    )
+    user = user_models.User.objects.using(PRIMARY).get(email=to_email)
+    return send_user_email(user.id, EMAIL_REGISTER_CONFIRM)
 
 
 @shared_task
 def send_forgot_password_email(to_email):
-    forgot_link = generate_forgot_link(to_email)
-    subject = '[Sixcent English App] Forgot password'
-    context = {'forgot_link': forgot_link}
-    body_html = render_to_string('emails/forgot_password.html', context)
-    send_email.delay(
-        subject=subject,
-        body_html=body_html,
-        from_email=settings.EMAIL_NO_REPLY,
-        recipient_list=[to_email]
-    )
+    user = user_models.User.objects.using(PRIMARY).get(email=to_email)
+    return send_user_email(user.id, EMAIL_FORGOT_PASSWORD)
+
+
+@shared_task
+def reap_expired_tokens():
+    return _reap_expired_tokens()
+
+
+@shared_task
+def flush_login_activity():
+    return login_activity.flush()
@@ -1,3 +1,596 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from channels.testing import HttpCommunicator
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import QuerySet
+from django.template.loader import render_to_string
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework.test import APIRequestFactory
+
+from core import emails, profiling, request_metrics
+from core.executors import BoundedExecutor, ExecutorOverloaded, executor_rejected, get_executor, run_bounded
+from core.loadtest import stub_json_server
+from dream_users import consumers as user_consumers
+from dream_users import login_activity
+from dream_users import models as user_models
+from dream_users import reaper
+from dream_users import signed_tokens
+from dream_users import tasks as user_tasks
+from dream_users import utils as user_utils
+from dream_users import views as user_views
+from dream_users.auth import BearerAuthentication, SignedBearerAuthentication
+from dream_users.cache import social_profile_cache, social_user_cache, token_cache, user_cache
+
+
+class CacheTestCase(TestCase):
+    """Starts every test with empty auth caches; ids get reused between tests."""
+
+    def setUp(self):
+        caches['default'].clear()
+        for cache in (token_cache, user_cache, social_profile_cache, social_user_cache):
+            cache.local.clear()
+
+
+class BearerAuthenticationTests(CacheTestCase):
+
+    def setUp(self):
+        super(BearerAuthenticationTests, self).setUp()
+        self.user = user_models.User.objects.create(email='token@example.com', username='token')
+        self.token = user_models.Token.objects.create(user=self.user)
+        self.authentication = BearerAuthentication()
+
+    def test_cached_token_skips_the_database(self):
+        self.authentication.authenticate_credentials(self.token.key)
+        with CaptureQueriesContext(connection) as queries:
+            user, token = self.authentication.authenticate_credentials(self.token.key)
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(user.pk, self.user.pk)
+        self.assertEqual(token.key, self.token.key)
+
+    def test_saved_user_is_not_served_stale(self):
+        self.authentication.authenticate_credentials(self.token.key)
+        self.user.user_type = user_models.User.TYPE_PREMIUM
+        self.user.save()
+        user, _ = self.authentication.authenticate_credentials(self.token.key)
+        self.assertEqual(user.user_type, user_models.User.TYPE_PREMIUM)
+
+    def test_deactivated_user_is_rejected(self):
+        self.authentication.authenticate_credentials(self.token.key)
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authentication.authenticate_credentials(self.token.key)
+
+    def test_caches_are_filled_from_the_primary(self):
+        # Reads routed anywhere else fail, as a lagging replica would be wrong.
+        with mock.patch('core.db_router.ReplicaRouter.db_for_read', return_value='lagging-replica'):
+            self.authentication.authenticate_credentials(self.token.key)
+            user_cache.invalidate(self.user.pk)
+            user, _ = self.authentication.authenticate_credentials(self.token.key)
+        self.assertEqual(user.pk, self.user.pk)
+
+    def test_cached_user_has_no_password_hash(self):
+        self.user.set_password('cached-pass1')
+        self.user.save()
+        self.authentication.authenticate_credentials(self.token.key)
+        self.assertNotIn(self.user.password, str(caches['default'].get(user_cache.make_key(self.user.pk))))
+        user, _ = self.authentication.authenticate_credentials(self.token.key)
+        self.assertIn('password', user.get_deferred_fields())
+        user.first_name = 'Cached'
+        user.save()
+        self.assertTrue(user_models.User.objects.get(pk=self.user.pk).check_password('cached-pass1'))
+
+    def test_deleted_token_is_rejected(self):
+        self.authentication.authenticate_credentials(self.token.key)
+        self.user.delete()
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authentication.authenticate_credentials(self.token.key)
+
+
+class SessionTokenTests(CacheTestCase):
+
+    def setUp(self):
+        super(SessionTokenTests, self).setUp()
+        self.user = user_models.User.objects.create(email='sessions@example.com', username='sessions')
+
+    def test_same_device_refreshes_its_token(self):
+        first, _ = user_utils.issue_access_token(self.user, device_id='phone')
+        second, _ = user_utils.issue_access_token(self.user, device_id='phone')
+        self.assertEqual(first, second)
+        self.assertEqual(user_models.Token.objects.filter(user=self.user).count(), 1)
+
+    def test_expired_device_token_is_replaced(self):
+        first, _ = user_utils.issue_access_token(self.user, device_id='phone')
+        user_models.Token.objects.filter(key=first).update(
+            created=timezone.now() - timedelta(seconds=settings.EXPIRED_TOKEN_TIME + 1))
+        second, _ = user_utils.issue_access_token(self.user, device_id='phone')
+        self.assertNotEqual(first, second)
+        self.assertEqual(list(user_models.Token.objects.filter(user=self.user).values_list('key', flat=True)),
+                         [second])
+
+    @override_settings(MAX_SESSIONS_PER_USER=2)
+    def test_oldest_sessions_are_evicted_past_the_cap(self):
+        keys = []
+        for i in range(3):
+            key, _ = user_utils.issue_access_token(self.user)
+            user_models.Token.objects.filter(key=key).update(created=timezone.now() - timedelta(minutes=10 - i))
+            token_cache.invalidate(key)
+            BearerAuthentication().authenticate_credentials(key)
+            keys.append(key)
+        key, _ = user_utils.issue_access_token(self.user)
+        remaining = set(user_models.Token.objects.filter(user=self.user).values_list('key', flat=True))
+        self.assertEqual(remaining, {keys[2], key})
+        for evicted in keys[:2]:
+            with self.assertRaises(exceptions.AuthenticationFailed):
+                BearerAuthentication().authenticate_credentials(evicted)
+
+
+@override_settings(ACCESS_TOKEN_MODE='signed', ACCESS_TOKEN_SIGNING_KEY='test-signing-key')
+class SignedTokenTests(CacheTestCase):
+
+    def setUp(self):
+        super(SignedTokenTests, self).setUp()
+        self.user = user_models.User.objects.create(email='signed@example.com', username='signed')
+        self.authentication = SignedBearerAuthentication()
+
+    def test_issued_token_verifies_without_a_row(self):
+        key, _ = user_utils.issue_access_token(self.user)
+        user, token = self.authentication.authenticate_credentials(key)
+        self.assertEqual(user.pk, self.user.pk)
+        self.assertFalse(user_models.Token.objects.exists())
+
+    def test_token_signed_with_secret_key_is_rejected(self):
+        payload = {'u': self.user.pk, 'g': 0, 'e': int(timezone.now().timestamp()) + 3600, 'j': 'forged'}
+        key = signing.dumps(payload, key=settings.SECRET_KEY, salt=signed_tokens.SALT)
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authentication.authenticate_credentials(key)
+
+    def test_revoked_token_is_rejected(self):
+        key, _ = user_utils.issue_access_token(self.user)
+        _, token = self.authentication.authenticate_credentials(key)
+        user_utils.revoke_access_token(token)
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authentication.authenticate_credentials(key)
+
+    def test_revoke_all_rejects_earlier_tokens(self):
+        key, _ = user_utils.issue_access_token(self.user)
+        signed_tokens.revoke_all(self.user.pk)
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authentication.authenticate_credentials(key)
+
+    def test_signed_mode_needs_its_own_key(self):
+        signed_tokens.check_signing_key()
+        with override_settings(ACCESS_TOKEN_SIGNING_KEY=None):
+            with self.assertRaises(ImproperlyConfigured):
+                signed_tokens.check_signing_key()
+        with override_settings(ACCESS_TOKEN_SIGNING_KEY=settings.SECRET_KEY):
+            with self.assertRaises(ImproperlyConfigured):
+                signed_tokens.check_signing_key()
+
+
+class LoginHistoryTests(TestCase):
+
+    def setUp(self):
+        self.user = user_models.User.objects.create(email='streak@example.com', username='streak')
+        self.today = timezone.now().date()
+
+    def day(self, offset):
+        return self.today + timedelta(days=offset)
+
+    def streaks(self):
+        return list(user_models.LoginHistory.objects.filter(user=self.user).order_by('start_date').values_list(
+            'start_date', 'end_date', 'num_date'))
+
+    def login(self, *offsets):
+        for offset in offsets:
+            user_utils.create_or_update_login_history(self.user.pk, self.day(offset))
+
+    def test_same_day_repeats_are_ignored(self):
+        self.login(0, 0)
+        self.assertEqual(self.streaks(), [(self.day(0), self.day(0), 1)])
+
+    def test_consecutive_days_extend_the_streak(self):
+        self.login(-2, -1, 0)
+        self.assertEqual(self.streaks(), [(self.day(-2), self.day(0), 3)])
+
+    def test_gap_starts_a_new_streak(self):
+        self.login(-3, 0)
+        self.assertEqual(self.streaks(), [(self.day(-3), self.day(-3), 1), (self.day(0), self.day(0), 1)])
+
+    def test_late_day_merges_adjacent_streaks(self):
+        self.login(-4, -3, -1, 0, -2)
+        self.assertEqual(self.streaks(), [(self.day(-4), self.day(0), 5)])
+
+    def test_late_day_extends_the_following_streak(self):
+        self.login(-1, 0, -2)
+        self.assertEqual(self.streaks(), [(self.day(-2), self.day(0), 3)])
+
+    def test_late_day_inside_a_streak_is_ignored(self):
+        self.login(-2, -1, 0, -1)
+        self.assertEqual(self.streaks(), [(self.day(-2), self.day(0), 3)])
+
+    def test_bulk_update_merges_late_days(self):
+        self.login(-3, 0)
+        other = user_models.User.objects.create(email='streak-2@example.com', username='streak-2')
+        user_utils.bulk_update_login_history([
+            (self.user.pk, self.day(-2)), (self.user.pk, self.day(-1)), (other.pk, self.day(-1)),
+        ])
+        self.assertEqual(self.streaks(), [(self.day(-3), self.day(0), 4)])
+        self.assertEqual(
+            list(user_models.LoginHistory.objects.filter(user=other).values_list('start_date', 'end_date')),
+            [(self.day(-1), self.day(-1))])
+
+
+class LocalActivityBufferTests(TestCase):
+
+    def setUp(self):
+        self.user = user_models.User.objects.create(email='local@example.com', username='local')
+        self.today = timezone.now().date()
+        self.buffer = login_activity.LocalActivityBuffer(interval=3600)
+        # Pretend the flush thread is running so the test flushes by hand.
+        self.buffer._thread = threading.current_thread()
+
+    def test_repeats_are_merged_and_flushed_once(self):
+        self.buffer.add(self.user.pk, self.today)
+        self.buffer.add(self.user.pk, self.today)
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(
+            list(user_models.LoginHistory.objects.filter(user=self.user).values_list('num_date', flat=True)), [1])
+
+    def test_add_during_flush_is_kept_for_the_next_one(self):
+        def bulk_update(user_days):
+            self.buffer.add(self.user.pk, self.today)
+
+        with mock.patch.object(user_utils, 'bulk_update_login_history', side_effect=bulk_update):
+            self.buffer.add(self.user.pk, self.today - timedelta(days=1))
+            self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(self.buffer.drain(), {(self.user.pk, self.today)})
+
+
+class CacheActivityBufferTests(CacheTestCase):
+
+    def setUp(self):
+        super(CacheActivityBufferTests, self).setUp()
+        self.user = user_models.User.objects.create(email='cache@example.com', username='cache')
+        self.today = timezone.now().date()
+        self.buffer = login_activity.CacheActivityBuffer('default')
+
+    def streak(self):
+        return list(user_models.LoginHistory.objects.filter(user=self.user).values_list(
+            'start_date', 'end_date', 'num_date'))
+
+    def test_flush_waits_one_interval_for_slots(self):
+        self.buffer.add(self.user.pk, self.today)
+        self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(self.streak(), [])
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(self.streak(), [(self.today, self.today, 1)])
+
+    def test_flushed_slots_are_not_written_twice(self):
+        self.buffer.add(self.user.pk, self.today)
+        self.buffer.flush()
+        self.buffer.flush()
+        with mock.patch.object(user_utils, 'bulk_update_login_history') as bulk_update:
+            self.assertEqual(self.buffer.flush(), 0)
+            self.assertEqual(login_activity.CacheActivityBuffer('default').flush(), 0)
+        bulk_update.assert_not_called()
+        self.assertIsNone(caches['default'].get(self.buffer._slot_key(1)))
+
+    def test_same_day_repeats_take_one_slot(self):
+        self.buffer.add(self.user.pk, self.today)
+        self.buffer.add(self.user.pk, self.today)
+        self.buffer.add(self.user.pk, self.today - timedelta(days=1))
+        self.assertEqual(caches['default'].get(login_activity.SEQ_KEY), 2)
+
+    def test_add_between_flushes_is_not_lost(self):
+        other = user_models.User.objects.create(email='cache-2@example.com', username='cache-2')
+        self.buffer.add(self.user.pk, self.today)
+        self.buffer.flush()
+        # Lands after the mark, so the next flush leaves it for the one after.
+        self.buffer.add(other.pk, self.today)
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(user_models.LoginHistory.objects.filter(user=other).count(), 1)
+
+    def test_failed_flush_is_retried(self):
+        self.buffer.add(self.user.pk, self.today)
+        self.buffer.flush()
+        with mock.patch.object(user_utils, 'bulk_update_login_history', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.buffer.flush()
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(self.streak(), [(self.today, self.today, 1)])
+
+    def test_missing_slot_is_reported(self):
+        self.buffer.add(self.user.pk, self.today)
+        self.buffer.flush()
+        caches['default'].delete(self.buffer._slot_key(1))
+        with self.assertLogs('dream_users.login_activity', 'WARNING'):
+            self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(caches['default'].get(login_activity.FLUSHED_KEY), 1)
+
+
+class ReaperTests(TestCase):
+
+    def setUp(self):
+        self.user = user_models.User.objects.create(email='reaper@example.com', username='reaper')
+        self.now = timezone.now()
+        patcher = mock.patch('dream_users.reaper.timezone.now', return_value=self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_tokens(self, model, ages):
+        """Create one ``model`` row per age in seconds, return their keys."""
+        field = 'created' if model is user_models.Token else 'created_at'
+        keys = []
+        for age in ages:
+            token = model.objects.create(user=self.user)
+            model.objects.filter(pk=token.pk).update(**{field: self.now - timedelta(seconds=age)})
+            keys.append(token.pk)
+        return keys
+
+    def remaining(self, model):
+        return set(model.objects.values_list('pk', flat=True))
+
+    def test_only_expired_rows_are_deleted(self):
+        expired = self.make_tokens(user_models.Token, [settings.EXPIRED_TOKEN_TIME + 60] * 3)
+        live = self.make_tokens(user_models.Token, [0, settings.EXPIRED_TOKEN_TIME - 60])
+        self.make_tokens(user_models.ResetToken, [settings.EXPIRED_TOKEN_RESET_TIME + 60])
+        reset_live = self.make_tokens(user_models.ResetToken, [settings.EXPIRED_TOKEN_RESET_TIME - 60])
+
+        results = reaper.reap_expired_tokens(batch_size=2, batch_sleep=0)
+
+        self.assertEqual(results['token'][0], len(expired))
+        self.assertEqual(results['reset_token'][0], 1)
+        self.assertEqual(results['confirm_email_token'][0], 0)
+        self.assertEqual(self.remaining(user_models.Token), set(live))
+        self.assertEqual(self.remaining(user_models.ResetToken), set(reset_live))
+
+    def test_row_at_the_cutoff_is_kept(self):
+        kept = self.make_tokens(user_models.Token, [settings.EXPIRED_TOKEN_TIME])
+        self.make_tokens(user_models.Token, [settings.EXPIRED_TOKEN_TIME + 1])
+        deleted, _ = reaper.reap_expired(user_models.Token, 'created', settings.EXPIRED_TOKEN_TIME, batch_size=10)
+        self.assertEqual(deleted, 1)
+        self.assertEqual(self.remaining(user_models.Token), set(kept))
+
+    def test_batches_oldest_first_and_stop_at_max_batches(self):
+        ages = [settings.EXPIRED_TOKEN_TIME + 60 * i for i in range(1, 6)]
+        keys = self.make_tokens(user_models.Token, ages)
+        with CaptureQueriesContext(connection) as queries:
+            deleted, _ = reaper.reap_expired(
+                user_models.Token, 'created', settings.EXPIRED_TOKEN_TIME, batch_size=2, max_batches=2)
+        self.assertEqual(deleted, 4)
+        self.assertEqual(self.remaining(user_models.Token), {keys[0]})
+        delete = 'DELETE FROM {}'.format(connection.ops.quote_name('token'))
+        deletes = [query['sql'] for query in queries if query['sql'].startswith(delete)]
+        self.assertEqual(len(deletes), 2)
+
+    def test_short_batch_ends_the_run(self):
+        self.make_tokens(user_models.Token, [settings.EXPIRED_TOKEN_TIME + 60] * 3)
+        with mock.patch('dream_users.reaper.time.sleep') as sleep:
+            deleted, _ = reaper.reap_expired(
+                user_models.Token, 'created', settings.EXPIRED_TOKEN_TIME, batch_size=2, batch_sleep=5)
+        self.assertEqual(deleted, 3)
+        sleep.assert_called_once_with(5)
+
+    def test_command_reports_deleted_counts(self):
+        self.make_tokens(user_models.Token, [settings.EXPIRED_TOKEN_TIME + 60] * 2)
+        self.make_tokens(user_models.ConfirmEmailToken, [settings.EXPIRED_TOKEN_CONFIRM_EMAIL_TIME + 60])
+        out = io.StringIO()
+        call_command('reap_tokens', '--batch-size', '1', '--batch-sleep', '0', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertTrue(any(line.startswith('token: deleted 2 rows') for line in lines), lines)
+        self.assertTrue(any(line.startswith('confirm_email_token: deleted 1 rows') for line in lines), lines)
+        self.assertTrue(any(line.startswith('reset_token: deleted 0 rows') for line in lines), lines)
+        self.assertFalse(user_models.Token.objects.exists())
+
+
+class SocialProfileTests(CacheTestCase):
+
+    def setUp(self):
+        super(SocialProfileTests, self).setUp()
+        self.calls = 0
+        self.answer = (200, {'id': 'fb-1', 'name': 'Facebook User'})
+
+    def respond(self, method, path):
+        self.calls += 1
+        return self.answer
+
+    def lookup(self):
+        with stub_json_server(self.respond) as url, override_settings(URL_GET_ID_FACEBOOK=url + '/me?access_token='):
+            return user_utils.get_facebook_profile('fb-token')
+
+    def test_profile_is_cached(self):
+        self.assertEqual(self.lookup(), {'id': 'fb-1', 'name': 'Facebook User'})
+        self.assertEqual(self.lookup(), {'id': 'fb-1', 'name': 'Facebook User'})
+        self.assertEqual(self.calls, 1)
+
+    def test_rejected_token_is_cached(self):
+        self.answer = (400, {'error': {'type': 'OAuthException', 'code': 190, 'message': 'Invalid token'}})
+        for _ in range(2):
+            with self.assertRaises(user_utils.InvalidSocialToken):
+                self.lookup()
+        self.assertEqual(self.calls, 1)
+
+    def test_outage_is_not_cached(self):
+        for answer in ((500, {'error': {'type': 'OAuthException', 'code': 2}}),
+                       (400, {'error': {'type': 'OAuthException', 'code': 4}}),
+                       (200, {'unexpected': True})):
+            self.answer = answer
+            with self.assertRaises(user_utils.SocialProfileUnavailable):
+                self.lookup()
+        self.answer = (200, {'id': 'fb-1', 'name': 'Facebook User'})
+        self.assertEqual(self.lookup(), {'id': 'fb-1', 'name': 'Facebook User'})
+        self.assertEqual(self.calls, 4)
+
+
+class AccountEmailTests(SimpleTestCase):
+
+    def test_account_emails_use_the_fast_render_path(self):
+        for name, field in (('emails/register_confirm.html', 'confirm_link'),
+                            ('emails/forgot_password.html', 'forgot_link')):
+            context = {field: 'http://example.com/confirm/<a&b>/'}
+            self.assertEqual(emails.render_email(name, context), render_to_string(name, context))
+            self.assertIsNotNone(emails._templates[(name, (field,))].parts)
+
+
+class EmailDedupTests(CacheTestCase):
+
+    def setUp(self):
+        super(EmailDedupTests, self).setUp()
+        self.user = user_models.User.objects.create(email='dedup@example.com', username='dedup')
+
+    def forgot_password(self):
+        view = user_views.ForgotPasswordAPI.as_view()
+        return view(APIRequestFactory().post('/forgot-password/', {'email': self.user.email}, format='json'))
+
+    def test_second_send_within_the_window_is_refused(self):
+        self.assertTrue(user_utils.claim_email_send('forgot_password', 'Dedup@Example.com'))
+        self.assertFalse(user_utils.claim_email_send('forgot_password', 'dedup@example.com'))
+        self.assertTrue(user_utils.claim_email_send('register_confirm', 'dedup@example.com'))
+
+    def test_send_after_the_window_is_claimed(self):
+        now = time.time()
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=now):
+            self.assertTrue(user_utils.claim_email_send('forgot_password', self.user.email))
+        with mock.patch('django.core.cache.backends.locmem.time.time',
+                        return_value=now + settings.EMAIL_DEDUP_WINDOW + 1):
+            self.assertTrue(user_utils.claim_email_send('forgot_password', self.user.email))
+
+    def test_recent_token_is_sent_again(self):
+        old = user_models.ResetToken.objects.create(user=self.user)
+        user_models.ResetToken.objects.filter(pk=old.pk).update(
+            created_at=timezone.now() - timedelta(seconds=settings.EMAIL_DEDUP_WINDOW + 1))
+        tokens = user_models.ResetToken.objects.filter(user=self.user)
+        self.assertIsNone(user_utils.get_recent_token(tokens))
+
+        recent = user_models.ResetToken.objects.create(user=self.user)
+        self.assertEqual(user_utils.get_recent_token(tokens), recent)
+        self.assertIn(recent.reset_token, user_tasks.generate_forgot_link(self.user))
+        self.assertEqual(tokens.count(), 2)
+
+    def test_repeated_request_enqueues_once(self):
+        with mock.patch.object(user_views.outbox, 'enqueue') as enqueue:
+            self.assertEqual(self.forgot_password().status_code, 204)
+            self.assertEqual(self.forgot_password().status_code, 204)
+        enqueue.assert_called_once_with(user_tasks.send_user_email, self.user.pk, user_tasks.EMAIL_FORGOT_PASSWORD)
+
+    def test_failed_enqueue_releases_the_claim(self):
+        with mock.patch.object(user_views.outbox, 'enqueue', side_effect=ConnectionError) as enqueue:
+            with self.assertRaises(ConnectionError):
+                self.forgot_password()
+            enqueue.side_effect = None
+            self.assertEqual(self.forgot_password().status_code, 204)
+        self.assertEqual(enqueue.call_count, 2)
+
+
+class HashingExecutorTests(SimpleTestCase):
+
+    def test_full_queue_sheds_load(self):
+        executor = BoundedExecutor('test', max_workers=1, max_queue=1)
+        self.addCleanup(executor.shutdown)
+        release = threading.Event()
+        self.addCleanup(release.set)
+        rejected = executor_rejected.labels(executor='test').value
+        futures = [executor.submit(release.wait) for _ in range(2)]
+        with self.assertRaises(ExecutorOverloaded):
+            executor.submit(release.wait)
+        self.assertEqual(executor_rejected.labels(executor='test').value, rejected + 1)
+        release.set()
+        for future in futures:
+            future.result(timeout=5)
+        executor.submit(release.wait).result(timeout=5)
+        self.assertEqual(executor.pending, 0)
+
+    def test_run_bounded_runs_inline_on_its_own_pool(self):
+        def idents():
+            return threading.get_ident(), run_bounded('hashing', threading.get_ident)
+
+        outer, inner = get_executor('hashing').submit(idents).result(timeout=5)
+        self.assertEqual(outer, inner)
+        self.assertNotEqual(run_bounded('hashing', threading.get_ident), threading.get_ident())
+
+
+class HashingOverloadTests(TestCase):
+
+    def setUp(self):
+        user = user_models.User.objects.create(email='overload@example.com', username='overload')
+        user.set_password('overload-pass1')
+        user.save()
+        patcher = mock.patch('dream_users.hashers.run_bounded', side_effect=ExecutorOverloaded)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_login_answers_503(self):
+        response = self.client.post('/login/email/', {'email': 'overload@example.com', 'password': 'overload-pass1'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+
+class RegisterConsumerTests(TransactionTestCase):
+
+    def register(self, email, headers=()):
+        communicator = HttpCommunicator(
+            user_consumers.RegisterEmailConsumer, 'POST', '/register/',
+            body=json.dumps({'email': email, 'password': 'register-pass1'}).encode(),
+            headers=[(b'content-type', b'application/json')] + list(headers))
+        response = asyncio.get_event_loop().run_until_complete(communicator.get_response(timeout=10))
+        return response['status'], json.loads(response['body'].decode())
+
+    def test_register_creates_an_inactive_user(self):
+        status_code, data = self.register('new@example.com')
+        self.assertEqual(status_code, 200)
+        self.assertFalse(user_models.User.objects.get(email='new@example.com').is_active)
+
+    def test_existing_email_conflicts(self):
+        self.register('taken@example.com')
+        self.assertEqual(self.register('taken@example.com')[0], 409)
+
+    def test_existing_email_missed_by_the_check_conflicts(self):
+        self.register('raced@example.com')
+        # As if the existence check read a replica that lags behind.
+        with mock.patch.object(QuerySet, 'exists', return_value=False):
+            self.assertEqual(self.register('raced@example.com')[0], 409)
+        self.assertEqual(user_models.User.objects.filter(email='raced@example.com').count(), 1)
+
+    def test_register_is_measured_by_route(self):
+        child = request_metrics.request_queries.labels(route='dream_users.consumers.RegisterEmailConsumer')
+        count, queries = child.count, child.sum
+        self.register('measured@example.com')
+        self.assertEqual(child.count, count + 1)
+        # The existence check, the insert and the outbox row all ran on the db pool.
+        self.assertGreaterEqual(child.sum - queries, 3)
+
+    @override_settings(PROFILER_HEADER_TOKEN='profile-me')
+    def test_register_is_profiled_on_request(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(PROFILER_OUTPUT_DIR=directory):
+            self.register('profiled@example.com', headers=[(profiling.PROFILE_ASGI_HEADER, b'profile-me')])
+            names = os.listdir(directory)
+            self.assertEqual(len(names), 1)
+            self.assertTrue(names[0].startswith('request-dream_users.consumers.RegisterEmailConsumer-'))
+            with open(os.path.join(directory, names[0])) as f:
+                profile = f.read()
+        # Password hashing ran on an executor thread and was sampled.
+        self.assertIn('dream_users.hashers:encode', profile)
+
+    def test_overloaded_hashing_answers_503(self):
+        with mock.patch('dream_users.hashers.run_bounded', side_effect=ExecutorOverloaded):
+            self.assertEqual(self.register('overloaded@example.com')[0], 503)
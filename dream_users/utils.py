@@ -1,9 +1,26 @@
+import hashlib
 from datetime import timedelta
+
 import requests
 from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.models import F
 from django.utils import timezone
 
-from dream_users.models import LoginHistory, User
+from core import metrics
+from core.http_client import http_client
+from dream_users import signed_tokens
+from dream_users.cache import (
+    INVALID_SOCIAL_TOKEN, get_user, social_profile_cache, social_user_cache, token_cache, user_cache,
+)
+from dream_users.models import LoginHistory, Token, User
+
+deduplicated_email_sends = metrics.counter(
+    'email_sends_deduplicated_total',
+    'Account emails skipped because one was sent within EMAIL_DEDUP_WINDOW.',
+    labelnames=('purpose',),
+)
 
 
 # def get_user_type(user_id: int) -> int:
@@ -22,11 +39,145 @@ def get_expired_time(token):
     return token.created + timedelta(seconds=settings.EXPIRED_TOKEN_TIME)
 
 
-def get_line_profile(line_access_token):
+def issue_access_token(user, device_id=None):
+    """
+    Return ``(access_token, expired_time)`` for a freshly logged in user.
+
+    A login from a device that already holds a live token refreshes that
+    token instead of inserting another row. Signed tokens carry no session
+    row, so ``device_id`` is ignored in signed mode.
+    """
+    if settings.ACCESS_TOKEN_MODE == 'signed':
+        token = signed_tokens.issue(user)
+        return token.key, token.expired_time
+
+    token = None
+    if device_id:
+        token = Token.objects.filter(user=user, device_id=device_id).order_by('-created').first()
+    if token is not None and timezone.now() < get_expired_time(token):
+        token.created = timezone.now()
+        token.save(update_fields=['created'])
+    else:
+        if token is not None:
+            revoke_access_token(token)
+        token = Token.objects.create(user=user, device_id=device_id or None)
+        evict_sessions(user.pk)
+
+    if settings.TOKEN_CACHE_ENABLED:
+        token_cache.set(token)
+    return token.key, get_expired_time(token)
+
+
+def evict_sessions(user_id):
+    """Delete all but the newest MAX_SESSIONS_PER_USER tokens of a user."""
+    stale = list(
+        Token.objects.filter(user_id=user_id)
+        .order_by('-created')
+        .values_list('key', flat=True)[settings.MAX_SESSIONS_PER_USER:]
+    )
+    if stale:
+        Token.objects.filter(pk__in=stale).delete()
+        if settings.TOKEN_CACHE_ENABLED:
+            token_cache.invalidate(*stale)
+    return len(stale)
+
+
+def revoke_access_token(token):
+    if isinstance(token, signed_tokens.SignedToken):
+        signed_tokens.revoke(token)
+        return
+
+    Token.objects.filter(key=token.key).delete()
+    token_cache.invalidate(token.key)
+
+
+class InvalidSocialToken(Exception):
+    pass
+
+
+class SocialProfileUnavailable(Exception):
+    """The provider could not answer, which says nothing about the token."""
+
+
+# Graph API throttling errors are 4xx OAuthException responses too.
+FACEBOOK_RATE_LIMIT_CODES = frozenset((4, 17, 32, 613))
+
+
+def _resolve_social_profile(provider, access_token, fetch):
+    # Clients retry social login with the same access token, answer the
+    # retries (and repeated invalid tokens) from the cache.
+    key = '{}:{}'.format(provider, access_token)
+    profile = social_profile_cache.get(key)
+    if profile == INVALID_SOCIAL_TOKEN:
+        raise InvalidSocialToken(provider)
+    if profile is not None:
+        return profile
+
+    try:
+        profile = fetch(access_token)
+    except InvalidSocialToken:
+        social_profile_cache.set(key, INVALID_SOCIAL_TOKEN, settings.SOCIAL_PROFILE_NEGATIVE_TTL)
+        raise
+    social_profile_cache.set(key, profile)
+    return profile
+
+
+def _get_profile(provider, url, **kwargs):
+    """Return the status code and JSON body of a profile lookup."""
+    try:
+        http_response = http_client.get(url, service=provider, **kwargs)
+        return http_response.status_code, http_response.json()
+    except (requests.RequestException, ValueError) as e:
+        raise SocialProfileUnavailable('{} profile lookup failed: {}'.format(provider, type(e).__name__))
+
+
+def _fetch_line_profile(line_access_token):
     ACCESS_TOKEN = 'Bearer ' + '{' + line_access_token + '}'
     headers = {'Authorization': ACCESS_TOKEN}
-    response = requests.get(url=settings.URL_GET_PROFILE_LINE, headers=headers).json()
-    return response
+    status_code, response = _get_profile('line', settings.URL_GET_PROFILE_LINE, headers=headers)
+    if status_code in (400, 401):
+        raise InvalidSocialToken('line')
+    if status_code != 200 or 'userId' not in response:
+        raise SocialProfileUnavailable('line answered {}'.format(status_code))
+    data = {
+        'id': response['userId'],
+        'name': response.get('displayName', '')
+    }
+    return data
+
+
+def get_line_profile(line_access_token):
+    return _resolve_social_profile('line', line_access_token, _fetch_line_profile)
+
+
+def _email_dedup_key(purpose, email):
+    return 'email_dedup:{}:{}'.format(purpose, hashlib.sha256(email.lower().encode()).hexdigest())
+
+
+def claim_email_send(purpose, email):
+    """
+    Return True if no ``purpose`` email went to ``email`` within
+    EMAIL_DEDUP_WINDOW, and reserve the window for this send.
+    """
+    claimed = caches[settings.EMAIL_DEDUP_CACHE_ALIAS].add(
+        _email_dedup_key(purpose, email), 1, settings.EMAIL_DEDUP_WINDOW)
+    if not claimed:
+        deduplicated_email_sends.labels(purpose=purpose).inc()
+    return claimed
+
+
+def release_email_send(purpose, email):
+    """Give back a claim whose send could not be queued, so a retry sends."""
+    caches[settings.EMAIL_DEDUP_CACHE_ALIAS].delete(_email_dedup_key(purpose, email))
+
+
+def get_recent_token(tokens):
+    """
+    Return the newest of ``tokens`` (ResetToken or ConfirmEmailToken rows)
+    created within EMAIL_DEDUP_WINDOW, to be sent again instead of a new one.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.EMAIL_DEDUP_WINDOW)
+    return tokens.filter(created_at__gte=cutoff).order_by('-created_at').first()
 
 
 def check_expired_time_reset_token(reset_token):
@@ -47,8 +198,14 @@ def check_expired_time_confirm_email_token(token):
     return True
 
 
-def get_facebook_profile(fb_access_token):
-    reponse = requests.get(settings.URL_GET_ID_FACEBOOK + fb_access_token).json()
+def _fetch_facebook_profile(fb_access_token):
+    status_code, reponse = _get_profile('facebook', settings.URL_GET_ID_FACEBOOK + fb_access_token)
+    error = reponse.get('error') if isinstance(reponse, dict) else None
+    if 400 <= status_code < 500 and isinstance(error, dict) and error.get('type') == 'OAuthException' \
+            and error.get('code') not in FACEBOOK_RATE_LIMIT_CODES:
+        raise InvalidSocialToken('facebook')
+    if status_code != 200 or 'id' not in reponse:
+        raise SocialProfileUnavailable('facebook answered {}'.format(status_code))
     data = {
         'id': reponse['id'],
         'name': reponse['name']
@@ -56,18 +213,130 @@ def get_facebook_profile(fb_access_token):
     return data
 
 
-def create_or_update_login_history(user_id):
-    current_day = timezone.now()
-    if LoginHistory.objects.filter(user_id=user_id).exists():
-        user_login_day = LoginHistory.objects.filter(
-            user_id=user_id
-        ).order_by('-end_date').first()
-        diff_date = current_day.date() - user_login_day.end_date
-        if diff_date.days == 1:
-            user_login_day.end_date = current_day.date()
-            user_login_day.num_date = user_login_day.num_date + 1
-            user_login_day.save()
-        elif diff_date.days != 0:
-            LoginHistory.objects.create(user_id=user_id)
-    else:
-        LoginHistory.objects.create(user_id=user_id)
+def get_facebook_profile(fb_access_token):
+    return _resolve_social_profile('facebook', fb_access_token, _fetch_facebook_profile)
+
+
+def get_or_create_facebook_user(fb_id, user_name):
+    user_id = social_user_cache.get(fb_id)
+    user = get_user(user_id) if user_id is not None else None
+    if user is None:
+        user, created = User.objects.get_or_create(
+            facebook_id=fb_id,
+            defaults={'username': user_name}
+        )
+        social_user_cache.set(fb_id, user.pk)
+        user_cache.set(user.pk, user)
+    return user
+
+
+def create_or_update_login_history(user_id, login_day=None):
+    """
+    Extend the user's streak that ended the day before ``login_day``
+    (default today), or start a new one.
+
+    Runs one UPDATE and, when no streak was extended, one INSERT that the
+    unique (user, end_date) key rejects if the user already logged in
+    that day, so concurrent logins cannot create duplicate rows. Days
+    before today may arrive after later ones and go through
+    ``apply_late_login`` instead.
+    """
+    if login_day is None:
+        login_day = timezone.now().date()
+    if login_day < timezone.now().date():
+        apply_late_login(user_id, login_day)
+        return
+
+    extended = LoginHistory.objects.filter(
+        user_id=user_id,
+        end_date=login_day - timedelta(days=1)
+    ).update(end_date=login_day, num_date=F('num_date') + 1)
+    if extended:
+        return
+
+    try:
+        with transaction.atomic():
+            LoginHistory.objects.create(user_id=user_id, start_date=login_day, end_date=login_day)
+    except IntegrityError:
+        pass
+
+
+def apply_late_login(user_id, login_day):
+    """
+    Record a login on a past day that may fall inside a recorded streak or
+    between two, which it then merges.
+    """
+    with transaction.atomic():
+        streaks = list(LoginHistory.objects.select_for_update().filter(
+            user_id=user_id,
+            start_date__lte=login_day + timedelta(days=1),
+            end_date__gte=login_day - timedelta(days=1),
+        ))
+        if any(streak.start_date <= login_day <= streak.end_date for streak in streaks):
+            return
+        before = next((streak for streak in streaks if streak.end_date == login_day - timedelta(days=1)), None)
+        after = next((streak for streak in streaks if streak.start_date == login_day + timedelta(days=1)), None)
+
+        if before is not None and after is not None:
+            # Free after's end_date for before under the unique key first.
+            after.delete()
+            before.end_date = after.end_date
+            before.num_date += after.num_date + 1
+            before.save(update_fields=['end_date', 'num_date'])
+        elif before is not None:
+            before.end_date = login_day
+            before.num_date += 1
+            before.save(update_fields=['end_date', 'num_date'])
+        elif after is not None:
+            after.start_date = login_day
+            after.num_date += 1
+            after.save(update_fields=['start_date', 'num_date'])
+        else:
+            try:
+                with transaction.atomic():
+                    LoginHistory.objects.create(user_id=user_id, start_date=login_day, end_date=login_day)
+            except IntegrityError:
+                # A concurrent write recorded the same day.
+                pass
+
+
+def bulk_update_login_history(user_days, chunk_size=500):
+    """
+    Apply many ``(user_id, login_day)`` pairs with a few statements per day
+    and chunk of users instead of a few statements per login.
+    """
+    users_by_day = {}
+    for user_id, login_day in user_days:
+        users_by_day.setdefault(login_day, set()).add(user_id)
+
+    today = timezone.now().date()
+    for login_day in sorted(users_by_day):
+        user_ids = sorted(users_by_day[login_day])
+        for i in range(0, len(user_ids), chunk_size):
+            chunk = user_ids[i:i + chunk_size]
+            if login_day < today:
+                # Users with a streak past login_day need the merging path.
+                late = set(LoginHistory.objects.filter(
+                    user_id__in=chunk, end_date__gt=login_day
+                ).values_list('user_id', flat=True))
+                for user_id in late:
+                    apply_late_login(user_id, login_day)
+                chunk = [user_id for user_id in chunk if user_id not in late]
+            LoginHistory.objects.filter(
+                user_id__in=chunk,
+                end_date=login_day - timedelta(days=1)
+            ).update(end_date=login_day, num_date=F('num_date') + 1)
+            existing = set(LoginHistory.objects.filter(
+                user_id__in=chunk, end_date=login_day
+            ).values_list('user_id', flat=True))
+            new_rows = [
+                LoginHistory(user_id=user_id, start_date=login_day, end_date=login_day)
+                for user_id in chunk if user_id not in existing
+            ]
+            try:
+                with transaction.atomic():
+                    LoginHistory.objects.bulk_create(new_rows)
+            except IntegrityError:
+                # Raced with a direct write, fall back to one user at a time.
+                for row in new_rows:
+                    create_or_update_login_history(row.user_id, login_day)
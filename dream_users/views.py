@@ -1,7 +1,9 @@
 import logging
 
+from django.conf import settings
 from django.contrib.auth import authenticate
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import IntegrityError, transaction
 from django.shortcuts import render
 
 from rest_framework import permissions
@@ -9,13 +11,13 @@ from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from core import db_router, outbox
 from core.https import HttpSixcentResponseRedirect, SIXCENTS_PROTOCOL
+from dream_users import login_activity
 from dream_users import models as user_models
 from dream_users import serializers as user_sers
 from dream_users import utils as user_utils
-from dream_users.tasks import (
-    send_forgot_password_email, send_register_confirm_email,
-)
+from dream_users.tasks import EMAIL_FORGOT_PASSWORD, EMAIL_REGISTER_CONFIRM, send_user_email
 
 _logger = logging.getLogger(__name__)
 
@@ -36,15 +38,16 @@ class LoginEmailAPI(APIView):
             _logger.error('Incorrect email: {} or password: ******'.format(email))
             return Response('Incorrect email or password', status=status.HTTP_401_UNAUTHORIZED)
 
-        token = user_models.Token.objects.create(user=user)
+        access_token, expired_time = user_utils.issue_access_token(
+            user, validator.validated_data.get('device_id'))
         # user.user_type = user_utils.get_user_type(user.id)
         data = {
-            'access_token': token.key,
-            'expired_time': user_utils.get_expired_time(token),
+            'access_token': access_token,
+            'expired_time': expired_time,
             'user': user
         }
 
-        user_utils.create_or_update_login_history(user.id)
+        login_activity.record(user.id)
         serializer = user_sers.TokenSerializer(data)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -90,24 +93,24 @@ class LoginFacebookAPI(APIView):
             profiles = user_utils.get_facebook_profile(fb_access_token)
             fb_id = profiles['id']
             user_name = profiles['name']
+        except user_utils.SocialProfileUnavailable:
+            return Response('Facebook is unavailable', status=status.HTTP_503_SERVICE_UNAVAILABLE)
         except Exception:
             return Response('Incorrect facebook id', status=status.HTTP_401_UNAUTHORIZED)
 
-        user, created = user_models.User.objects.get_or_create(
-            facebook_id=fb_id,
-            defaults={'username': user_name}
-        )
+        user = user_utils.get_or_create_facebook_user(fb_id, user_name)
 
-        token = user_models.Token.objects.create(user=user)
+        access_token, expired_time = user_utils.issue_access_token(
+            user, validator.validated_data.get('device_id'))
         # user.user_type = user_utils.get_user_type(user.id)
 
         data = {
-            'access_token': token.key,
-            'expired_time': user_utils.get_expired_time(token),
+            'access_token': access_token,
+            'expired_time': expired_time,
             'user': user
         }
 
-        user_utils.create_or_update_login_history(user.id)
+        login_activity.record(user.id)
         serializer = user_sers.TokenSerializer(data)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -127,9 +130,13 @@ class RegisterEmailAPI(APIView):
         else:
             user = user_models.User(email=email, is_active=False)
             user.set_password(password)
-            user.save()
-
-        send_register_confirm_email.delay(email)
+            try:
+                with transaction.atomic():
+                    user.save()
+                    outbox.enqueue(send_user_email, user.id, EMAIL_REGISTER_CONFIRM)
+            except IntegrityError:
+                # The existence check may have read a lagging replica.
+                return Response('Email already exists', status=status.HTTP_409_CONFLICT)
 
         serializer = user_sers.UserSerializer(user)
         return Response(serializer.data, status=status.HTTP_200_OK)
@@ -138,7 +145,7 @@ class RegisterEmailAPI(APIView):
 class LogoutAPI(APIView):
 
     def post(self, request, format=None):
-        user_models.Token.objects.filter(key=request.auth.key).delete()
+        user_utils.revoke_access_token(request.auth)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -180,10 +187,20 @@ class ForgotPasswordAPI(APIView):
             return Response(validator.errors, status=status.HTTP_400_BAD_REQUEST)
 
         email = validator.validated_data['email']
-        if not user_models.User.objects.filter(email=email).exists():
+        users = user_models.User.objects.filter(email=email).values_list('id', flat=True)
+        user_id = users.first()
+        if user_id is None and settings.DATABASE_REPLICAS:
+            # The account may be too new to have reached the replica.
+            user_id = users.using(db_router.PRIMARY).first()
+        if user_id is None:
             _logger.error('Email already not exists')
             return Response('Email already not exists', status=status.HTTP_400_BAD_REQUEST)
 
-        send_forgot_password_email.delay(email)
+        if user_utils.claim_email_send(EMAIL_FORGOT_PASSWORD, email):
+            try:
+                outbox.enqueue(send_user_email, user_id, EMAIL_FORGOT_PASSWORD)
+            except Exception:
+                user_utils.release_email_send(EMAIL_FORGOT_PASSWORD, email)
+                raise
 
         return Response(status=status.HTTP_204_NO_CONTENT)